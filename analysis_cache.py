@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Incremental Analysis Cache
+==========================
+
+Persistent per-file cache for FirmwareAnalyzer results. Entries are keyed
+by path relative to the analyzed tree and validated against the file's
+size, mtime and SHA-256:
+
+- size and mtime unchanged: cached results are used without opening the file
+- size or mtime changed: the file is re-hashed; if the content is the same
+  the results are kept, otherwise they are dropped and recomputed
+
+The cache is stored as JSON next to the tree and evicts least recently used
+entries once its serialized size exceeds max_bytes.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+def file_digest(path):
+    """SHA-256 of a file's content (or of a symlink's target)"""
+    digest = hashlib.sha256()
+    if os.path.islink(path):
+        digest.update(os.readlink(path).encode())
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """On-disk cache of per-file analysis results"""
+
+    def __init__(self, cache_path, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "rehashed": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Load the cache file, ignoring it if missing or from another version"""
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == CACHE_VERSION:
+            self.entries = OrderedDict(data.get("entries", {}))
+
+    def save(self):
+        """Evict down to max_bytes and write the cache atomically"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._evict()
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+
+    def _evict(self):
+        sizes = {key: len(json.dumps(entry)) for key, entry in self.entries.items()}
+        total = sum(sizes.values())
+        while self.entries and total > self.max_bytes:
+            key, _ = self.entries.popitem(last=False)
+            total -= sizes[key]
+            self.stats["evicted"] += 1
+
+    def _entry(self, root, rel_path, st=None):
+        """Validated cache entry for a file, creating or resetting it as needed"""
+        full_path = os.path.join(root, rel_path)
+        if st is None:
+            st = os.lstat(full_path)
+        entry = self.entries.get(rel_path)
+
+        if entry is None or entry["size"] != st.st_size or entry["mtime"] != st.st_mtime_ns:
+            digest = file_digest(full_path)
+            if entry is not None and entry["sha256"] == digest:
+                self.stats["rehashed"] += 1
+                entry.update(size=st.st_size, mtime=st.st_mtime_ns)
+            else:
+                entry = {"size": st.st_size, "mtime": st.st_mtime_ns,
+                         "sha256": digest, "results": {}}
+            self.entries[rel_path] = entry
+            self._dirty = True
+
+        self.entries.move_to_end(rel_path)
+        return entry
+
+    def get_or_compute(self, root, rel_path, name, compute, st=None):
+        """Return cached result name for rel_path, computing it on a miss
+
+        compute is called with the full path and must return a
+        JSON-serializable value. st may carry an lstat result (or any object
+        with st_size/st_mtime_ns) already known to the caller.
+        """
+        with self._lock:
+            results = self._entry(root, rel_path, st)["results"]
+            if name in results:
+                self.stats["hits"] += 1
+                return results[name]
+
+        value = compute(os.path.join(root, rel_path))
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self._entry(root, rel_path, st)["results"][name] = value
+            self._dirty = True
+        return value
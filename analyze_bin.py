@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import struct
 import os
+from firmware_image import FirmwareImage
+from entropy_map import shannon_entropy
+from string_extractor import iter_strings
 
 def analyze_binary(filename):
     print(f"Analyzing {filename}...")
@@ -9,8 +12,11 @@ def analyze_binary(filename):
         print(f"File {filename} not found!")
         return
     
-    with open(filename, 'rb') as f:
-        data = f.read()
+    with FirmwareImage(filename) as image:
+        _analyze_image(image)
+
+def _analyze_image(image):
+    data = image.view
     
     print(f"File size: {len(data)} bytes ({len(data) / (1024*1024):.2f} MB)")
     
@@ -24,7 +30,7 @@ def analyze_binary(filename):
     # Check for common file signatures
     print("\nFile signature analysis:")
     if len(data) >= 4:
-        header = data[:4]
+        header = image.bytes(0, 4)
         if header == b'\x7fELF':
             print("- ELF executable/library")
         elif header[:2] == b'MZ':
@@ -44,41 +50,25 @@ def analyze_binary(filename):
         else:
             print(f"- Unknown format, header: {header.hex()}")
     
-    # Look for readable strings
+    # Look for readable strings (ASCII and UTF-16LE) across the whole file
     strings = []
-    current_string = b''
-    for byte in data[:1024]:  # Check first 1KB for strings
-        if 32 <= byte <= 126:  # Printable ASCII
-            current_string += bytes([byte])
-        else:
-            if len(current_string) >= 4:
-                try:
-                    strings.append(current_string.decode('ascii'))
-                except:
-                    pass
-            current_string = b''
+    total_strings = 0
+    for offset, encoding, text in iter_strings(data, min_length=4):
+        total_strings += 1
+        if len(strings) < 10:  # Show first 10
+            strings.append((offset, encoding, text))
     
     if strings:
-        print(f"\nFound {len(strings)} readable strings in first 1KB:")
-        for s in strings[:10]:  # Show first 10
-            print(f"  '{s}'")
+        print(f"\nFound {total_strings} readable strings:")
+        for offset, encoding, text in strings:
+            print(f"  0x{offset:08x} [{encoding}] '{text}'")
     else:
-        print("\nNo readable strings found in first 1KB")
+        print("\nNo readable strings found")
     
     # Check entropy (randomness) of the data
-    byte_counts = [0] * 256
-    for byte in data[:10000]:  # Sample first 10KB
-        byte_counts[byte] += 1
-    
-    entropy = 0
-    total = sum(byte_counts)
-    if total > 0:
-        for count in byte_counts:
-            if count > 0:
-                p = count / total
-                entropy -= p * (p.bit_length() - 1) if p > 0 else 0
+    entropy = shannon_entropy(data)
     
-    print(f"\nEntropy (first 10KB): {entropy:.2f} (0=ordered, 8=random)")
+    print(f"\nEntropy (whole file): {entropy:.2f} (0=ordered, 8=random)")
     if entropy > 7:
         print("- High entropy: possibly encrypted/compressed data")
     elif entropy < 2:
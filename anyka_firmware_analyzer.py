@@ -6,16 +6,23 @@ A60.BIN Firmware Reverse Engineering Analysis
 This script analyzes the a60.bin firmware file for ANYKA A60 series chips.
 """
 
-import struct
-import os
+from firmware_image import FirmwareImage
+from string_extractor import iter_strings
+from entropy_map import shannon_entropy, entropy_map, print_regions
+from elf_parser import ElfFile, ElfError
+from signature_scanner import scan_signatures, SIGNATURES, SECTION_MARKERS, EMBEDDED_IMAGES
 
 def analyze_anyka_firmware(filename):
     print("=" * 60)
     print("ANYKA A60 FIRMWARE REVERSE ENGINEERING REPORT")
     print("=" * 60)
     
-    with open(filename, 'rb') as f:
-        data = f.read()
+    # Every analysis step shares one mmap-backed image; slices are views
+    with FirmwareImage(filename) as image:
+        _analyze_image(image, filename)
+
+def _analyze_image(image, filename):
+    data = image.view
     
     print(f"\n📁 FILE INFORMATION:")
     print(f"   File: {filename}")
@@ -30,67 +37,56 @@ def analyze_anyka_firmware(filename):
     
     # Header analysis
     print(f"\n📋 HEADER STRUCTURE:")
-    magic = struct.unpack('<I', data[0:4])[0]
+    magic = image.unpack_from('<I', 0)[0]
     print(f"   Magic Number: 0x{magic:08x}")
-    print(f"   Firmware ID: {data[4:12].decode('ascii', errors='ignore')}")
+    print(f"   Firmware ID: {image.bytes(4, 8).decode('ascii', errors='ignore')}")
     print(f"   Version Flag: {data[12:16].hex()}")
     
     # Try to parse more header fields
-    header_fields = struct.unpack('<IIIIIIII', data[16:48])
+    header_fields = image.unpack_from('<IIIIIIII', 16)
     print(f"   Header Fields:")
     for i, field in enumerate(header_fields):
         print(f"     Field {i}: 0x{field:08x} ({field})")
     
     print(f"\n🧩 FIRMWARE SECTIONS:")
     
+    # One pass over the image finds every known magic
+    signatures = scan_signatures(data)
+    found = signatures.by_name()
+    
     # Look for ELF sections (embedded executables)
-    elf_positions = []
-    start = 0
-    while True:
-        pos = data.find(b'\x7fELF', start)
-        if pos == -1:
-            break
-        elf_positions.append(pos)
-        start = pos + 1
+    elf_positions = found.get("elf", [])
     
     if elf_positions:
         print(f"   ELF Executables found at:")
         for i, pos in enumerate(elf_positions):
             print(f"     ELF #{i+1}: offset 0x{pos:06x}")
-            # Try to get ELF info
-            if pos + 16 < len(data):
-                elf_header = data[pos:pos+16]
-                if len(elf_header) >= 16:
-                    arch = elf_header[4]
-                    endian = elf_header[5]
-                    arch_name = "32-bit" if arch == 1 else "64-bit" if arch == 2 else "unknown"
-                    endian_name = "little" if endian == 1 else "big" if endian == 2 else "unknown"
-                    print(f"       Architecture: {arch_name}, Endian: {endian_name}")
+            # Parse the header in place; stray magics fail validation
+            try:
+                elf = ElfFile(data, pos)
+            except ElfError as e:
+                print(f"       Not an ELF image ({e})")
+                continue
+            truncated = " (truncated)" if elf.truncated else ""
+            print(f"       {elf.describe()}, {elf.extent} bytes{truncated}")
+            if elf.needed:
+                print(f"       Needs: {', '.join(elf.needed)}")
+            elf.close()
+    
+    # Embedded filesystems, boot images and compressed streams
+    print(f"\n   Embedded images:")
+    for name in EMBEDDED_IMAGES:
+        positions = found.get(name, [])
+        if positions:
+            print(f"     {SIGNATURES[name][1]}: {len(positions)} occurrence(s) at {[hex(p) for p in positions[:3]]}")
     
     # Look for common firmware sections
     print(f"\n   Other sections:")
-    sections = {
-        b'BOOT': 'Bootloader',
-        b'KERN': 'Kernel',
-        b'ROOT': 'Root filesystem',
-        b'DATA': 'Data section',
-        b'UIMG': 'U-Boot image'
-    }
-    
-    for marker, description in sections.items():
-        positions = []
-        start = 0
-        while True:
-            pos = data.find(marker, start)
-            if pos == -1:
-                break
-            positions.append(pos)
-            start = pos + 1
-            if len(positions) > 5:
-                break
+    for name in SECTION_MARKERS:
+        positions = found.get(name, [])
         
         if positions:
-            print(f"     {description}: {len(positions)} occurrence(s) at {[hex(p) for p in positions[:3]]}")
+            print(f"     {SIGNATURES[name][1]}: {len(positions)} occurrence(s) at {[hex(p) for p in positions[:3]]}")
     
     print(f"\n📝 STRINGS ANALYSIS:")
     strings = extract_strings(data, min_length=4, max_strings=20)
@@ -100,8 +96,8 @@ def analyze_anyka_firmware(filename):
             print(f"     '{s}'")
     
     print(f"\n🔐 SECURITY ANALYSIS:")
-    entropy = calculate_entropy(data[:10000])
-    print(f"   Entropy (first 10KB): {entropy:.2f}/8.0")
+    entropy = calculate_entropy(data)
+    print(f"   Entropy (whole image): {entropy:.2f}/8.0")
     if entropy > 7.5:
         print(f"   Status: High entropy - likely encrypted or compressed")
     elif entropy > 6.0:
@@ -111,8 +107,14 @@ def analyze_anyka_firmware(filename):
     else:
         print(f"   Status: Low entropy - highly structured or repetitive data")
     
+    # Entropy map over the whole image highlights partition boundaries
+    entropy_regions = entropy_map(data, window=4096, min_size=16384)["regions"]
+    print(f"   Entropy regions ({len(entropy_regions)}):")
+    print_regions(entropy_regions)
+    
     print(f"\n🛠️  REVERSE ENGINEERING NEXT STEPS:")
     print(f"   1. Extract ELF executables from offsets: {[hex(p) for p in elf_positions]}")
+    print(f"      (elf_parser.py {filename} <offset> lists their segments and libraries)")
     print(f"   2. Use binwalk to extract embedded files: 'binwalk -e {filename}'")
     print(f"   3. Analyze with firmware analysis tools:")
     print(f"      - firmware-mod-kit (FMK)")
@@ -130,19 +132,10 @@ def analyze_anyka_firmware(filename):
 def extract_strings(data, min_length=4, max_strings=50):
     """Extract printable ASCII strings from binary data"""
     strings = []
-    current_string = b''
-    
-    for byte in data[:5000]:  # Check first 5KB
-        if 32 <= byte <= 126:  # Printable ASCII
-            current_string += bytes([byte])
-        else:
-            if len(current_string) >= min_length:
-                try:
-                    strings.append(current_string.decode('ascii'))
-                except:
-                    pass
-            current_string = b''
-            
+    
+    # Streams over the whole image; stops as soon as enough are found
+    for offset, encoding, text in iter_strings(data, min_length, encodings=("ascii",)):
+        strings.append(text)
         if len(strings) >= max_strings:
             break
     
@@ -150,21 +143,7 @@ def extract_strings(data, min_length=4, max_strings=50):
 
 def calculate_entropy(data):
     """Calculate Shannon entropy of data"""
-    if not data:
-        return 0
-    
-    byte_counts = [0] * 256
-    for byte in data:
-        byte_counts[byte] += 1
-    
-    entropy = 0
-    total = len(data)
-    for count in byte_counts:
-        if count > 0:
-            p = count / total
-            entropy -= p * (p.bit_length() - 1)
-    
-    return entropy
+    return shannon_entropy(data)
 
 if __name__ == "__main__":
     analyze_anyka_firmware("a60.bin")
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Artifact Store
+================================
+
+Keeps extracted trees, repacked squashfs images and final firmware images
+between builds. Artifacts are named after a build key, a hash of
+everything that determines them (input image, profile, injected files),
+so a repeat build with the same inputs is a cache hit.
+
+Artifact data is split into fixed 64K chunks stored once under their
+SHA-256; identical chunks are shared between artifacts. Firmware
+variants only differ in a few rootfs chunks and share the rest. Fixed
+chunks line up because the AK3760 partitions sit at fixed offsets. The
+store evicts least recently used artifacts, and the chunks only they
+referenced, once it grows past max_bytes. Chunks are hashed and written
+without locking (they are content-addressed, so concurrent writes of
+the same chunk are harmless); only index updates and eviction hold the
+file lock, so several builder processes can share one store.
+
+Build keys include a digest of the toolkit modules that produce the
+artifacts, so changing the writer or patcher invalidates older builds.
+
+Layout:
+    <root>/chunks/ab/ab12...     chunk data
+    <root>/artifacts/<name>.json artifact manifests
+    <root>/index.json            last use and chunk list per artifact
+
+Usage: artifact_store.py [store_dir] [ls|gc]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+from analysis_cache import file_digest
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+STORE_VERSION = 1
+
+_NAME = re.compile(r"^[A-Za-z0-9._-]+$")
+
+# Modules whose code shapes extracted trees, rootfs and firmware images
+TOOLKIT_MODULES = ("artifact_store", "config_document", "en818_modifier", "firmware_layout",
+                   "firmware_modifier", "fleet_builder", "resource_bin", "squashfs_reader",
+                   "squashfs_writer", "startup_composer", "workspace")
+_toolkit_digest = None
+
+
+def toolkit_digest():
+    """Hash of the toolkit modules' source, computed once per process"""
+    global _toolkit_digest
+    if _toolkit_digest is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in TOOLKIT_MODULES:
+            path = os.path.join(directory, f"{module}.py")
+            digest.update(f"{module}\0{file_digest(path) if os.path.exists(path) else ''}\n".encode())
+        _toolkit_digest = digest.hexdigest()
+    return _toolkit_digest
+
+
+def build_key(image_path, profile=None, injected_files=(), stage=""):
+    """Hash of a build's inputs: toolkit code, image content, profile and injected files
+
+    injected_files are paths of files copied into the tree (custom
+    binaries, scripts); their content is part of the key, their path
+    only as given.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{STORE_VERSION}\0{toolkit_digest()}\0{stage}\0".encode())
+    digest.update(file_digest(image_path).encode())
+    digest.update(json.dumps(profile, sort_keys=True, separators=(",", ":")).encode())
+    for path in sorted(injected_files):
+        digest.update(f"\0{path}\0{file_digest(path)}".encode())
+    return digest.hexdigest()
+
+
+def derive_key(key, data):
+    """Key of a build derived from key by JSON-serializable extra inputs"""
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{key}\0{payload}".encode()).hexdigest()
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class ArtifactStore:
+    """Chunked, deduplicated, size-limited store of build artifacts"""
+
+    def __init__(self, root="_artifacts", max_bytes=DEFAULT_MAX_BYTES, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.stats = {"hits": 0, "misses": 0, "chunks_written": 0, "chunks_shared": 0,
+                      "evicted": 0}
+        os.makedirs(f"{root}/chunks", exist_ok=True)
+        os.makedirs(f"{root}/artifacts", exist_ok=True)
+
+    # Index and locking
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the index across processes"""
+        with open(f"{self.root}/.lock", 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            with open(f"{self.root}/index.json", 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if not index or index.get("version") != STORE_VERSION:
+            index = {"version": STORE_VERSION, "artifacts": {}, "chunks": {}}
+        return index
+
+    def _save_index(self, index):
+        _atomic_write(f"{self.root}/index.json", json.dumps(index).encode())
+
+    def _manifest_path(self, name):
+        if not _NAME.match(name):
+            raise ValueError(f"Invalid artifact name: {name}")
+        return f"{self.root}/artifacts/{name}.json"
+
+    def _chunk_path(self, digest):
+        return f"{self.root}/chunks/{digest[:2]}/{digest}"
+
+    # Chunks
+
+    def _put_chunk(self, data):
+        """Write a chunk unless present; needs no lock since chunks are content-addressed"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            self.stats["chunks_shared"] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _atomic_write(path, data)
+            self.stats["chunks_written"] += 1
+        return digest
+
+    def _put_stream(self, path, sources):
+        """Chunk a file; returns (chunk digests, size, sha256)
+
+        sources records where each chunk came from, (path, offset, size),
+        so a chunk evicted before the commit can be written again.
+        """
+        chunks, size = [], 0
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(self.chunk_size), b''):
+                chunk = self._put_chunk(data)
+                chunks.append(chunk)
+                sources.setdefault(chunk, (path, size, len(data)))
+                digest.update(data)
+                size += len(data)
+        return chunks, size, digest.hexdigest()
+
+    def _write_chunks(self, chunks, out):
+        for digest in chunks:
+            with open(self._chunk_path(digest), 'rb') as f:
+                out.write(f.read())
+
+    # Artifacts
+
+    def _commit(self, name, manifest, sources):
+        """Register an artifact whose chunks are written; takes the index lock"""
+        chunks = manifest["chunks"] if manifest["kind"] == "file" else \
+            [c for entry in manifest["entries"] for c in entry.get("chunks", ())]
+        manifest["created"] = time.time()
+        with self._locked():
+            index = self._load_index()
+            for digest in set(chunks):
+                if not os.path.exists(self._chunk_path(digest)):
+                    # Evicted by another process since it was written
+                    path, offset, size = sources[digest]
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        if self._put_chunk(f.read(size)) != digest:
+                            raise ValueError(f"{path} changed while it was being stored")
+                index["chunks"][digest] = sources[digest][2]
+            _atomic_write(self._manifest_path(name), json.dumps(manifest).encode())
+            index["artifacts"][name] = {"last_used": time.time(), "chunks": sorted(set(chunks))}
+            self._evict(index, keep=name)
+            self._save_index(index)
+
+    def has(self, name):
+        return os.path.exists(self._manifest_path(name))
+
+    def _load_manifest(self, name):
+        try:
+            with open(self._manifest_path(name), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _touch(self, name):
+        with self._locked():
+            index = self._load_index()
+            if name in index["artifacts"]:
+                index["artifacts"][name]["last_used"] = time.time()
+                self._save_index(index)
+
+    def put_file(self, name, path, meta=None):
+        """Store a file under name; returns its manifest"""
+        sources = {}
+        chunks, size, sha256 = self._put_stream(path, sources)
+        manifest = {"name": name, "kind": "file", "size": size, "sha256": sha256,
+                    "mode": os.stat(path).st_mode & 0o7777, "chunks": chunks,
+                    "meta": meta or {}}
+        self._commit(name, manifest, sources)
+        return manifest
+
+    def get_file(self, name, dest):
+        """Restore artifact name to dest; returns its manifest, or None on a miss"""
+        manifest = self._load_manifest(name)
+        if manifest is None or manifest["kind"] != "file":
+            self.stats["misses"] += 1
+            return None
+
+        directory = os.path.dirname(dest) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.restore.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                self._write_chunks(manifest["chunks"], out)
+            if file_digest(tmp_path) != manifest["sha256"]:
+                raise ValueError(f"Artifact {name} is corrupt")
+            os.chmod(tmp_path, manifest["mode"])
+            os.replace(tmp_path, dest)
+        except (OSError, ValueError):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            self.stats["misses"] += 1
+            return None
+
+        self._touch(name)
+        self.stats["hits"] += 1
+        return manifest
+
+    def put_tree(self, name, root):
+        """Store a directory tree (files, directories, symlinks) under name"""
+        entries, sources = [], {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, root)
+            for entry_name in sorted(dirnames + filenames):
+                path = os.path.join(dirpath, entry_name)
+                rel_path = os.path.normpath(os.path.join(rel_dir, entry_name))
+                st = os.lstat(path)
+                entry = {"path": rel_path, "mode": st.st_mode & 0o7777}
+                if os.path.islink(path):
+                    entry.update(type="symlink", target=os.readlink(path))
+                elif os.path.isdir(path):
+                    entry.update(type="dir")
+                else:
+                    chunks, size, sha256 = self._put_stream(path, sources)
+                    entry.update(type="file", size=size, sha256=sha256, chunks=chunks)
+                entries.append(entry)
+        manifest = {"name": name, "kind": "tree", "entries": entries}
+        self._commit(name, manifest, sources)
+        return manifest
+
+    def get_tree(self, name, dest):
+        """Materialize tree artifact name at dest (which must not exist)"""
+        manifest = self._load_manifest(name)
+        if manifest is None or manifest["kind"] != "tree" or os.path.exists(dest):
+            self.stats["misses"] += 1
+            return None
+
+        tmp_root = tempfile.mkdtemp(prefix='.restore.', dir=os.path.dirname(os.path.abspath(dest)))
+        try:
+            directories = []
+            for entry in manifest["entries"]:
+                path = os.path.join(tmp_root, entry["path"])
+                if entry["type"] == "dir":
+                    os.makedirs(path, exist_ok=True)
+                    directories.append((path, entry["mode"]))
+                elif entry["type"] == "symlink":
+                    os.symlink(entry["target"], path)
+                else:
+                    with open(path, 'wb') as out:
+                        self._write_chunks(entry["chunks"], out)
+                    os.chmod(path, entry["mode"])
+            for path, mode in reversed(directories):
+                os.chmod(path, mode)
+            os.rename(tmp_root, dest)
+        except OSError:
+            shutil.rmtree(tmp_root, ignore_errors=True)
+            self.stats["misses"] += 1
+            return None
+
+        self._touch(name)
+        self.stats["hits"] += 1
+        return manifest
+
+    # Size limit
+
+    def _evict(self, index, keep=None):
+        """Drop least recently used artifacts until chunk data fits max_bytes"""
+        artifacts = index["artifacts"]
+        referenced = {}
+        for info in artifacts.values():
+            for digest in info["chunks"]:
+                referenced[digest] = referenced.get(digest, 0) + 1
+        total = sum(index["chunks"].get(digest, 0) for digest in referenced)
+
+        for name in sorted(artifacts, key=lambda n: artifacts[n]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            for digest in artifacts.pop(name)["chunks"]:
+                referenced[digest] -= 1
+                if referenced[digest] == 0:
+                    total -= index["chunks"].get(digest, 0)
+            try:
+                os.unlink(self._manifest_path(name))
+            except FileNotFoundError:
+                pass
+            self.stats["evicted"] += 1
+
+        # Chunks no artifact references any more
+        for digest in [d for d in index["chunks"] if referenced.get(d, 0) == 0]:
+            del index["chunks"][digest]
+            try:
+                os.unlink(self._chunk_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def gc(self):
+        with self._locked():
+            index = self._load_index()
+            self._evict(index)
+            self._save_index(index)
+
+    def usage(self):
+        """(artifact count, unique chunk bytes)"""
+        index = self._load_index()
+        return len(index["artifacts"]), sum(index["chunks"].values())
+
+    def list(self):
+        index = self._load_index()
+        return sorted(index["artifacts"].items(), key=lambda item: -item[1]["last_used"])
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else "_artifacts"
+    command = sys.argv[2] if len(sys.argv) > 2 else "ls"
+    store = ArtifactStore(root)
+    if command == "gc":
+        store.gc()
+    count, size = store.usage()
+    print(f"{count} artifacts, {size} bytes of unique chunks")
+    if command == "ls":
+        for name, info in store.list():
+            print(f"   {time.strftime('%Y-%m-%d %H:%M', time.localtime(info['last_used']))}  "
+                  f"{len(info['chunks']):>6} chunks  {name}")
+
+
+if __name__ == "__main__":
+    main()
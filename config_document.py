@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Device Configuration Document
+=============================
+
+In-memory model of usr/config.txt. The file is parsed once into its
+original lines (comments, blank lines and the obfuscated feature-flag block
+at the top are kept verbatim) plus an ordered key -> line index. Any number
+of updates can be applied in memory; commit() writes the document back once,
+atomically, and rollback() discards pending changes.
+"""
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+COMMENT_PREFIXES = ('#', ';')
+
+
+def _parse_key(line):
+    """Key of a key=value line, or None for comments, blanks and other text"""
+    if line.startswith(COMMENT_PREFIXES) or '=' not in line:
+        return None
+    return line.split('=', 1)[0]
+
+
+class ConfigDocument:
+    """Parsed config.txt with batched, atomic updates"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.index = OrderedDict()
+        self._original = []
+        self.load()
+
+    def load(self):
+        """(Re)read the file from disk, dropping uncommitted changes"""
+        with open(self.path, 'r') as f:
+            self._original = f.readlines()
+        self._reset(self._original)
+
+    def _reset(self, lines):
+        self.lines = list(lines)
+        self.index = OrderedDict()
+        for number, line in enumerate(self.lines):
+            key = _parse_key(line)
+            if key is not None:
+                self.index.setdefault(key, []).append(number)
+
+    @property
+    def dirty(self):
+        return self.lines != self._original
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, default=None):
+        """Current value of key (first occurrence)"""
+        if key not in self.index:
+            return default
+        return self.lines[self.index[key][0]].split('=', 1)[1].rstrip('\r\n')
+
+    def items(self):
+        return [(key, self.get(key)) for key in self.index]
+
+    def set(self, key, value):
+        """Set key=value in memory; returns 'modified', 'added' or 'unchanged'"""
+        new_line = f"{key}={value}\n"
+
+        if key in self.index:
+            numbers = self.index[key]
+            if all(self.lines[n] == new_line for n in numbers):
+                return "unchanged"
+            for n in numbers:
+                self.lines[n] = new_line
+            return "modified"
+
+        # Keep the last line terminated before appending
+        if self.lines and not self.lines[-1].endswith('\n'):
+            self.lines[-1] += '\n'
+        self.index[key] = [len(self.lines)]
+        self.lines.append(new_line)
+        return "added"
+
+    def update(self, modifications):
+        """Apply several updates; returns [(key, value, action), ...]"""
+        return [(key, value, self.set(key, value)) for key, value in modifications.items()]
+
+    def render(self):
+        return ''.join(self.lines)
+
+    def commit(self):
+        """Write pending changes once, atomically; returns True if written"""
+        if not self.dirty:
+            return False
+
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.config.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            shutil.copymode(self.path, tmp_path)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self._original = list(self.lines)
+        return True
+
+    def rollback(self):
+        """Discard changes made since the last load or commit"""
+        self._reset(self._original)
@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+ELF Parser
+==========
+
+In-process reader for the ELF binaries of the root filesystem and for
+ELF images carved out of the raw firmware (7900, 10EA00, ...). It is
+written for the AK3760's ELF32/ARM little-endian binaries but accepts
+either class and byte order.
+
+Every record layout is a struct.Struct compiled once per class and byte
+order. An ElfFile reads only the ELF header when it is created. Program
+headers, sections, dynamic entries, needed libraries and symbols are
+parsed from the underlying buffer (bytes, or a memoryview of a mapped
+file or image) or seekable file the first time they are used; a file is
+read range by range, never as a whole. Binaries stripped of their
+section headers still report needed libraries and dynamic symbols
+through the PT_DYNAMIC segment.
+
+Usage: elf_parser.py <file> [offset]
+       elf_parser.py [squashfs_root]      (dependency graph)
+"""
+
+import os
+import sys
+import struct
+
+from firmware_image import FirmwareImage
+from file_classifier import ELF_TYPES, ELF_MACHINES
+
+ELF_MAGIC = b"\x7fELF"
+IDENT_SIZE = 16
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+PF_X = 1
+PF_W = 2
+
+SHT_SYMTAB = 2
+SHT_DYNAMIC = 6
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_HASH = 4
+DT_STRTAB = 5
+DT_SYMTAB = 6
+DT_STRSZ = 10
+DT_SYMENT = 11
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+EM_ARM = 40
+EF_ARM_ABI_FLOAT_SOFT = 0x200
+EF_ARM_ABI_FLOAT_HARD = 0x400
+
+SEGMENT_TYPES = {0: "NULL", 1: "LOAD", 2: "DYNAMIC", 3: "INTERP", 4: "NOTE", 6: "PHDR",
+                 7: "TLS", 0x6474E550: "GNU_EH_FRAME", 0x6474E551: "GNU_STACK",
+                 0x6474E552: "GNU_RELRO", 0x70000001: "ARM_EXIDX"}
+SYMBOL_TYPES = {0: "notype", 1: "object", 2: "func", 3: "section", 4: "file", 6: "tls"}
+SYMBOL_BINDS = {0: "local", 1: "global", 2: "weak"}
+
+# Library directories searched for DT_NEEDED entries, in uClibc ld.so order
+LIBRARY_PATHS = ("lib", "usr/lib")
+
+
+class ElfError(ValueError):
+    pass
+
+
+class _Layouts:
+    """Record layouts of one ELF class and byte order"""
+
+    __slots__ = ("header", "segment", "section", "dynamic", "symbol", "hash")
+
+    def __init__(self, elf_class, endian):
+        if elf_class == ELFCLASS32:
+            self.header = struct.Struct(endian + "HHIIIIIHHHHHH")
+            self.segment = struct.Struct(endian + "IIIIIIII")
+            self.section = struct.Struct(endian + "IIIIIIIIII")
+            self.dynamic = struct.Struct(endian + "iI")
+            self.symbol = struct.Struct(endian + "IIIBBH")
+        else:
+            self.header = struct.Struct(endian + "HHIQQQIHHHHHH")
+            self.segment = struct.Struct(endian + "IIQQQQQQ")
+            self.section = struct.Struct(endian + "IIQQQQIIQQ")
+            self.dynamic = struct.Struct(endian + "qQ")
+            self.symbol = struct.Struct(endian + "IBBHQQ")
+        self.hash = struct.Struct(endian + "II")
+
+
+LAYOUTS = {(elf_class, data): _Layouts(elf_class, endian)
+           for elf_class in (ELFCLASS32, ELFCLASS64)
+           for data, endian in ((1, "<"), (2, ">"))}
+
+
+class Segment:
+    """Program header"""
+
+    __slots__ = ("type", "flags", "offset", "vaddr", "filesz", "memsz", "align")
+
+    def __init__(self, type, flags, offset, vaddr, filesz, memsz, align):
+        self.type = type
+        self.flags = flags
+        self.offset = offset
+        self.vaddr = vaddr
+        self.filesz = filesz
+        self.memsz = memsz
+        self.align = align
+
+    @property
+    def type_name(self):
+        return SEGMENT_TYPES.get(self.type, f"{self.type:#x}")
+
+
+class Section:
+    """Section header with its name resolved"""
+
+    __slots__ = ("name", "type", "flags", "addr", "offset", "size", "link", "info", "entsize")
+
+    def __init__(self, name, type, flags, addr, offset, size, link, info, entsize):
+        self.name = name
+        self.type = type
+        self.flags = flags
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.info = info
+        self.entsize = entsize
+
+
+class Symbol:
+    __slots__ = ("name", "value", "size", "type", "bind", "shndx")
+
+    def __init__(self, name, value, size, info, shndx):
+        self.name = name
+        self.value = value
+        self.size = size
+        self.type = SYMBOL_TYPES.get(info & 0xF, str(info & 0xF))
+        self.bind = SYMBOL_BINDS.get(info >> 4, str(info >> 4))
+        self.shndx = shndx
+
+    @property
+    def defined(self):
+        return self.shndx != 0
+
+
+class ElfFile:
+    """Lazily parsed ELF image starting at offset of a buffer or seekable binary file"""
+
+    def __init__(self, data, offset=0, name=None):
+        if hasattr(data, "read"):
+            self.stream, self.data = data, None
+            length = data.seek(0, os.SEEK_END)
+        else:
+            self.stream, self.data = None, memoryview(data)
+            length = len(self.data)
+        self.base = offset
+        self.name = name
+        self._image = None
+
+        available = length - offset
+        ident = bytes(self._read(offset, IDENT_SIZE)) if available >= IDENT_SIZE else b""
+        if ident[:4] != ELF_MAGIC:
+            raise ElfError("No ELF magic")
+        self.elf_class, self.byte_order, self.osabi = ident[4], ident[5], ident[7]
+        self.layouts = LAYOUTS.get((self.elf_class, self.byte_order))
+        if self.layouts is None:
+            raise ElfError(f"Invalid class {ident[4]} or byte order {ident[5]}")
+        if available < IDENT_SIZE + self.layouts.header.size:
+            raise ElfError("Truncated ELF header")
+
+        (self.type, self.machine, self.version, self.entry, self.phoff, self.shoff, self.flags,
+         self.ehsize, self.phentsize, self.phnum, self.shentsize, self.shnum,
+         self.shstrndx) = self.layouts.header.unpack(
+            self._read(offset + IDENT_SIZE, self.layouts.header.size))
+        if self.version != 1:
+            raise ElfError(f"Unknown ELF version {self.version}")
+        if self.phnum and self.phentsize != self.layouts.segment.size:
+            raise ElfError(f"Unexpected program header size {self.phentsize}")
+        if self.phoff + self.phnum * self.phentsize > available:
+            raise ElfError("Program headers beyond the end of the data")
+        self.available = available
+
+        self._segments = None
+        self._sections = None
+        self._dynamic = None
+        self._dynamic_strings = None
+        self._symbols = None
+        self._dynamic_symbols = None
+
+    @classmethod
+    def open(cls, path):
+        """ElfFile over a read-only mapping of path; close() releases it"""
+        image = FirmwareImage(path)
+        try:
+            elf = cls(image.view, 0, path)
+        except ElfError:
+            image.close()
+            raise
+        elf._image = image
+        return elf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Release the buffer; a file passed in stays open for its owner"""
+        if self.data is not None:
+            self.data.release()
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+    # Raw access
+
+    def _read(self, start, size):
+        """size bytes at a position of the underlying buffer or file"""
+        if self.stream is None:
+            return self.data[start:start + size]
+        self.stream.seek(start)
+        return self.stream.read(size)
+
+    def _bytes(self, offset, size):
+        """Bytes at a file offset, clipped to the available data"""
+        start = self.base + min(offset, self.available)
+        return bytes(self._read(start, max(0, min(size, self.available - offset))))
+
+    def _table(self, layout, offset, count):
+        """Unpacked records of a table, or as many as fit in the data"""
+        count = min(count, max(0, self.available - offset) // layout.size)
+        start = self.base + offset
+        return layout.iter_unpack(self._read(start, count * layout.size))
+
+    def file_offset(self, vaddr):
+        """File offset of a virtual address inside a loaded segment, or None"""
+        for segment in self.segments:
+            if segment.type == PT_LOAD and segment.vaddr <= vaddr < segment.vaddr + segment.filesz:
+                return segment.offset + vaddr - segment.vaddr
+        return None
+
+    # Headers
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            if self.elf_class == ELFCLASS32:
+                self._segments = [Segment(t, flags, offset, vaddr, filesz, memsz, align)
+                                  for t, offset, vaddr, _, filesz, memsz, flags, align
+                                  in self._table(self.layouts.segment, self.phoff, self.phnum)]
+            else:
+                self._segments = [Segment(t, flags, offset, vaddr, filesz, memsz, align)
+                                  for t, flags, offset, vaddr, _, filesz, memsz, align
+                                  in self._table(self.layouts.segment, self.phoff, self.phnum)]
+        return self._segments
+
+    @property
+    def sections(self):
+        """Section headers; empty when stripped or cut off (carved images)"""
+        if self._sections is None:
+            headers = []
+            if self.shnum and self.shentsize == self.layouts.section.size:
+                headers = list(self._table(self.layouts.section, self.shoff, self.shnum))
+            names = b""
+            if self.shstrndx < len(headers):
+                names = self._bytes(headers[self.shstrndx][4], headers[self.shstrndx][5])
+            self._sections = []
+            for name, t, flags, addr, offset, size, link, info, _, entsize in headers:
+                end = names.find(b"\0", name)
+                self._sections.append(Section(names[name:end if end >= 0 else None].decode("latin-1"),
+                                              t, flags, addr, offset, size, link, info, entsize))
+        return self._sections
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    @property
+    def interpreter(self):
+        for segment in self.segments:
+            if segment.type == PT_INTERP:
+                return self._bytes(segment.offset, segment.filesz).rstrip(b"\0").decode("latin-1")
+        return None
+
+    @property
+    def extent(self):
+        """Bytes the image covers from its start, for carving it out of a dump"""
+        end = IDENT_SIZE + self.layouts.header.size
+        end = max(end, self.phoff + self.phnum * self.phentsize)
+        if self.shnum:
+            end = max(end, self.shoff + self.shnum * self.shentsize)
+        for segment in self.segments:
+            end = max(end, segment.offset + segment.filesz)
+        for section in self.sections:
+            if section.type != SHT_NOBITS:
+                end = max(end, section.offset + section.size)
+        return end
+
+    @property
+    def truncated(self):
+        return self.extent > self.available
+
+    # Dynamic linking
+
+    @property
+    def dynamic(self):
+        """(tag, value) pairs of the dynamic table up to DT_NULL"""
+        if self._dynamic is None:
+            table = next(((s.offset, s.filesz) for s in self.segments if s.type == PT_DYNAMIC), None)
+            if table is None:
+                table = next(((s.offset, s.size) for s in self.sections if s.type == SHT_DYNAMIC), None)
+            self._dynamic = []
+            if table is not None:
+                layout = self.layouts.dynamic
+                for tag, value in self._table(layout, table[0], table[1] // layout.size):
+                    if tag == DT_NULL:
+                        break
+                    self._dynamic.append((tag, value))
+        return self._dynamic
+
+    def _dynamic_value(self, tag):
+        return next((value for t, value in self.dynamic if t == tag), None)
+
+    def _dynamic_string(self, offset):
+        if self._dynamic_strings is None:
+            self._dynamic_strings = b""
+            address, size = self._dynamic_value(DT_STRTAB), self._dynamic_value(DT_STRSZ)
+            if address is not None and size:
+                start = self.file_offset(address)
+                if start is not None:
+                    self._dynamic_strings = self._bytes(start, size)
+        end = self._dynamic_strings.find(b"\0", offset)
+        return self._dynamic_strings[offset:end if end >= 0 else None].decode("latin-1")
+
+    @property
+    def needed(self):
+        return [self._dynamic_string(value) for tag, value in self.dynamic if tag == DT_NEEDED]
+
+    @property
+    def soname(self):
+        value = self._dynamic_value(DT_SONAME)
+        return None if value is None else self._dynamic_string(value)
+
+    @property
+    def search_paths(self):
+        """DT_RUNPATH, or DT_RPATH, directories"""
+        value = self._dynamic_value(DT_RUNPATH)
+        if value is None:
+            value = self._dynamic_value(DT_RPATH)
+        return [] if value is None else [p for p in self._dynamic_string(value).split(":") if p]
+
+    # Symbols
+
+    def _read_symbols(self, offset, count, strings):
+        symbols = []
+        layout = self.layouts.symbol
+        for fields in self._table(layout, offset, count):
+            if self.elf_class == ELFCLASS32:
+                name, value, size, info, _, shndx = fields
+            else:
+                name, info, _, shndx, value, size = fields
+            end = strings.find(b"\0", name)
+            symbols.append(Symbol(strings[name:end if end >= 0 else None].decode("latin-1"),
+                                  value, size, info, shndx))
+        return symbols
+
+    def _section_symbols(self, section_type):
+        for section in self.sections:
+            if section.type == section_type and section.entsize == self.layouts.symbol.size:
+                strings = b""
+                if section.link < len(self.sections):
+                    link = self.sections[section.link]
+                    strings = self._bytes(link.offset, link.size)
+                return self._read_symbols(section.offset, section.size // section.entsize, strings)
+        return None
+
+    @property
+    def dynamic_symbols(self):
+        """.dynsym, or the table DT_SYMTAB points at when sections are stripped"""
+        if self._dynamic_symbols is None:
+            symbols = self._section_symbols(SHT_DYNSYM)
+            if symbols is None:
+                symbols = []
+                address = self._dynamic_value(DT_SYMTAB)
+                start = None if address is None else self.file_offset(address)
+                if start is not None:
+                    symbols = self._read_symbols(start, self._dynamic_symbol_count(start),
+                                                 self._dynamic_strings_loaded())
+            self._dynamic_symbols = symbols
+        return self._dynamic_symbols
+
+    def _dynamic_strings_loaded(self):
+        self._dynamic_string(0)
+        return self._dynamic_strings
+
+    def _dynamic_symbol_count(self, start):
+        """Entries of DT_SYMTAB: nchain of DT_HASH, else the gap up to DT_STRTAB"""
+        address = self._dynamic_value(DT_HASH)
+        offset = None if address is None else self.file_offset(address)
+        if offset is not None and offset + self.layouts.hash.size <= self.available:
+            return self.layouts.hash.unpack(self._read(self.base + offset, self.layouts.hash.size))[1]
+        strtab = self._dynamic_value(DT_STRTAB)
+        strtab_offset = None if strtab is None else self.file_offset(strtab)
+        if strtab_offset is not None and strtab_offset > start:
+            return (strtab_offset - start) // (self._dynamic_value(DT_SYMENT) or self.layouts.symbol.size)
+        return 0
+
+    @property
+    def symbols(self):
+        """.symtab when present, otherwise the dynamic symbols"""
+        if self._symbols is None:
+            symbols = self._section_symbols(SHT_SYMTAB)
+            self._symbols = symbols if symbols is not None else self.dynamic_symbols
+        return self._symbols
+
+    @property
+    def imports(self):
+        return sorted({s.name for s in self.dynamic_symbols if s.name and not s.defined})
+
+    @property
+    def exports(self):
+        return sorted({s.name for s in self.dynamic_symbols
+                       if s.name and s.defined and s.bind in ("global", "weak")})
+
+    # Summary
+
+    def segment_sizes(self):
+        """text/data/bss bytes from the loadable segments"""
+        sizes = {"text": 0, "data": 0, "bss": 0}
+        for segment in self.segments:
+            if segment.type == PT_LOAD:
+                sizes["data" if segment.flags & PF_W else "text"] += segment.filesz
+                sizes["bss"] += max(0, segment.memsz - segment.filesz)
+        return sizes
+
+    def describe(self):
+        parts = [f"ELF{32 if self.elf_class == ELFCLASS32 else 64} "
+                 f"{'LSB' if self.byte_order == 1 else 'MSB'} "
+                 f"{ELF_TYPES.get(self.type, 'unknown type')}",
+                 ELF_MACHINES.get(self.machine, f"machine {self.machine}")]
+        if self.machine == EM_ARM:
+            if self.flags >> 24:
+                parts.append(f"EABI{self.flags >> 24}")
+            if self.flags & EF_ARM_ABI_FLOAT_HARD:
+                parts.append("hard-float")
+            elif self.flags & EF_ARM_ABI_FLOAT_SOFT:
+                parts.append("soft-float")
+        parts.append("dynamically linked" if self.dynamic else "statically linked")
+        return ", ".join(parts)
+
+    def summary(self):
+        """JSON-friendly digest for analysis reports"""
+        return {
+            "description": self.describe(),
+            "class": 32 if self.elf_class == ELFCLASS32 else 64,
+            "machine": ELF_MACHINES.get(self.machine, str(self.machine)),
+            "type": ELF_TYPES.get(self.type, str(self.type)),
+            "entry": self.entry,
+            "size": self.extent,
+            "truncated": self.truncated,
+            "segments": self.segment_sizes(),
+            "sections": len(self.sections),
+            "interpreter": self.interpreter,
+            "soname": self.soname,
+            "needed": self.needed,
+            "search_paths": self.search_paths,
+            "symbols": len(self.symbols),
+            "imports": len(self.imports),
+            "exports": len(self.exports),
+        }
+
+
+def is_elf(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(4) == ELF_MAGIC
+    except OSError:
+        return False
+
+
+def elf_summary(path):
+    """summary() of an ELF file, or None when path is not a valid ELF"""
+    if not is_elf(path):
+        return None
+    try:
+        with ElfFile.open(path) as elf:
+            return elf.summary()
+    except ElfError:
+        return None
+
+
+def carved_elves(data, positions):
+    """(offset, summary) for each signature hit that parses as an ELF header"""
+    found = []
+    for offset in positions:
+        try:
+            elf = ElfFile(data, offset)
+            found.append((offset, elf.summary()))
+        except ElfError:
+            continue
+    return found
+
+
+def dependency_graph(binaries):
+    """Resolve DT_NEEDED entries between rootfs binaries
+
+    binaries maps a path relative to the root to its summary(). Libraries
+    are found by SONAME or file name in the binary's run path and
+    LIBRARY_PATHS. Returns {"edges": {path: {library: resolved path or
+    None}}, "used_by": {path: [paths]}, "missing": {library: [paths]}}.
+    """
+    by_location = {}
+    for path, summary in binaries.items():
+        directory = os.path.dirname(path)
+        names = {os.path.basename(path)}
+        if summary.get("soname"):
+            names.add(summary["soname"])
+        for name in names:
+            by_location.setdefault((directory, name), path)
+
+    edges, used_by, missing = {}, {}, {}
+    for path, summary in sorted(binaries.items()):
+        if not summary["needed"]:
+            continue
+        directories = [p.strip("/") for p in summary["search_paths"]] + list(LIBRARY_PATHS)
+        edges[path] = {}
+        for library in summary["needed"]:
+            resolved = next((by_location[(d, library)] for d in directories
+                             if (d, library) in by_location), None)
+            edges[path][library] = resolved
+            if resolved is None:
+                missing.setdefault(library, []).append(path)
+            else:
+                used_by.setdefault(resolved, []).append(path)
+    return {"edges": edges, "used_by": used_by, "missing": missing}
+
+
+def main():
+    target = sys.argv[1] if len(sys.argv) > 1 else "_a60.bin/squashfs-root"
+    if not os.path.exists(target):
+        print(f"❌ {target} not found")
+        return
+    if os.path.isdir(target):
+        binaries = {}
+        for dirpath, _, filenames in os.walk(target):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not os.path.islink(path):
+                    summary = elf_summary(path)
+                    if summary is not None:
+                        binaries[os.path.relpath(path, target)] = summary
+        graph = dependency_graph(binaries)
+        for path, summary in sorted(binaries.items()):
+            print(f"{path}: {summary['description']}, {summary['size']} bytes")
+            for library, resolved in graph["edges"].get(path, {}).items():
+                print(f"   -> {library} ({resolved or 'missing'})")
+        return
+
+    offset = int(sys.argv[2], 0) if len(sys.argv) > 2 else 0
+    with FirmwareImage(target) as image:
+        try:
+            elf = ElfFile(image.view, offset, target)
+        except ElfError as e:
+            print(f"❌ {target} @ {offset:#x}: {e}")
+            return
+        print(elf.describe())
+        print(f"   entry {elf.entry:#x}, {elf.extent} bytes{' (truncated)' if elf.truncated else ''}")
+        if elf.interpreter:
+            print(f"   interpreter: {elf.interpreter}")
+        for segment in elf.segments:
+            print(f"   {segment.type_name:<13} offset {segment.offset:#08x} vaddr {segment.vaddr:#010x} "
+                  f"filesz {segment.filesz:#x} memsz {segment.memsz:#x}")
+        for library in elf.needed:
+            print(f"   needs {library}")
+        print(f"   {len(elf.sections)} sections, {len(elf.symbols)} symbols "
+              f"({len(elf.imports)} imported, {len(elf.exports)} exported)")
+        elf.close()
+
+
+if __name__ == "__main__":
+    main()
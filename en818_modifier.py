@@ -10,12 +10,14 @@ biometric access control device firmware.
 import os
 import json
 from firmware_modifier import FirmwareModifier
+from workspace import break_link
+from artifact_store import ArtifactStore, build_key
 
 class EN818Modifier(FirmwareModifier):
     """EN-818 specific firmware modifications"""
     
-    def __init__(self):
-        super().__init__()
+    def __init__(self, firmware_path="a60.bin", modified_dir="_a60_modified", store=None):
+        super().__init__(firmware_path, modified_dir, store)
         self.device_model = "EN-818/EN-818T"
         
     def enable_debug_mode(self):
@@ -45,7 +47,7 @@ class EN818Modifier(FirmwareModifier):
             ""
         ]
         
-        self.modify_startup_script(debug_commands)
+        self.modify_startup_script(debug_commands, name="debug", priority=10)
         
     def modify_authentication_settings(self, settings):
         """Modify authentication-related settings"""
@@ -127,7 +129,7 @@ class EN818Modifier(FirmwareModifier):
                 ""
             ])
             
-        self.modify_startup_script(network_commands)
+        self.modify_startup_script(network_commands, name="network", priority=20)
         
     def modify_display_settings(self, display_config):
         """Modify 2.4" TFT display settings"""
@@ -183,6 +185,7 @@ exit 0
         full_path = f"{self.modified_dir}/squashfs-root{script_path}"
         
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        break_link(full_path, keep_content=False)
         with open(full_path, 'w') as f:
             f.write(auth_script)
         os.chmod(full_path, 0o755)
@@ -236,6 +239,7 @@ busybox httpd -p 8080 -h $WEB_ROOT
         full_path = f"{self.modified_dir}/squashfs-root{web_path}"
         
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        break_link(full_path, keep_content=False)
         with open(full_path, 'w') as f:
             f.write(web_script)
         os.chmod(full_path, 0o755)
@@ -248,7 +252,7 @@ busybox httpd -p 8080 -h $WEB_ROOT
             ""
         ]
         
-        self.modify_startup_script(web_commands)
+        self.modify_startup_script(web_commands, name="web", priority=30)
 
 def create_modification_profile():
     """Create a modification profile for EN-818/EN-818T"""
@@ -299,6 +303,53 @@ def create_modification_profile():
     print("📋 Modification profile created: en818_modification_profile.json")
     return profile
 
+def apply_profile(modifier, mods):
+    """Apply a profile's modifications to a prepared EN818Modifier"""
+    
+    # config.txt and run_app.sh are each written once, at the end of the block
+    with modifier.edit_transaction():
+        if mods.get("debug_mode"):
+            modifier.enable_debug_mode()
+            print()
+            
+        if mods.get("custom_auth"):
+            modifier.add_custom_authentication_script()
+            print()
+            
+        if mods.get("web_interface"):
+            modifier.add_web_interface()
+            print()
+            
+        # Apply settings
+        modifier.modify_authentication_settings(mods["authentication"])
+        print()
+        
+        modifier.modify_network_settings(mods["network"])
+        print()
+        
+        modifier.modify_display_settings(mods["display"])
+        print()
+        
+        # Apply custom config
+        modifier.modify_config(mods["custom_config"])
+        print()
+    
+    # Keep only the voice prompts the site needs (optional profile section:
+    # {"languages": [...], "bitrate": kbps, "mono": bool})
+    voice = mods.get("voice")
+    if voice and voice.get("languages"):
+        modifier.prune_languages(voice["languages"], voice.get("bitrate"), voice.get("mono", False))
+        print()
+    
+    # UI assets swapped inside usr/resource.bin (optional: {entry name: file})
+    for name, source_path in sorted(mods.get("resources", {}).items()):
+        modifier.replace_resource(name, source_path)
+        print()
+
+def profile_files(mods):
+    """Files a profile pulls into the image, part of its build key"""
+    return sorted(mods.get("resources", {}).values())
+
 def apply_modifications():
     """Apply all modifications to EN-818/EN-818T firmware"""
     
@@ -310,11 +361,16 @@ def apply_modifications():
     # Create modification profile
     profile = create_modification_profile()
     
-    # Initialize modifier
-    modifier = EN818Modifier()
+    # Initialize modifier; identical inputs reuse the previous build's outputs
+    modifier = EN818Modifier(store=ArtifactStore())
+    modifier.build_key = build_key(modifier.firmware_path, profile,
+                                   profile_files(profile["modifications"]), stage="en818")
     
     # Backup and extract
     modifier.backup_original()
+    if modifier.restore_build():
+        print("🎉 EN-818/EN-818T firmware is up to date (no inputs changed)")
+        return
     modifier.extract_firmware()
     modifier.prepare_modification_env()
     
@@ -322,37 +378,12 @@ def apply_modifications():
     print()
     
     # Apply modifications based on profile
-    mods = profile["modifications"]
-    
-    if mods["debug_mode"]:
-        modifier.enable_debug_mode()
-        print()
-        
-    if mods["custom_auth"]:
-        modifier.add_custom_authentication_script()
-        print()
-        
-    if mods["web_interface"]:
-        modifier.add_web_interface()
-        print()
-        
-    # Apply settings
-    modifier.modify_authentication_settings(mods["authentication"])
-    print()
-    
-    modifier.modify_network_settings(mods["network"])
-    print()
-    
-    modifier.modify_display_settings(mods["display"])
-    print()
-    
-    # Apply custom config
-    modifier.modify_config(mods["custom_config"])
-    print()
+    apply_profile(modifier, profile["modifications"])
     
     # Repack and rebuild
     modifier.repack_filesystem()
-    modifier.rebuild_firmware()
+    if modifier.rebuild_firmware():
+        modifier.create_delta()
     
     print("🎉 EN-818/EN-818T firmware modification complete!")
     print()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Windowed Entropy Map
+====================
+
+NumPy-backed Shannon entropy over whole firmware images. Produces a
+sliding-window entropy profile (configurable window and stride) from
+cumulative byte histograms and condenses it into a region summary
+(compressed / code / padding) that makes partition boundaries in a60.bin
+stand out without reading hexdumps.
+
+Requires NumPy.
+"""
+
+import sys
+import math
+import numpy as np
+
+from firmware_image import FirmwareImage
+
+# Region classification thresholds (bits per byte)
+PADDING_MAX = 1.0
+COMPRESSED_MIN = 7.2
+
+# Bytes histogrammed per bincount call, block histograms held at once
+# and windows whose entropy is computed together
+CHUNK_SIZE = 1 << 20
+HIST_ROWS = 4096
+WINDOW_BATCH = 4096
+
+
+def shannon_entropy(data):
+    """Shannon entropy of data in bits per byte (0.0 - 8.0)"""
+    arr = np.frombuffer(data, dtype=np.uint8)
+    if arr.size == 0:
+        return 0.0
+    counts = np.bincount(arr, minlength=256)
+    p = counts[counts > 0] / arr.size
+    return float(0.0 - (p * np.log2(p)).sum())
+
+
+def _entropy_rows(counts, total):
+    """Entropy for each row of a (n, 256) histogram matrix"""
+    p = counts / float(total)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.where(counts > 0, np.log2(p), 0.0)
+    return 0.0 - (p * logs).sum(axis=1)
+
+
+class _CumulativeHistogram:
+    """Running byte histogram over a sequence of equal-sized blocks
+
+    at() returns the histogram of every block before each requested
+    position. The cursor only moves forward and holds at most HIST_ROWS
+    block histograms at a time, so memory does not grow with the image.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.position = 0
+        self.total = np.zeros(256, dtype=np.int64)
+        self.rows = max(1, min(HIST_ROWS, CHUNK_SIZE // blocks.shape[1]))
+
+    def at(self, positions):
+        out = np.empty((len(positions), 256), dtype=np.int64)
+        i = 0
+        while i < len(positions):
+            end = min(int(positions[-1]), self.position + self.rows)
+            chunk = self.blocks[self.position:end]
+            # One bincount over (row * 256 + byte) for the whole chunk
+            keys = chunk + (np.arange(len(chunk), dtype=np.int64) * 256)[:, None]
+            cumulative = np.empty((len(chunk) + 1, 256), dtype=np.int64)
+            cumulative[0] = self.total
+            np.cumsum(np.bincount(keys.ravel(), minlength=len(chunk) * 256).reshape(len(chunk), 256),
+                      axis=0, out=cumulative[1:])
+            cumulative[1:] += self.total
+            j = int(np.searchsorted(positions, end, side="right"))
+            out[i:j] = cumulative[positions[i:j] - self.position]
+            self.total = cumulative[-1]
+            self.position = end
+            i = j
+        return out
+
+
+def entropy_profile(data, window=4096, stride=None):
+    """Sliding-window entropy profile
+
+    Returns (offsets, entropies) as NumPy arrays, one entry per full window.
+    The data is cut into gcd(window, stride) blocks and each window's
+    histogram is the difference of the running block histograms at its two
+    edges, so overlapping windows cost no extra passes over the data.
+    Windows are processed in batches and the running histograms advance
+    chunk by chunk, so memory stays bounded for any stride.
+    """
+    if stride is None:
+        stride = window
+    if window <= 0 or stride <= 0:
+        raise ValueError("window and stride must be positive")
+
+    arr = np.frombuffer(data, dtype=np.uint8)
+    if arr.size < window:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    block = math.gcd(window, stride)
+    nblocks = arr.size // block
+    blocks = arr[:nblocks * block].reshape(nblocks, block)
+
+    per_window = window // block
+    per_stride = stride // block
+    starts = np.arange(0, nblocks - per_window + 1, per_stride)
+    entropies = np.empty(len(starts))
+
+    leading, trailing = _CumulativeHistogram(blocks), _CumulativeHistogram(blocks)
+    for first in range(0, len(starts), WINDOW_BATCH):
+        batch = starts[first:first + WINDOW_BATCH]
+        counts = leading.at(batch + per_window) - trailing.at(batch)
+        entropies[first:first + len(batch)] = _entropy_rows(counts, window)
+
+    return starts * block, entropies
+
+
+def classify_entropy(entropy):
+    """Coarse content class for one window's entropy"""
+    if entropy < PADDING_MAX:
+        return "padding"
+    if entropy >= COMPRESSED_MIN:
+        return "compressed"
+    return "code"
+
+
+def summarize_regions(offsets, entropies, window, total_size=None, min_size=0):
+    """Merge consecutive windows of the same class into regions
+
+    Returns a list of dicts with start, end, kind and mean entropy. Runs
+    shorter than min_size bytes are absorbed into the region that follows.
+    """
+    runs = []
+    for offset, entropy in zip(offsets.tolist(), entropies.tolist()):
+        kind = classify_entropy(entropy)
+        if runs and (runs[-1][2] == kind or runs[-1][1] - runs[-1][0] < min_size):
+            run = runs[-1]
+            run[1:] = [offset + window, kind, run[3] + entropy, run[4] + 1]
+        else:
+            start = max(offset, runs[-1][1]) if runs else offset
+            runs.append([start, offset + window, kind, entropy, 1])
+
+    # Folding can leave neighbouring runs of the same kind
+    merged = []
+    for run in runs:
+        if merged and merged[-1][2] == run[2]:
+            merged[-1][1] = run[1]
+            merged[-1][3] += run[3]
+            merged[-1][4] += run[4]
+        else:
+            merged.append(run)
+
+    if merged and total_size is not None:
+        merged[-1][1] = total_size
+
+    return [
+        {"start": start, "end": end, "kind": kind, "entropy": round(total / count, 3)}
+        for start, end, kind, total, count in merged
+    ]
+
+
+def entropy_map(data, window=4096, stride=None, min_size=0):
+    """Profile and region summary for a whole image"""
+    offsets, entropies = entropy_profile(data, window, stride)
+    return {
+        "window": window,
+        "stride": stride or window,
+        "entropy": shannon_entropy(data),
+        "profile": entropies,
+        "offsets": offsets,
+        "regions": summarize_regions(offsets, entropies, window, len(data), min_size),
+    }
+
+
+def print_regions(regions):
+    for region in regions:
+        size = region["end"] - region["start"]
+        print(f"   0x{region['start']:08x}-0x{region['end']:08x} "
+              f"{region['kind']:<10} {size:>10,} bytes  (entropy {region['entropy']:.2f})")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: entropy_map.py <image> [window] [stride]")
+        return
+
+    window = int(sys.argv[2], 0) if len(sys.argv) > 2 else 4096
+    stride = int(sys.argv[3], 0) if len(sys.argv) > 3 else None
+
+    with FirmwareImage(sys.argv[1]) as image:
+        result = entropy_map(image.view, window, stride, min_size=window * 4)
+
+    print(f"📊 Entropy map: {sys.argv[1]}")
+    print(f"   Overall entropy: {result['entropy']:.2f}/8.0")
+    print(f"   Windows: {len(result['profile'])} x {window} bytes (stride {result['stride']})")
+    print_regions(result["regions"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Filesystem Index
+================
+
+Single-walk, in-memory index of an extracted root filesystem. The tree is
+scanned once with os.scandir (one lstat per entry) into compact __slots__
+nodes with interned names and symlink targets; analysis passes then answer
+exists/isfile/listdir/stat/walk queries from the index instead of hitting
+the disk again. Symlinks are resolved inside the tree, the way they would
+be on the device.
+
+The index can also be built straight from a squashfs image through
+SquashfsReader, in which case open() reads file data out of the image.
+"""
+
+import os
+import sys
+import stat as stat_module
+
+FILE, DIRECTORY, SYMLINK, OTHER = "file", "directory", "symlink", "other"
+
+# Guard against symlink loops while resolving
+MAX_SYMLINK_DEPTH = 40
+
+
+class FsNode:
+    """One filesystem entry; exposes stat-compatible st_* attributes"""
+
+    __slots__ = ("name", "parent", "kind", "st_mode", "st_size", "st_mtime_ns",
+                 "st_ino", "st_dev", "target", "children")
+
+    def __init__(self, name, parent, kind, st, target=None):
+        self.name = name
+        self.parent = parent
+        self.kind = kind
+        self.st_mode = st.st_mode
+        self.st_size = st.st_size
+        self.st_mtime_ns = st.st_mtime_ns
+        self.st_ino = st.st_ino
+        self.st_dev = st.st_dev
+        self.target = target
+        self.children = {} if kind == DIRECTORY else None
+
+    @property
+    def rel_path(self):
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return "/".join(reversed(parts))
+
+    def __repr__(self):
+        return f"FsNode({self.rel_path or '/'!r}, {self.kind})"
+
+
+def _kind(mode):
+    if stat_module.S_ISLNK(mode):
+        return SYMLINK
+    if stat_module.S_ISDIR(mode):
+        return DIRECTORY
+    if stat_module.S_ISREG(mode):
+        return FILE
+    return OTHER
+
+
+class FilesystemIndex:
+    """Index of a directory tree built with one os.scandir walk"""
+
+    def __init__(self, root, reader=None):
+        self.root_path = root
+        self.reader = reader
+        self.root = None
+        self.node_count = 0
+        self.build()
+
+    @classmethod
+    def from_squashfs(cls, reader):
+        """Index of a squashfs image, read in place through a SquashfsReader"""
+        return cls(None, reader)
+
+    def build(self):
+        """(Re)scan the tree"""
+        if self.reader is not None:
+            return self._build_from_reader()
+        self.root = FsNode("", None, DIRECTORY, os.stat(self.root_path))
+        self.node_count = 1
+        stack = [(self.root, self.root_path)]
+
+        while stack:
+            parent, path = stack.pop()
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                st = entry.stat(follow_symlinks=False)
+                kind = _kind(st.st_mode)
+                target = sys.intern(os.readlink(entry.path)) if kind == SYMLINK else None
+                node = FsNode(sys.intern(entry.name), parent, kind, st, target)
+                parent.children[node.name] = node
+                self.node_count += 1
+                if kind == DIRECTORY:
+                    stack.append((node, entry.path))
+        return self
+
+    def _build_from_reader(self):
+        """Walk the image's directory table; no file data is decompressed"""
+        self.root = FsNode("", None, DIRECTORY, self.reader.root)
+        self.node_count = 1
+        stack = [(self.root, self.reader.root)]
+
+        while stack:
+            parent, inode = stack.pop()
+            for name, child_inode in self.reader.iterdir(inode):
+                kind = _kind(child_inode.st_mode)
+                target = sys.intern(child_inode.target) if kind == SYMLINK else None
+                node = FsNode(sys.intern(name), parent, kind, child_inode, target)
+                parent.children[node.name] = node
+                self.node_count += 1
+                if kind == DIRECTORY:
+                    stack.append((node, child_inode))
+        return self
+
+    def full_path(self, rel_path):
+        if self.root_path is None:
+            return f"/{rel_path}"
+        return os.path.join(self.root_path, rel_path)
+
+    def open(self, rel_path):
+        """Binary file object for rel_path (symlinks resolved inside the tree)"""
+        node = self.resolve(rel_path)
+        if node is None:
+            raise FileNotFoundError(rel_path)
+        if self.reader is None:
+            return open(self.full_path(node.rel_path), 'rb')
+        return self.reader.open(node.rel_path)
+
+    def lookup(self, rel_path, follow_symlinks=False):
+        """Node for a path relative to the root (None if missing)"""
+        return self._lookup(rel_path, follow_symlinks, 0)
+
+    def _lookup(self, rel_path, follow_symlinks, depth):
+        if depth > MAX_SYMLINK_DEPTH:
+            return None
+        node = self.root
+        parts = [p for p in rel_path.split("/") if p and p != "."]
+        for i, part in enumerate(parts):
+            if part == "..":
+                node = node.parent or node
+                continue
+            # Intermediate symlinked directories are always followed
+            if node.kind == SYMLINK:
+                node = self._follow(node, depth + 1)
+            if node is None or node.kind != DIRECTORY:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        if follow_symlinks and node.kind == SYMLINK:
+            node = self._follow(node, depth + 1)
+        return node
+
+    def _follow(self, link, depth):
+        """Resolve a symlink node inside the tree (absolute targets are rooted)"""
+        if link.target.startswith("/"):
+            target = link.target
+        else:
+            parent_path = link.parent.rel_path
+            target = f"{parent_path}/{link.target}" if parent_path else link.target
+        return self._lookup(target, True, depth)
+
+    def resolve(self, rel_path):
+        """Node rel_path points to after following symlinks"""
+        return self.lookup(rel_path, follow_symlinks=True)
+
+    def exists(self, rel_path):
+        """Like os.path.exists: follows symlinks"""
+        return self.resolve(rel_path) is not None
+
+    def isfile(self, rel_path):
+        node = self.resolve(rel_path)
+        return node is not None and node.kind == FILE
+
+    def isdir(self, rel_path):
+        node = self.resolve(rel_path)
+        return node is not None and node.kind == DIRECTORY
+
+    def stat(self, rel_path, follow_symlinks=True):
+        """Stat-like node for rel_path; raises FileNotFoundError if missing"""
+        node = self.lookup(rel_path, follow_symlinks)
+        if node is None:
+            raise FileNotFoundError(rel_path)
+        return node
+
+    def listdir(self, rel_path=""):
+        node = self.resolve(rel_path)
+        if node is None or node.kind != DIRECTORY:
+            raise NotADirectoryError(rel_path)
+        return list(node.children)
+
+    def walk(self):
+        """Yield (rel_dir, dir_names, file_names) top-down, like os.walk
+
+        Symlinks to directories are listed with the directories but not
+        descended into, matching os.walk's defaults.
+        """
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dirs, files = [], []
+            for child in node.children.values():
+                is_dir = child.kind == DIRECTORY or (
+                    child.kind == SYMLINK and self.isdir(child.rel_path))
+                (dirs if is_dir else files).append(child.name)
+            yield node.rel_path, dirs, files
+            stack.extend(reversed([node.children[d] for d in dirs
+                                   if node.children[d].kind == DIRECTORY]))
+
+    def iter_nodes(self):
+        """Every node below the root, depth first"""
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.kind == DIRECTORY:
+                stack.extend(node.children.values())
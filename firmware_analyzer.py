@@ -7,31 +7,144 @@ This script analyzes the extracted EN-818/EN-818T firmware and prepares
 it for safe modification by identifying key components and dependencies.
 """
 
+import io
 import os
+import sys
 import json
-import subprocess
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+from file_classifier import FileClassifier
+from analysis_cache import AnalysisCache
+from filesystem_index import FilesystemIndex, FILE
+from squashfs_reader import SquashfsReader, SquashfsError
+from merkle_index import MerkleIndex, diff_trees
+from voice_indexer import VoicePromptIndexer
+from string_index import StringIndex
+from elf_parser import ElfFile, ElfError, ELF_MAGIC, elf_summary, dependency_graph
+
+def run_passes(passes, max_workers=None):
+    """Run analysis passes on a thread pool, honouring their dependencies
+    
+    passes maps a pass name to (callable, [names it depends on]). A pass is
+    submitted as soon as everything it depends on has finished, so
+    independent I/O-heavy passes overlap. Returns per-pass wall time in
+    seconds.
+    """
+    for name, (_, deps) in passes.items():
+        missing = [dep for dep in deps if dep not in passes]
+        if missing:
+            raise ValueError(f"Pass {name} depends on unknown pass(es): {missing}")
+    
+    def timed(func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+    
+    timings = {}
+    pending = dict(passes)
+    running = {}
+    
+    with ThreadPoolExecutor(max_workers=max_workers or len(passes) or 1) as pool:
+        while pending or running:
+            for name in [n for n, (_, deps) in pending.items() if all(d in timings for d in deps)]:
+                func, _ = pending.pop(name)
+                running[pool.submit(timed, func)] = name
+            
+            if not running:
+                raise ValueError(f"Dependency cycle between passes: {sorted(pending)}")
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                timings[running.pop(future)] = round(future.result(), 6)
+    
+    return timings
 
 class FirmwareAnalyzer:
-    def __init__(self, extract_dir="_a60.bin"):
+    def __init__(self, extract_dir="_a60.bin", use_cache=True, cache_path=None,
+                 squashfs_image=None, squashfs_offset=0,
+                 modified_root="_a60_modified/squashfs-root"):
         self.extract_dir = extract_dir
         self.squashfs_root = f"{extract_dir}/squashfs-root"
+        self.modified_root = modified_root
+        self.voice_root = f"{extract_dir}/squashfs-root-0"
         self.analysis_report = {}
+        self.classifier = FileClassifier()
+        
+        # Analyze a squashfs image (or one embedded at an offset) in place
+        self.reader = None
+        if squashfs_image:
+            self.reader = SquashfsReader(squashfs_image, squashfs_offset)
+            self.squashfs_root = squashfs_image
+        
+        # Per-file results survive between runs; only changed files are re-read
+        self.cache = None
+        if use_cache and self.reader is None:
+            self.cache = AnalysisCache(cache_path or f"{extract_dir}/.analysis_cache.json")
+        
+        # One scandir walk per run, shared by every pass
+        self._fs_index = None
+        self._fs_index_lock = threading.Lock()
+        
+    @property
+    def fs_index(self):
+        """Filesystem index of squashfs-root (None if not extracted)"""
+        with self._fs_index_lock:
+            if self._fs_index is None:
+                if self.reader is not None:
+                    self._fs_index = FilesystemIndex.from_squashfs(self.reader)
+                elif os.path.isdir(self.squashfs_root):
+                    self._fs_index = FilesystemIndex(self.squashfs_root)
+            return self._fs_index
+        
+    def build_index(self):
+        """(Re)build the filesystem index, e.g. after the tree changed"""
+        with self._fs_index_lock:
+            self._fs_index = None
+        return self.fs_index
+        
+    def _exists(self, rel_path):
+        index = self.fs_index
+        return index is not None and index.exists(rel_path)
+        
+    def _open(self, path):
+        """Binary file object; path is relative to the image in image mode"""
+        if self.reader is not None:
+            return self.fs_index.open(path)
+        return open(path, 'rb')
+        
+    def _read_text(self, path):
+        """File content as text with universal newlines, like open(path, 'r')"""
+        with self._open(path) as f:
+            return io.StringIO(f.read().decode('utf-8', errors='ignore'), newline=None).read()
+        
+    def _classify(self, path):
+        if self.reader is not None:
+            with self._open(path) as f:
+                return self.classifier.classify_stream(f, self.fs_index.stat(path))
+        return self.classifier.classify(path)
+        
+    def _cached(self, rel_path, name, compute):
+        """Per-file analysis result for rel_path, served from the cache if valid"""
+        if self.reader is not None:
+            return compute(rel_path)
+        if self.cache is None:
+            return compute(f"{self.squashfs_root}/{rel_path}")
+        st = self.fs_index.stat(rel_path, follow_symlinks=False)
+        return self.cache.get_or_compute(self.squashfs_root, rel_path, name, compute, st)
         
     def analyze_filesystem_structure(self):
         """Analyze the extracted filesystem structure"""
         print("📁 Analyzing filesystem structure...")
         
         structure = {}
+        index = self.fs_index
         
-        if os.path.exists(self.squashfs_root):
-            for root, dirs, files in os.walk(self.squashfs_root):
-                rel_path = os.path.relpath(root, self.squashfs_root)
-                if rel_path == ".":
-                    rel_path = "/"
-                
-                structure[rel_path] = {
-                    "directories": dirs,
+        if index is not None:
+            # Subdirectory names are the other keys; only files are listed
+            for rel_path, dirs, files in index.walk():
+                structure[rel_path or "/"] = {
                     "files": files,
                     "file_count": len(files),
                     "dir_count": len(dirs)
@@ -57,18 +170,10 @@ class FirmwareAnalyzer:
         configs = {}
         
         for config_file in config_files:
-            full_path = f"{self.squashfs_root}/{config_file}"
-            if os.path.exists(full_path):
+            if self._exists(config_file):
                 try:
-                    with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                    
-                    configs[config_file] = {
-                        "exists": True,
-                        "size": len(content),
-                        "lines": len(content.split('\n')),
-                        "content_preview": content[:200] + "..." if len(content) > 200 else content
-                    }
+                    configs[config_file] = self._cached(
+                        config_file, "configuration", self._summarize_config_file)
                 except Exception as e:
                     configs[config_file] = {
                         "exists": True,
@@ -80,20 +185,25 @@ class FirmwareAnalyzer:
         self.analysis_report["configurations"] = configs
         print(f"   Analyzed {len([c for c in configs.values() if c['exists']])} config files")
         
+    def _summarize_config_file(self, full_path):
+        content = self._read_text(full_path)
+        
+        return {
+            "exists": True,
+            "size": len(content),
+            "lines": len(content.split('\n')),
+            "content_preview": content[:200] + "..." if len(content) > 200 else content
+        }
+        
     def analyze_device_settings(self):
         """Extract and analyze device-specific settings"""
         print("🔧 Analyzing device settings...")
         
-        config_path = f"{self.squashfs_root}/usr/config.txt"
         device_settings = {}
         
-        if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#') and '=' in line:
-                        key, value = line.split('=', 1)
-                        device_settings[key] = value
+        if self._exists("usr/config.txt"):
+            device_settings = self._cached("usr/config.txt", "device_settings",
+                                           self._parse_device_settings)
         
         # Categorize settings
         categorized = {
@@ -125,6 +235,15 @@ class FirmwareAnalyzer:
         self.analysis_report["device_settings"] = categorized
         print(f"   Found {len(device_settings)} device settings")
         
+    def _parse_device_settings(self, config_path):
+        device_settings = {}
+        for line in self._read_text(config_path).splitlines():
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                device_settings[key] = value
+        return device_settings
+        
     def analyze_binaries(self):
         """Analyze binary files and executables"""
         print("🔍 Analyzing binary files...")
@@ -132,26 +251,25 @@ class FirmwareAnalyzer:
         bin_dirs = ["bin", "sbin", "usr/bin", "usr/sbin"]
         binaries = {}
         
+        index = self.fs_index
+        
         for bin_dir in bin_dirs:
-            full_dir = f"{self.squashfs_root}/{bin_dir}"
-            if os.path.exists(full_dir):
+            if index is not None and index.isdir(bin_dir):
                 binaries[bin_dir] = []
                 
-                for item in os.listdir(full_dir):
-                    item_path = f"{full_dir}/{item}"
-                    if os.path.isfile(item_path):
-                        # Check if executable
-                        is_exec = os.access(item_path, os.X_OK)
+                for item in index.listdir(bin_dir):
+                    if index.isfile(f"{bin_dir}/{item}"):
+                        # Get file info (symlinks resolved inside the rootfs)
+                        stat = index.stat(f"{bin_dir}/{item}")
                         
-                        # Get file info
-                        stat = os.stat(item_path)
+                        # Check if executable
+                        is_exec = bool(stat.st_mode & 0o111)
                         
-                        # Try to get file type
+                        # Classify in-process; applet links share one inode
                         try:
-                            result = subprocess.run(['file', item_path], 
-                                                  capture_output=True, text=True)
-                            file_type = result.stdout.strip()
-                        except:
+                            file_type = self._cached(f"{bin_dir}/{item}", "file_type",
+                                                     self._classify)
+                        except OSError:
                             file_type = "unknown"
                         
                         binaries[bin_dir].append({
@@ -165,6 +283,39 @@ class FirmwareAnalyzer:
         total_bins = sum(len(bins) for bins in binaries.values())
         print(f"   Found {total_bins} binary files")
         
+    def _elf_summary(self, path):
+        if self.reader is None:
+            return elf_summary(path)
+        # Only the headers and tables the summary needs are decompressed
+        with self._open(path) as f:
+            if f.read(len(ELF_MAGIC)) != ELF_MAGIC:
+                return None
+            try:
+                return ElfFile(f, 0, path).summary()
+            except ElfError:
+                return None
+        
+    def analyze_elf_binaries(self):
+        """Parse every ELF file of the rootfs and resolve its library dependencies"""
+        print("🧬 Parsing ELF binaries...")
+        
+        index = self.fs_index
+        if index is None:
+            print("   No root filesystem")
+            return
+        
+        binaries = {}
+        for node in index.iter_nodes():
+            if node.kind == FILE:
+                summary = self._cached(node.rel_path, "elf", self._elf_summary)
+                if summary is not None:
+                    binaries[node.rel_path] = summary
+        
+        graph = dependency_graph(binaries)
+        self.analysis_report["elf_binaries"] = {"binaries": dict(sorted(binaries.items())), **graph}
+        print(f"   {len(binaries)} ELF files, {sum(len(e) for e in graph['edges'].values())} "
+              f"library dependencies, {len(graph['missing'])} missing libraries")
+        
     def identify_modification_points(self):
         """Identify safe modification points"""
         print("🎯 Identifying modification points...")
@@ -198,7 +349,7 @@ class FirmwareAnalyzer:
         ]
         
         for file_path in safe_files:
-            if os.path.exists(f"{self.squashfs_root}/{file_path}"):
+            if self._exists(file_path):
                 modification_points["safe_to_modify"].append(file_path)
         
         modification_points["recommendations"] = [
@@ -235,36 +386,104 @@ class FirmwareAnalyzer:
             security_analysis["authentication_methods"].append("Keyboard/Password")
             
         # Check for default passwords
-        passwd_path = f"{self.squashfs_root}/etc/passwd"
-        if os.path.exists(passwd_path):
-            with open(passwd_path, 'r') as f:
-                passwd_content = f.read()
-                if "root::0:0" in passwd_content:
-                    security_analysis["potential_issues"].append("Root account with no password")
+        if self._exists("etc/passwd"):
+            if self._cached("etc/passwd", "root_without_password", self._root_without_password):
+                security_analysis["potential_issues"].append("Root account with no password")
         
         # Check file permissions on critical files
         critical_files = ["etc/passwd", "etc/shadow", "usr/config.txt"]
         for file_path in critical_files:
-            full_path = f"{self.squashfs_root}/{file_path}"
-            if os.path.exists(full_path):
-                stat = os.stat(full_path)
+            if self._exists(file_path):
+                stat = self.fs_index.stat(file_path)
                 permissions = oct(stat.st_mode)[-3:]
                 security_analysis["file_permissions"][file_path] = permissions
         
         self.analysis_report["security"] = security_analysis
         print(f"   Found {len(security_analysis['authentication_methods'])} authentication methods")
         
+    def analyze_modified_tree(self):
+        """Diff squashfs-root against the modified tree through cached Merkle indexes"""
+        print("🌳 Comparing with modified filesystem...")
+        
+        if self.reader is not None or not os.path.isdir(self.modified_root):
+            print("   No modified tree to compare")
+            return
+        
+        changes = diff_trees(MerkleIndex.load(self.squashfs_root), MerkleIndex.load(self.modified_root))
+        self.analysis_report["tree_diff"] = changes
+        summary = changes["summary"]
+        print(f"   {summary['added']} added, {summary['removed']} removed, "
+              f"{summary['changed']} changed, {summary['mode_changed']} mode changes, "
+              f"{summary['retargeted']} symlinks retargeted")
+        
+    def analyze_voice_prompts(self):
+        """Index the MP3 voice prompts of the voice partition"""
+        print("🔊 Indexing voice prompts...")
+        
+        if self.reader is not None or not os.path.isdir(self.voice_root):
+            print("   No voice partition extracted")
+            return
+        
+        voice = VoicePromptIndexer(self.voice_root).index()
+        self.analysis_report["voice_prompts"] = voice
+        print(f"   {voice['totals']['files']} prompts in {len(voice['languages'])} languages, "
+              f"{voice['totals']['bytes']} bytes, {len(voice['duplicates'])} duplicate groups")
+        
+    def build_string_index(self):
+        """Refresh the string/symbol index of the extracted tree and partitions"""
+        print("🔎 Updating string index...")
+        
+        if self.reader is not None:
+            print("   Not available in image mode")
+            return
+        
+        index, rebuilt = StringIndex.load_or_build(self.extract_dir)
+        stats = index.stats()
+        stats["rebuilt"] = rebuilt
+        self.analysis_report["string_index"] = stats
+        print(f"   {stats['files']} files, {stats['strings']} strings, {stats['terms']} terms "
+              f"({'rebuilt' if rebuilt else 'up to date'})")
+        
+    def analysis_passes(self):
+        """Analysis passes and the passes each one depends on"""
+        return {
+            "index": (self.build_index, []),
+            "filesystem": (self.analyze_filesystem_structure, ["index"]),
+            "configurations": (self.analyze_configuration_files, ["index"]),
+            "device_settings": (self.analyze_device_settings, ["index"]),
+            "binaries": (self.analyze_binaries, ["index"]),
+            "elf_binaries": (self.analyze_elf_binaries, ["index"]),
+            "modification_points": (self.identify_modification_points, ["index"]),
+            "security": (self.analyze_security_features, ["index", "device_settings"]),
+            "tree_diff": (self.analyze_modified_tree, []),
+            "voice_prompts": (self.analyze_voice_prompts, []),
+            "string_index": (self.build_string_index, []),
+        }
+        
+    def _root_without_password(self, passwd_path):
+        return "root::0:0" in self._read_text(passwd_path)
+        
     def generate_report(self):
         """Generate comprehensive analysis report"""
         print("📝 Generating analysis report...")
         
-        # Run all analysis functions
-        self.analyze_filesystem_structure()
-        self.analyze_configuration_files()
-        self.analyze_device_settings()
-        self.analyze_binaries()
-        self.identify_modification_points()
-        self.analyze_security_features()
+        # Run all analysis passes; independent ones overlap on a thread pool
+        start = time.perf_counter()
+        passes = self.analysis_passes()
+        timings = run_passes(passes)
+        
+        # Keep report sections in declaration order, not completion order
+        report = self.analysis_report
+        self.analysis_report = {name: report[name] for name in passes if name in report}
+        self.analysis_report.update((k, v) for k, v in report.items() if k not in passes)
+        self.analysis_report["pass_timings"] = {
+            "passes": timings,
+            "total": round(time.perf_counter() - start, 6)
+        }
+        
+        if self.cache is not None:
+            self.cache.save()
+            self.analysis_report["cache"] = dict(self.cache.stats)
         
         # Save detailed report
         with open("firmware_analysis_report.json", "w") as f:
@@ -325,6 +544,54 @@ class FirmwareAnalyzer:
         else:
             summary += "- No major security issues identified\n"
         
+        changes = self.analysis_report.get('tree_diff')
+        if changes:
+            summary += f"""
+## Changes in Modified Filesystem
+"""
+            for path in changes['added']:
+                summary += f"- Added: {path}\n"
+            for path in changes['removed']:
+                summary += f"- Removed: {path}\n"
+            for path in changes['changed']:
+                summary += f"- Changed: {path}\n"
+            for entry in changes['mode_changed']:
+                summary += f"- Mode changed: {entry['path']} ({entry['old']} -> {entry['new']})\n"
+            for entry in changes['type_changed']:
+                summary += f"- Type changed: {entry['path']} ({entry['old']} -> {entry['new']})\n"
+            for entry in changes['retargeted']:
+                summary += f"- Symlink retargeted: {entry['path']} ({entry['old']} -> {entry['new']})\n"
+            if changes['summary']['identical']:
+                summary += "- No changes\n"
+        
+        elves = self.analysis_report.get('elf_binaries')
+        if elves and elves['binaries']:
+            summary += f"""
+## ELF Binaries
+"""
+            for path, elf in elves['binaries'].items():
+                sizes = elf['segments']
+                summary += (f"- **{path}**: {elf['description']}, {elf['size']} bytes "
+                            f"(text {sizes['text']}, data {sizes['data']}, bss {sizes['bss']})\n")
+                for library, resolved in elves['edges'].get(path, {}).items():
+                    summary += f"  - needs {library}" + (f" → {resolved}\n" if resolved else " (not in rootfs)\n")
+            for library, users in elves['missing'].items():
+                summary += f"- ⚠️  {library} missing, needed by {', '.join(users)}\n"
+        
+        voice = self.analysis_report.get('voice_prompts')
+        if voice:
+            summary += f"""
+## Voice Prompts
+"""
+            for language, entry in voice['languages'].items():
+                missing = f", missing {', '.join(map(str, entry['missing']))}" if entry['missing'] else ""
+                summary += (f"- **{language}**: {entry['files']} prompts, {entry['bytes']} bytes "
+                            f"({entry['id3_bytes']} in tags), {entry['duration']:.1f}s{missing}\n")
+            for group in voice['duplicates']:
+                summary += f"- ⚠️  Identical prompts: {', '.join(group['paths'])}\n"
+            for group in voice['audio_duplicates']:
+                summary += f"- ⚠️  Same audio with different tags: {', '.join(group['paths'])}\n"
+        
         summary += f"""
 ## Next Steps for Modification
 1. Create backup of original firmware
@@ -344,7 +611,19 @@ def main():
     print("=" * 70)
     print()
     
-    analyzer = FirmwareAnalyzer()
+    # A squashfs image given on the command line is analyzed in place
+    if len(sys.argv) > 1:
+        offset = int(sys.argv[2], 0) if len(sys.argv) > 2 else 0
+        try:
+            analyzer = FirmwareAnalyzer(squashfs_image=sys.argv[1], squashfs_offset=offset)
+        except OSError as e:
+            print(f"❌ Cannot open {sys.argv[1]}: {e.strerror or e}")
+            return
+        except SquashfsError as e:
+            print(f"❌ Cannot read {sys.argv[1]}: {e}")
+            return
+    else:
+        analyzer = FirmwareAnalyzer()
     
     # Check if firmware is extracted
     if not os.path.exists(analyzer.squashfs_root):
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Streaming Firmware Backup
+=========================
+
+Copies a firmware image and computes its digests in one pass: each chunk
+read from the source is written to the backup and fed to SHA-256,
+BLAKE2b and the SHA-256 of every partition it overlaps. Memory use is
+one chunk regardless of the image size. The result is a JSON manifest
+next to the backup, which verify_backup() can check the backup against.
+
+Usage: firmware_backup.py <image> <backup> | --verify <manifest>
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import time
+
+from firmware_layout import ANYKA_MAGIC, ANYKA_MAGIC_OFFSET, partition_ranges
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_VERSION = 1
+DIGESTS = ("sha256", "blake2b")
+
+
+def _stream(source, sink=None, chunk_size=CHUNK_SIZE):
+    """Read source once, optionally copying it to sink; returns digests
+
+    Per-partition SHA-256s are included when source is an ANYKAS3C image.
+    """
+    size = os.fstat(source.fileno()).st_size
+    digests = {name: hashlib.new(name) for name in DIGESTS}
+    partitions = []
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    position = 0
+
+    while True:
+        length = source.readinto(buffer)
+        if not length:
+            break
+        chunk = view[:length]
+
+        if position == 0 and bytes(chunk[ANYKA_MAGIC_OFFSET:ANYKA_MAGIC_OFFSET + len(ANYKA_MAGIC)]) == ANYKA_MAGIC:
+            try:
+                partitions = [(name, start, end, hashlib.sha256())
+                              for name, start, end in partition_ranges(size)]
+            except ValueError:
+                partitions = []
+
+        if sink is not None:
+            sink.write(chunk)
+        for digest in digests.values():
+            digest.update(chunk)
+        for _, start, end, digest in partitions:
+            if start < position + length and end > position:
+                digest.update(chunk[max(start - position, 0):min(end - position, length)])
+        position += length
+
+    return {
+        "size": position,
+        "digests": {name: digest.hexdigest() for name, digest in digests.items()},
+        "partitions": [{"name": name, "offset": f"0x{start:X}", "size": end - start,
+                        "sha256": digest.hexdigest()}
+                       for name, start, end, digest in partitions],
+    }
+
+
+def backup_firmware(source_path, backup_path, manifest_path=None, chunk_size=CHUNK_SIZE):
+    """Copy source_path to backup_path, hashing in the same pass; returns the manifest"""
+    manifest_path = manifest_path or f"{backup_path}.manifest.json"
+    directory = os.path.dirname(backup_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.backup.', dir=directory)
+    try:
+        with open(source_path, 'rb') as source, os.fdopen(fd, 'wb') as sink:
+            result = _stream(source, sink, chunk_size)
+            sink.flush()
+            os.fsync(sink.fileno())
+        shutil.copystat(source_path, tmp_path)
+        os.replace(tmp_path, backup_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "source": source_path,
+        "backup": os.path.basename(backup_path),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **result,
+    }
+    tmp_manifest = f"{manifest_path}.tmp"
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, manifest_path)
+    return manifest
+
+
+def verify_backup(manifest_path):
+    """Re-hash the backup a manifest describes; returns a list of mismatches"""
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    backup_path = os.path.join(os.path.dirname(manifest_path), manifest["backup"])
+    with open(backup_path, 'rb') as f:
+        result = _stream(f)
+
+    mismatches = []
+    if result["size"] != manifest["size"]:
+        mismatches.append("size")
+    mismatches.extend(name for name, value in manifest["digests"].items()
+                      if result["digests"].get(name) != value)
+    actual = {p["name"]: p["sha256"] for p in result["partitions"]}
+    mismatches.extend(f"partition {p['name']}" for p in manifest["partitions"]
+                      if actual.get(p["name"]) != p["sha256"])
+    return mismatches
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--verify":
+        mismatches = verify_backup(sys.argv[2])
+        print("Backup OK" if not mismatches else f"Backup differs: {', '.join(mismatches)}")
+        return
+    if len(sys.argv) < 3:
+        print("Usage: firmware_backup.py <image> <backup> | --verify <manifest>")
+        return
+    manifest = backup_firmware(sys.argv[1], sys.argv[2])
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
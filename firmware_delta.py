@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Firmware Delta Patches
+======================
+
+Compact binary patches from an original a60.bin to a rebuilt image, for
+pushing modified firmware to devices over slow links. The images are
+compared partition by partition (see firmware_layout). An untouched
+partition becomes a single copy op and adds no patch data. A changed one
+is matched bsdiff-style against the same partition of the original:
+exact matches are looked up in a suffix array of the old partition,
+extended into approximate matches and stored as byte-wise differences,
+which are mostly zeros. Bytes with no counterpart in the old partition
+are stored as they are. The op, difference and extra streams are
+compressed separately with LZMA.
+
+A patch records the SHA-256 of both images and of every partition it
+produces. apply_patch() refuses a different source image and checks
+everything it writes, and create_patch() applies each patch once before
+saving it.
+
+Usage: firmware_delta.py diff <original> <modified> <patch>
+       firmware_delta.py apply <original> <patch> <output>
+       firmware_delta.py info <patch>
+"""
+
+import os
+import sys
+import lzma
+import struct
+import hashlib
+import tempfile
+
+import numpy as np
+
+from firmware_image import FirmwareImage
+from firmware_layout import FirmwareLayout
+
+PATCH_MAGIC = b"A60DELTA"
+PATCH_VERSION = 1
+
+# magic, version, partition count, old size, new size, old sha256, new sha256,
+# compressed op, difference and extra stream lengths
+HEADER = struct.Struct("<8sHHQQ32s32sIII")
+# name, offset, size, sha256, op count
+PARTITION = struct.Struct("<16sQQ32sI")
+# kind, old offset, length
+OP = struct.Struct("<BQQ")
+
+OP_COPY = 0
+OP_DIFF = 1
+OP_EXTRA = 2
+OP_NAMES = {OP_COPY: "copy", OP_DIFF: "diff", OP_EXTRA: "extra"}
+
+# Shortest exact match that may start a new alignment
+MIN_MATCH = 32
+# Prefix bytes compared per step of the suffix array search
+SEARCH_WINDOW = 4096
+# Key length used to find match candidates for all new positions at once
+KEY_LENGTH = 8
+# Positions this deep into a run of one byte value are not searched
+RUN_DEPTH = 16
+
+
+def suffix_array(data):
+    """Suffix array of data (a uint8 array) by prefix doubling
+
+    Suffixes are first ranked by their leading four bytes; every round
+    then doubles the compared length but only re-sorts the suffixes that
+    are still tied, so data without long repeats needs one or two cheap
+    rounds.
+    """
+    n = len(data)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Bytes are shifted by one so that the end of the data sorts first
+    padded = np.zeros(n + 3, dtype=np.uint64)
+    padded[:n] = data.astype(np.uint64) + 1
+    key = (padded[:n] << 27) | (padded[1:n + 1] << 18) | (padded[2:n + 2] << 9) | padded[3:n + 3]
+    sa = np.argsort(key, kind="stable")
+    sorted_key = key[sa]
+    positions = np.arange(n, dtype=np.int64)
+
+    # A suffix's rank is the sa index where its group of ties starts
+    boundary = np.ones(n + 1, dtype=bool)
+    boundary[1:n] = sorted_key[1:] != sorted_key[:-1]
+    rank = np.empty(n, dtype=np.int64)
+    rank[sa] = np.maximum.accumulate(np.where(boundary[:n], positions, 0))
+
+    h = 4
+    while True:
+        tied = np.flatnonzero(~(boundary[:n] & boundary[1:]))
+        if not len(tied):
+            return sa
+        members = sa[tied]
+        first = rank[members]
+        following = members + h
+        second = np.where(following < n, rank[np.minimum(following, n - 1)], -1)
+        order = np.lexsort((second, first))
+        members, first, second = members[order], first[order], second[order]
+        sa[tied] = members
+
+        starts = np.ones(len(tied), dtype=bool)
+        starts[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+        boundary[tied] = starts
+        rank[members] = np.maximum.accumulate(np.where(starts, tied, 0))
+        h *= 2
+
+
+def _prefix_keys(data, count):
+    """Big-endian KEY_LENGTH-byte prefix of the first count positions, zero padded"""
+    padded = np.zeros(count + KEY_LENGTH, dtype=np.uint64)
+    padded[:len(data)] = data
+    keys = np.zeros(count, dtype=np.uint64)
+    for i in range(KEY_LENGTH):
+        keys = (keys << np.uint64(8)) | padded[i:i + count]
+    return keys
+
+
+class _Matcher:
+    """Longest-match lookups of new data in an old region"""
+
+    __slots__ = ("old", "new", "old_view", "new_view", "sa", "sorted_keys")
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.old_view = memoryview(old)
+        self.new_view = memoryview(new)
+        self.sa = suffix_array(old)
+        self.sorted_keys = _prefix_keys(old, len(old))[self.sa]
+
+    def candidates(self):
+        """New positions whose first KEY_LENGTH bytes occur in the old region"""
+        count = len(self.new) - KEY_LENGTH + 1
+        if count <= 0 or not len(self.old):
+            return np.zeros(0, dtype=np.int64), None, None
+        keys = _prefix_keys(self.new, count)
+        lo = np.searchsorted(self.sorted_keys, keys, side="left")
+        hi = np.searchsorted(self.sorted_keys, keys, side="right")
+        found = np.flatnonzero(hi > lo)
+
+        # A match found at the start of a run covers the run; without one,
+        # every later position of the run would fail the same way
+        change = np.ones(len(self.new), dtype=bool)
+        change[1:] = self.new[1:] != self.new[:-1]
+        positions = np.arange(len(self.new), dtype=np.int64)
+        depth = positions - np.maximum.accumulate(np.where(change, positions, 0))
+        return found[depth[found] < RUN_DEPTH], lo, hi
+
+    def common_length(self, old_pos, new_pos):
+        """Length of the common prefix of old[old_pos:] and new[new_pos:]"""
+        limit = min(len(self.old) - old_pos, len(self.new) - new_pos)
+        length, step = 0, 64
+        while length < limit:
+            k = min(step, limit - length)
+            if bytes(self.old_view[old_pos + length:old_pos + length + k]) != \
+                    bytes(self.new_view[new_pos + length:new_pos + length + k]):
+                mismatch = np.flatnonzero(self.old[old_pos + length:old_pos + length + k] !=
+                                          self.new[new_pos + length:new_pos + length + k])
+                return length + int(mismatch[0])
+            length += k
+            step = min(step * 4, 1 << 20)
+        return length
+
+    def search(self, new_pos, lo, hi):
+        """(old position, length) of the longest match for new[new_pos:] among sa[lo:hi]"""
+        # The longest match sorts right next to new[new_pos:]
+        hi -= 1
+        if hi - lo > 1:
+            probe = bytes(self.new_view[new_pos:new_pos + SEARCH_WINDOW])
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                start = int(self.sa[mid])
+                if bytes(self.old_view[start:start + SEARCH_WINDOW]) < probe:
+                    lo = mid
+                else:
+                    hi = mid
+        best_pos, best_length = -1, 0
+        for i in range(lo, hi + 1):
+            start = int(self.sa[i])
+            length = self.common_length(start, new_pos)
+            if length > best_length:
+                best_pos, best_length = start, length
+        return best_pos, best_length
+
+
+def _exact_matches(matcher):
+    """Greedy left-to-right exact matches [(new_pos, old_pos, length), ...]"""
+    found, lo, hi = matcher.candidates()
+    matches = []
+    delta = None
+    scan = 0
+    while True:
+        j = int(np.searchsorted(found, scan))
+        if j >= len(found):
+            break
+        position = int(found[j])
+
+        # Staying on the current alignment keeps the difference stream zero
+        best_pos, best_length = -1, 0
+        if delta is not None and 0 <= position + delta < len(matcher.old):
+            best_pos = position + delta
+            best_length = matcher.common_length(best_pos, position)
+        if best_length < MIN_MATCH:
+            old_pos, length = matcher.search(position, int(lo[position]), int(hi[position]))
+            if length > best_length:
+                best_pos, best_length = old_pos, length
+
+        if best_length >= MIN_MATCH or (best_length >= KEY_LENGTH and best_pos - position == delta):
+            matches.append((position, best_pos, best_length))
+            delta = best_pos - position
+            scan = position + best_length
+        else:
+            scan = position + 1
+    return matches
+
+
+def _extension(new, old, new_pos, old_pos, length, backward=False):
+    """Bytes by which a match can be extended with at least half of them matching"""
+    if backward:
+        length = min(length, old_pos)
+        if length <= 0:
+            return 0
+        equal = new[new_pos - length:new_pos][::-1] == old[old_pos - length:old_pos][::-1]
+    else:
+        length = min(length, len(old) - old_pos)
+        if length <= 0:
+            return 0
+        equal = new[new_pos:new_pos + length] == old[old_pos:old_pos + length]
+    score = np.cumsum(equal.astype(np.int64) * 2 - 1)
+    best = int(np.argmax(score))
+    return best + 1 if score[best] > 0 else 0
+
+
+def _approximate_matches(new, old, matches):
+    """Merge exact matches on one alignment and extend them into the gaps"""
+    merged = []
+    for new_pos, old_pos, length in matches:
+        if merged and merged[-1][1] - merged[-1][0] == old_pos - new_pos:
+            first_new, first_old, _ = merged[-1]
+            merged[-1] = [first_new, first_old, new_pos + length - first_new]
+        else:
+            merged.append([new_pos, old_pos, length])
+
+    previous_end = 0
+    for i, region in enumerate(merged):
+        new_pos, old_pos, _ = region
+        gap = new_pos - previous_end
+        if gap:
+            forward = 0
+            if i:
+                last = merged[i - 1]
+                forward = _extension(new, old, previous_end, last[1] + last[2], gap)
+                last[2] += forward
+            backward = _extension(new, old, new_pos, old_pos, gap - forward, backward=True)
+            region[0] -= backward
+            region[1] -= backward
+            region[2] += backward
+        previous_end = region[0] + region[2]
+
+    if merged:
+        last = merged[-1]
+        last[2] += _extension(new, old, previous_end, last[1] + last[2], len(new) - previous_end)
+    return merged
+
+
+def _diff_region(old, old_base, new):
+    """Ops, difference and extra bytes turning old into new
+
+    Op old offsets are relative to the start of the image, old_base being
+    the image offset of old.
+    """
+    ops, diffs, extras = [], [], []
+    position = 0
+    for new_pos, old_pos, length in _approximate_matches(new, old, _exact_matches(_Matcher(old, new))):
+        if new_pos > position:
+            ops.append((OP_EXTRA, 0, new_pos - position))
+            extras.append(new[position:new_pos])
+        ops.append((OP_DIFF, old_base + old_pos, length))
+        diffs.append(new[new_pos:new_pos + length] - old[old_pos:old_pos + length])
+        position = new_pos + length
+    if position < len(new):
+        ops.append((OP_EXTRA, 0, len(new) - position))
+        extras.append(new[position:])
+    return ops, diffs, extras
+
+
+def _trim_fill(data, fill):
+    """Length of data without trailing fill bytes"""
+    payload = np.flatnonzero(data != fill)
+    return int(payload[-1]) + 1 if len(payload) else 0
+
+
+def _partitions(original_path, old_size, new_size):
+    """[(name, offset, size, fill), ...] the patch is split into"""
+    if old_size == new_size:
+        try:
+            with FirmwareImage(original_path) as image:
+                layout = FirmwareLayout.for_image(image)
+                return [(p.name, p.offset, p.capacity, p.fill) for p in layout]
+        except ValueError:
+            pass
+    return [("image", 0, new_size, 0xFF)]
+
+
+def _diff_partition(old, new, offset, size, fill, same_offsets):
+    """Ops, difference and extra bytes for new[offset:offset + size]"""
+    new_part = new[offset:offset + size]
+    old_part = old[offset:offset + size] if same_offsets else old
+    old_base = offset if same_offsets else 0
+
+    # Unchanged head and tail are copied as they are
+    common = min(len(old_part), size)
+    differs = np.flatnonzero(old_part[:common] != new_part[:common])
+    if not len(differs) and len(old_part) == size:
+        return [(OP_COPY, old_base, size)], [], []
+    head = int(differs[0]) if len(differs) else common
+    tail = 0
+    if len(old_part) == size:
+        tail = size - 1 - int(differs[-1])
+
+    # The old partition's padding only adds ties to the suffix array
+    search = old_part[:max(_trim_fill(old_part, fill), head)]
+    ops = [(OP_COPY, old_base, head)] if head else []
+    middle_ops, diffs, extras = _diff_region(search, old_base, new_part[head:size - tail])
+    ops.extend(middle_ops)
+    if tail:
+        ops.append((OP_COPY, old_base + size - tail, tail))
+    return ops, diffs, extras
+
+
+def _compress(data):
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=6)
+
+
+def _concat(parts):
+    return np.concatenate(parts).tobytes() if parts else b""
+
+
+def create_patch(original_path, modified_path, patch_path):
+    """Write a patch turning original_path into modified_path; returns its statistics"""
+    old = np.fromfile(original_path, dtype=np.uint8)
+    new = np.fromfile(modified_path, dtype=np.uint8)
+    partitions = _partitions(original_path, len(old), len(new))
+    same_offsets = partitions[0][0] != "image"
+
+    table, ops, diffs, extras = [], [], [], []
+    stats = {"partitions": {}}
+    for name, offset, size, fill in partitions:
+        part_ops, part_diffs, part_extras = _diff_partition(old, new, offset, size, fill, same_offsets)
+        ops.extend(part_ops)
+        diffs.extend(part_diffs)
+        extras.extend(part_extras)
+        digest = hashlib.sha256(new[offset:offset + size]).digest()
+        table.append(PARTITION.pack(name.encode(), offset, size, digest, len(part_ops)))
+        stats["partitions"][name] = {
+            "changed": part_ops != [(OP_COPY, offset if same_offsets else 0, size)],
+            "ops": len(part_ops),
+            "diff_bytes": sum(len(d) for d in part_diffs),
+            "extra_bytes": sum(len(e) for e in part_extras),
+        }
+
+    streams = [_compress(b"".join(OP.pack(*op) for op in ops)),
+               _compress(_concat(diffs)), _compress(_concat(extras))]
+    header = HEADER.pack(PATCH_MAGIC, PATCH_VERSION, len(table), len(old), len(new),
+                         hashlib.sha256(old).digest(), hashlib.sha256(new).digest(),
+                         *(len(stream) for stream in streams))
+    patch = header + b"".join(table) + b"".join(streams)
+
+    # Never ship a patch that does not reproduce the modified image
+    if not np.array_equal(_apply(old, patch)[0], new):
+        raise ValueError("Patch does not reproduce the modified image")
+
+    directory = os.path.dirname(patch_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.delta.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(patch)
+        os.replace(tmp_path, patch_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    stats.update(patch_size=len(patch), image_size=len(new), ops=len(ops),
+                 ratio=round(len(patch) / len(new), 5) if len(new) else 0.0)
+    return stats
+
+
+def read_patch(patch):
+    """Parse a patch (bytes) into (header dict, partitions, ops, diff, extra)"""
+    if len(patch) < HEADER.size:
+        raise ValueError("Truncated delta patch")
+    magic, version, count, old_size, new_size, old_sha256, new_sha256, *lengths = \
+        HEADER.unpack_from(patch)
+    if magic != PATCH_MAGIC:
+        raise ValueError("Not a firmware delta patch")
+    if version != PATCH_VERSION:
+        raise ValueError(f"Unsupported delta patch version {version}")
+
+    partitions = []
+    position = HEADER.size
+    for _ in range(count):
+        name, offset, size, digest, op_count = PARTITION.unpack_from(patch, position)
+        partitions.append((name.rstrip(b"\0").decode(), offset, size, digest, op_count))
+        position += PARTITION.size
+
+    streams = []
+    for length in lengths:
+        try:
+            streams.append(lzma.decompress(patch[position:position + length]))
+        except lzma.LZMAError as e:
+            raise ValueError(f"Corrupt delta patch: {e}") from None
+        position += length
+    header = {"old_size": old_size, "new_size": new_size,
+              "old_sha256": old_sha256, "new_sha256": new_sha256}
+    return header, partitions, list(OP.iter_unpack(streams[0])), streams[1], streams[2]
+
+
+def _apply(old, patch):
+    """Apply patch (bytes) to old (a uint8 array); returns (new array, partitions)"""
+    header, partitions, ops, diff, extra = read_patch(patch)
+    if len(old) != header["old_size"] or hashlib.sha256(old).digest() != header["old_sha256"]:
+        raise ValueError("Patch was made for a different original image")
+
+    diff = np.frombuffer(diff, dtype=np.uint8)
+    extra = np.frombuffer(extra, dtype=np.uint8)
+    new = np.empty(header["new_size"], dtype=np.uint8)
+    position = diff_pos = extra_pos = 0
+    for kind, old_offset, length in ops:
+        if position + length > len(new):
+            raise ValueError("Delta patch writes past the end of the image")
+        target = new[position:position + length]
+        if kind == OP_COPY:
+            target[:] = old[old_offset:old_offset + length]
+        elif kind == OP_DIFF:
+            np.add(old[old_offset:old_offset + length], diff[diff_pos:diff_pos + length], out=target)
+            diff_pos += length
+        elif kind == OP_EXTRA:
+            target[:] = extra[extra_pos:extra_pos + length]
+            extra_pos += length
+        else:
+            raise ValueError(f"Unknown delta op {kind}")
+        position += length
+    if position != len(new):
+        raise ValueError("Delta patch does not cover the whole image")
+
+    for name, offset, size, digest, _ in partitions:
+        if hashlib.sha256(new[offset:offset + size]).digest() != digest:
+            raise ValueError(f"Partition {name} does not verify after patching")
+    if hashlib.sha256(new).digest() != header["new_sha256"]:
+        raise ValueError("Patched image does not verify")
+    return new, partitions
+
+
+def apply_patch(original_path, patch_path, output_path):
+    """Rebuild the modified image from original_path and a patch; returns its partitions"""
+    with open(patch_path, 'rb') as f:
+        patch = f.read()
+    new, partitions = _apply(np.fromfile(original_path, dtype=np.uint8), patch)
+
+    directory = os.path.dirname(output_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.patched.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(new.data)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return [name for name, *_ in partitions]
+
+
+def describe_patch(patch_path):
+    """Per-partition op summary of a patch"""
+    with open(patch_path, 'rb') as f:
+        patch = f.read()
+    header, partitions, ops, diff, extra = read_patch(patch)
+    summary = []
+    position = 0
+    for name, offset, size, digest, op_count in partitions:
+        part_ops = ops[position:position + op_count]
+        position += op_count
+        summary.append({
+            "name": name,
+            "offset": f"0x{offset:X}",
+            "size": size,
+            "ops": {OP_NAMES[kind]: sum(1 for k, _, _ in part_ops if k == kind) for kind in OP_NAMES},
+            "copied": sum(length for kind, _, length in part_ops if kind == OP_COPY),
+            "diffed": sum(length for kind, _, length in part_ops if kind == OP_DIFF),
+            "extra": sum(length for kind, _, length in part_ops if kind == OP_EXTRA),
+        })
+    return {"patch_size": len(patch), "image_size": header["new_size"], "partitions": summary}
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "diff":
+        stats = create_patch(sys.argv[2], sys.argv[3], sys.argv[4])
+        print(f"Patch: {stats['patch_size']} bytes for a {stats['image_size']} byte image "
+              f"({stats['ratio']:.2%})")
+        for name, part in stats["partitions"].items():
+            state = "changed" if part["changed"] else "copied"
+            print(f"   {name:<8} {state:<8} {part['ops']:>6} ops  {part['diff_bytes']:>9} diff  "
+                  f"{part['extra_bytes']:>9} extra")
+    elif len(sys.argv) == 5 and sys.argv[1] == "apply":
+        apply_patch(sys.argv[2], sys.argv[3], sys.argv[4])
+        print(f"Patched image verified: {sys.argv[4]}")
+    elif len(sys.argv) == 3 and sys.argv[1] == "info":
+        info = describe_patch(sys.argv[2])
+        print(f"Patch: {info['patch_size']} bytes for a {info['image_size']} byte image")
+        for part in info["partitions"]:
+            print(f"   {part['offset']:>10}  {part['name']:<8} copy {part['copied']:>9}  "
+                  f"diff {part['diffed']:>9}  extra {part['extra']:>9}")
+    else:
+        print("Usage: firmware_delta.py diff <original> <modified> <patch>")
+        print("       firmware_delta.py apply <original> <patch> <output>")
+        print("       firmware_delta.py info <patch>")
+
+
+if __name__ == "__main__":
+    main()
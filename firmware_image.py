@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Memory-Mapped Firmware Image
+============================
+
+Shared, zero-copy view of a firmware image (a60.bin, raw NAND/flash dumps,
+carved partitions). The file is mapped read-only and every slice handed out
+is a memoryview into the mapping, so analysis steps can share one image
+object without copying data and resident memory stays flat regardless of
+how large the dump is.
+"""
+
+import mmap
+import os
+import struct
+
+
+class FirmwareImage:
+    """Read-only mmap/memoryview-backed firmware image"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+
+        # mmap refuses zero-length files, fall back to an empty buffer
+        if self.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mmap = None
+        self.view = memoryview(self._mmap if self._mmap is not None else b'')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        """Slice the image without copying (returns a memoryview)"""
+        return self.view[key]
+
+    def slice(self, offset, length=None):
+        """Return a zero-copy view of length bytes starting at offset"""
+        end = self.size if length is None else min(offset + length, self.size)
+        return self.view[offset:end]
+
+    def bytes(self, offset, length):
+        """Copy a small region out of the image (headers, magics)"""
+        return bytes(self.slice(offset, length))
+
+    def unpack_from(self, fmt, offset=0):
+        """struct.unpack_from directly against the mapping"""
+        return struct.unpack_from(fmt, self.view, offset)
+
+    def find(self, sub, start=0, end=None):
+        """Search the mapping without materializing it"""
+        if self._mmap is None:
+            return -1
+        return self._mmap.find(sub, start, self.size if end is None else end)
+
+    def find_all(self, sub, start=0, limit=None):
+        """Yield every offset of sub in the image"""
+        pos = self.find(sub, start)
+        found = 0
+        while pos != -1:
+            yield pos
+            found += 1
+            if limit is not None and found >= limit:
+                return
+            pos = self.find(sub, pos + 1)
+
+    def close(self):
+        """Release the view and unmap the file"""
+        try:
+            self.view.release()
+            if self._mmap is not None:
+                self._mmap.close()
+        except BufferError:
+            # A caller still holds a slice (or a NumPy array over one); the
+            # mapping is released once the last exported view goes away.
+            pass
+        self._file.close()
+
+
+def open_image(path):
+    """Open a firmware image for shared zero-copy analysis"""
+    return FirmwareImage(path)
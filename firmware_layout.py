@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+AK3760 Firmware Layout
+======================
+
+Partition model of a60.bin and an in-place partition patcher.
+
+    0x000000  boot    ANYKAS3C boot image (its length is stored at 0x10)
+    0x007900  kernel  LZMA compressed kernel
+    0x10EA00  logo    LZMA compressed BMHX boot logo
+    0x11EA00  rootfs  SquashFS root filesystem
+    0x590000  voice   SquashFS voice prompts (to the end of the image)
+
+rebuild_image() patches replacement partitions into an mmap'd copy of the
+original. Only chunks that differ from what the output already holds are
+written, and the rest of a partition past a shorter payload is reset to
+the partition's fill byte. Partitions that already match the original, as
+recorded in the layout manifest written next to the output, are not read
+at all. A partition may name header fields holding its size and CRC32,
+and these are recomputed after patching. The ANYKAS3C header has no such
+fields for the AK3760 partitions, so per-partition sizes and CRC32s are
+kept in the manifest instead.
+
+Usage: firmware_layout.py <image>
+"""
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import struct
+import zlib
+
+from firmware_image import FirmwareImage
+from workspace import reflink
+
+ANYKA_MAGIC = b"ANYKAS3C"
+ANYKA_MAGIC_OFFSET = 4
+BOOT_LENGTH_OFFSET = 0x10
+SQUASHFS_MAGIC = b"hsqs"
+
+# Compare/write granularity when patching
+PATCH_CHUNK = 64 * 1024
+
+MANIFEST_VERSION = 1
+
+
+class Partition:
+    """One region of the image"""
+
+    __slots__ = ("name", "offset", "capacity", "kind", "fill", "size_field", "crc_field")
+
+    def __init__(self, name, offset, capacity, kind, fill=0xFF, size_field=None, crc_field=None):
+        self.name = name
+        self.offset = offset
+        self.capacity = capacity
+        self.kind = kind
+        self.fill = fill
+        self.size_field = size_field
+        self.crc_field = crc_field
+
+    @property
+    def end(self):
+        return self.offset + self.capacity
+
+    @property
+    def carved_name(self):
+        """Name binwalk gives the region when carving it"""
+        return f"{self.offset:X}"
+
+    def __repr__(self):
+        return f"Partition({self.name!r}, 0x{self.offset:X}, 0x{self.capacity:X}, {self.kind!r})"
+
+
+# (name, offset, kind); capacities run to the next partition or the image end
+AK3760_PARTITIONS = (
+    ("boot", 0x000000, "anyka"),
+    ("kernel", 0x007900, "lzma"),
+    ("logo", 0x10EA00, "lzma"),
+    ("rootfs", 0x11EA00, "squashfs"),
+    ("voice", 0x590000, "squashfs"),
+)
+
+
+def partition_ranges(image_size, table=AK3760_PARTITIONS):
+    """[(name, offset, end), ...] for an image of image_size bytes"""
+    ranges = []
+    for i, (name, offset, _) in enumerate(table):
+        end = table[i + 1][1] if i + 1 < len(table) else image_size
+        if end > image_size:
+            raise ValueError(f"Image too small for partition {name} at 0x{offset:X}")
+        ranges.append((name, offset, end))
+    return ranges
+
+
+class FirmwareLayout:
+    """Partition table of an AK3760 image"""
+
+    def __init__(self, partitions, image_size):
+        self.partitions = list(partitions)
+        self.image_size = image_size
+
+    @classmethod
+    def for_image(cls, image, table=AK3760_PARTITIONS):
+        """Layout for a FirmwareImage; raises ValueError if it is not an ANYKA image"""
+        if image.bytes(ANYKA_MAGIC_OFFSET, len(ANYKA_MAGIC)) != ANYKA_MAGIC:
+            raise ValueError("Not an ANYKAS3C firmware image")
+        size = len(image)
+        partitions = []
+        for (name, offset, end), (_, _, kind) in zip(partition_ranges(size, table), table):
+            # Padding after a payload looks like the partition's last byte
+            partitions.append(Partition(name, offset, end - offset, kind, fill=image.view[end - 1]))
+        return cls(partitions, size)
+
+    def __iter__(self):
+        return iter(self.partitions)
+
+    def partition(self, key):
+        """Partition by name, carved name (e.g. '11EA00') or offset"""
+        for partition in self.partitions:
+            if key in (partition.name, partition.carved_name, partition.offset):
+                return partition
+        raise KeyError(key)
+
+    def used_size(self, image, partition):
+        """Bytes of the partition holding payload (squashfs bytes_used, else capacity)"""
+        if partition.kind == "squashfs" and image.bytes(partition.offset, 4) == SQUASHFS_MAGIC:
+            bytes_used, = image.unpack_from("<Q", partition.offset + 40)
+            return bytes_used
+        if partition.kind == "anyka":
+            boot_length, = image.unpack_from("<I", partition.offset + BOOT_LENGTH_OFFSET)
+            if boot_length <= partition.capacity:
+                return boot_length
+        return partition.capacity
+
+    def validate(self, partition, payload):
+        """Raise ValueError if payload cannot go into partition"""
+        if len(payload) > partition.capacity:
+            raise ValueError(f"{partition.name} payload is {len(payload)} bytes, "
+                             f"partition holds {partition.capacity}")
+        if partition.kind == "squashfs" and bytes(payload[:4]) != SQUASHFS_MAGIC:
+            raise ValueError(f"{partition.name} payload is not a squashfs image")
+        if partition.kind == "anyka" and bytes(payload[4:12]) != ANYKA_MAGIC:
+            raise ValueError(f"{partition.name} payload is not an ANYKAS3C boot image")
+
+    def describe(self, image):
+        return [{
+            "name": p.name,
+            "offset": f"0x{p.offset:X}",
+            "capacity": p.capacity,
+            "used": self.used_size(image, p),
+            "kind": p.kind,
+        } for p in self.partitions]
+
+
+def _payload_size(partition, payload):
+    """Meaningful payload length (squashfs images are trimmed to bytes_used)"""
+    if partition.kind == "squashfs" and len(payload) >= 48:
+        bytes_used, = struct.unpack_from("<Q", payload, 40)
+        return min(len(payload), bytes_used + (-bytes_used % 4096))
+    return len(payload)
+
+
+def _patch(out, offset, payload, stats):
+    """Write payload at offset, touching only chunks that differ"""
+    view = memoryview(payload)
+    for start in range(0, len(view), PATCH_CHUNK):
+        chunk = view[start:start + PATCH_CHUNK]
+        position = offset + start
+        if out[position:position + len(chunk)] != chunk:
+            out[position:position + len(chunk)] = chunk
+            stats["bytes_written"] += len(chunk)
+        stats["bytes_compared"] += len(chunk)
+
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def _base_identity(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def rebuild_image(original_path, output_path, replacements):
+    """Patch replacement partitions into output_path, a copy of original_path
+
+    replacements maps a partition name (or carved name) to a file path or
+    bytes. The output is created by copying (reflinking where possible)
+    the original only if it does not already derive from it. Returns
+    build statistics; the layout manifest is saved as
+    <output_path>.layout.json.
+    """
+    manifest_path = f"{output_path}.layout.json"
+    base = _base_identity(original_path)
+    manifest = _load_manifest(manifest_path)
+    stats = {"created": False, "bytes_written": 0, "bytes_compared": 0, "partitions": {}}
+
+    with FirmwareImage(original_path) as original:
+        layout = FirmwareLayout.for_image(original)
+
+        # Resolve payloads before touching the output
+        payloads = {}
+        for key, source in replacements.items():
+            partition = layout.partition(key)
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                data = bytes(source)
+            else:
+                with open(source, 'rb') as f:
+                    data = f.read()
+            data = data[:_payload_size(partition, data)]
+            layout.validate(partition, data)
+            payloads[partition.name] = (data, source if isinstance(source, str) else "<bytes>")
+
+        reusable = (manifest is not None and manifest.get("base") == base
+                    and os.path.isfile(output_path)
+                    and os.path.getsize(output_path) == layout.image_size)
+        if not reusable:
+            try:
+                reflink(original_path, output_path)
+            except OSError:
+                shutil.copyfile(original_path, output_path)
+            stats["created"] = True
+            manifest = {"version": MANIFEST_VERSION, "base": base, "partitions": {}}
+        previous = manifest["partitions"]
+
+        with open(output_path, 'r+b') as f:
+            out = mmap.mmap(f.fileno(), 0)
+            try:
+                for partition in layout:
+                    entry = previous.get(partition.name)
+                    if partition.name in payloads:
+                        data, source = payloads[partition.name]
+                    elif entry is None or entry["source"] == "original":
+                        # Untouched since the output was copied from the original
+                        used = layout.used_size(original, partition)
+                        previous[partition.name] = entry or {
+                            "source": "original", "size": used,
+                            "crc32": zlib.crc32(original.view[partition.offset:partition.offset + used]),
+                        }
+                        continue
+                    else:
+                        # Replaced in an earlier rebuild; restore the original
+                        data = original.bytes(partition.offset, partition.capacity)
+                        source = "original"
+
+                    _patch(out, partition.offset, data, stats)
+                    old_size = entry["size"] if entry else layout.used_size(original, partition)
+                    if old_size > len(data):
+                        tail = partition.offset + len(data)
+                        _patch(out, tail, bytes([partition.fill]) * (old_size - len(data)), stats)
+
+                    size = len(data) if source != "original" else layout.used_size(original, partition)
+                    crc = zlib.crc32(data[:size])
+                    if partition.size_field is not None:
+                        struct.pack_into("<I", out, partition.size_field, size)
+                    if partition.crc_field is not None:
+                        struct.pack_into("<I", out, partition.crc_field, crc)
+                    previous[partition.name] = {"source": source, "size": size, "crc32": crc}
+                    stats["partitions"][partition.name] = {
+                        "size": size, "capacity": partition.capacity,
+                        "free": partition.capacity - size, "crc32": f"{crc:08x}"}
+                out.flush()
+            finally:
+                out.close()
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return stats
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: firmware_layout.py <image>")
+        return
+    with FirmwareImage(sys.argv[1]) as image:
+        layout = FirmwareLayout.for_image(image)
+        for entry in layout.describe(image):
+            print(f"{entry['offset']:>10}  {entry['name']:<8} {entry['kind']:<9} "
+                  f"{entry['used']:>9} / {entry['capacity']:<9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,36 +18,92 @@ Device Specifications:
 import os
 import shutil
 import subprocess
-import struct
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from config_document import ConfigDocument
+from startup_composer import StartupComposer
+from workspace import Workspace, break_link
+from squashfs_writer import SquashfsWriter
+from squashfs_reader import SquashfsReader, SquashfsError
+from firmware_layout import FirmwareLayout, rebuild_image
+from firmware_image import FirmwareImage
+from firmware_backup import backup_firmware
+from firmware_delta import create_patch
+from artifact_store import build_key
+from resource_bin import ResourceContainer, ResourceError
+
+# Where binwalk found the root filesystem and the voice prompts in a60.bin
+ROOTFS_OFFSET = 0x11EA00
+VOICE_OFFSET = 0x590000
+
+# The original voice partition uses 4K blocks
+VOICE_BLOCK_SIZE = 4096
+
+
+def _reencode_prompt(job):
+    """Re-encode one MP3 with ffmpeg, keeping the result only if it is smaller
+    
+    Returns (old size, new size).
+    """
+    path, bitrate, mono = job
+    tmp_path = f"{path}.reencode.mp3"
+    command = ['ffmpeg', '-v', 'error', '-y', '-i', path, '-map_metadata', '-1',
+               '-write_xing', '0', '-id3v2_version', '0', '-codec:a', 'libmp3lame']
+    if bitrate:
+        command += ['-b:a', f'{bitrate}k']
+        # MPEG-1 stops at 32 kbps; lower rates need MPEG-2 sample rates
+        if bitrate < 32:
+            command += ['-ar', '22050']
+    if mono:
+        command += ['-ac', '1']
+    
+    old_size = os.path.getsize(path)
+    result = subprocess.run(command + [tmp_path], capture_output=True, text=True)
+    if result.returncode != 0 or not os.path.exists(tmp_path):
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return old_size, old_size
+    new_size = os.path.getsize(tmp_path)
+    if new_size >= old_size:
+        os.unlink(tmp_path)
+        return old_size, old_size
+    # Replacing the path never touches an inode shared with the extraction
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+    return old_size, new_size
 
 class FirmwareModifier:
-    def __init__(self, firmware_path="a60.bin"):
+    def __init__(self, firmware_path="a60.bin", modified_dir="_a60_modified", store=None):
         self.firmware_path = firmware_path
         self.extract_dir = "_a60.bin"
-        self.modified_dir = "_a60_modified"
+        self.modified_dir = modified_dir
         self.backup_dir = "_a60_backup"
         
+        # Optional ArtifactStore; build_key names this build's outputs in it
+        self.store = store
+        self.build_key = None
+        
+        # Parsed usr/config.txt, run_app.sh composer and edit_transaction() depth
+        self._config = None
+        self._startup = None
+        self._batch_depth = 0
+        
     def backup_original(self):
         """Create backup of original firmware"""
         print("🔒 Creating backup of original firmware...")
         if not os.path.exists(self.backup_dir):
             os.makedirs(self.backup_dir)
         
-        # Backup original bin file
-        shutil.copy2(self.firmware_path, f"{self.backup_dir}/original_a60.bin")
-        
-        # Calculate and store hash
-        with open(self.firmware_path, 'rb') as f:
-            original_hash = hashlib.sha256(f.read()).hexdigest()
-        
-        with open(f"{self.backup_dir}/original_hash.txt", 'w') as f:
-            f.write(f"SHA256: {original_hash}\n")
-            f.write(f"Original file: {self.firmware_path}\n")
+        # Copy and hash in one streaming pass
+        manifest = backup_firmware(self.firmware_path, f"{self.backup_dir}/original_a60.bin",
+                                   f"{self.backup_dir}/backup_manifest.json")
+        original_hash = manifest["digests"]["sha256"]
         
         print(f"✅ Backup created in {self.backup_dir}/")
         print(f"   Original hash: {original_hash[:16]}...")
+        print(f"   Manifest: {self.backup_dir}/backup_manifest.json "
+              f"({len(manifest['partitions'])} partition hashes)")
         
     def extract_firmware(self):
         """Extract firmware using binwalk"""
@@ -57,6 +113,14 @@ class FirmwareModifier:
             print(f"   Extraction directory {self.extract_dir} already exists")
             return
         
+        # Same image extracted before: restore the tree instead of running binwalk
+        artifact = None
+        if self.store is not None:
+            artifact = f"{build_key(self.firmware_path, stage='extract')}-extracted"
+            if self.store.get_tree(artifact, self.extract_dir):
+                print("♻️  Extraction restored from artifact store")
+                return
+        
         # Use binwalk to extract
         result = subprocess.run([
             'binwalk', '-e', '--preserve-symlinks', 
@@ -65,66 +129,120 @@ class FirmwareModifier:
         
         if result.returncode == 0:
             print("✅ Firmware extracted successfully")
+            if artifact is not None:
+                self.store.put_tree(artifact, self.extract_dir)
         else:
             print(f"❌ Extraction failed: {result.stderr}")
             
-    def prepare_modification_env(self):
-        """Prepare environment for modifications"""
+    def prepare_modification_env(self, mode="auto"):
+        """Prepare environment for modifications
+        
+        The modification tree is a copy-on-write clone of the extraction:
+        files are reflinked or hardlinked and only get a private copy when
+        a modifier writes to them. Use mode="copy" for a full physical copy.
+        """
         print("🛠️  Preparing modification environment...")
         
         if os.path.exists(self.modified_dir):
             shutil.rmtree(self.modified_dir)
         
-        # Copy extracted files to modification directory (preserve symlinks)
-        shutil.copytree(self.extract_dir, self.modified_dir, symlinks=True, ignore_dangling_symlinks=True)
+        # Clone extracted files into the modification directory (symlinks preserved)
+        stats = Workspace(self.extract_dir, self.modified_dir).create(mode)
+        self._config = None
+        self._startup = None
+        
         print(f"✅ Modification environment ready in {self.modified_dir}/")
+        print(f"   {stats['reflinked']} reflinked, {stats['hardlinked']} hardlinked, "
+              f"{stats['copied']} copied, {stats['symlinks']} symlinks")
+        
+    def _config_document(self):
+        """Parsed usr/config.txt of the modification tree (loaded once)"""
+        config_path = f"{self.modified_dir}/squashfs-root/usr/config.txt"
+        
+        if self._config is None or self._config.path != config_path:
+            if not os.path.exists(config_path):
+                return None
+            self._config = ConfigDocument(config_path)
+        return self._config
+        
+    def _startup_composer(self):
+        """Composer for etc/run_app.sh, rendered against the pristine extraction"""
+        script_path = f"{self.modified_dir}/squashfs-root/etc/run_app.sh"
+        
+        if self._startup is None or self._startup.script_path != script_path:
+            original_path = f"{self.extract_dir}/squashfs-root/etc/run_app.sh"
+            if not os.path.exists(original_path):
+                original_path = script_path
+            self._startup = StartupComposer(script_path, original_path)
+        return self._startup
+        
+    def startup_fragments(self):
+        """Named run_app.sh fragments of this build, to seed derived builds"""
+        return dict(self._startup_composer().fragments)
+        
+    def seed_startup_fragments(self, fragments):
+        """Start from fragments already rendered into this tree's run_app.sh"""
+        self._startup_composer().restore(fragments)
+        
+    @contextmanager
+    def edit_transaction(self):
+        """Batch modify_config() and modify_startup_script() calls
+        
+        config.txt and run_app.sh are each written once, atomically, when the
+        outermost block exits; pending edits are discarded if it raises.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                for document in (self._config, self._startup):
+                    if document is not None:
+                        document.rollback()
+            raise
+        
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self.commit_edits()
+        
+    def commit_edits(self):
+        """Flush pending configuration and startup script changes to disk"""
+        if self._config is not None and self._config.commit():
+            print(f"💾 Configuration written: {self._config.path}")
+        if self._startup is not None and self._startup.write():
+            print(f"💾 Startup script written: {self._startup.script_path}")
         
     def modify_config(self, modifications):
         """Modify device configuration"""
         print("⚙️  Modifying device configuration...")
         
-        config_path = f"{self.modified_dir}/squashfs-root/usr/config.txt"
+        config = self._config_document()
         
-        if not os.path.exists(config_path):
-            print(f"❌ Config file not found: {config_path}")
+        if config is None:
+            print(f"❌ Config file not found: {self.modified_dir}/squashfs-root/usr/config.txt")
             return
             
-        # Read current config
-        with open(config_path, 'r') as f:
-            lines = f.readlines()
-        
-        # Apply modifications
-        modified_lines = []
-        for line in lines:
-            line_modified = False
-            for key, value in modifications.items():
-                if line.startswith(f"{key}="):
-                    modified_lines.append(f"{key}={value}\n")
-                    print(f"   Modified: {key}={value}")
-                    line_modified = True
-                    break
-            
-            if not line_modified:
-                modified_lines.append(line)
-        
-        # Add new settings if they don't exist
-        existing_keys = {line.split('=')[0] for line in lines if '=' in line}
-        for key, value in modifications.items():
-            if key not in existing_keys:
-                modified_lines.append(f"{key}={value}\n")
+        # Apply modifications in memory
+        for key, value, action in config.update(modifications):
+            if action == "modified":
+                print(f"   Modified: {key}={value}")
+            elif action == "added":
                 print(f"   Added: {key}={value}")
         
-        # Write modified config
-        with open(config_path, 'w') as f:
-            f.writelines(modified_lines)
+        # Outside a transaction every call is written straight away
+        if self._batch_depth == 0:
+            config.commit()
             
         print("✅ Configuration modified successfully")
         
-    def modify_startup_script(self, custom_commands=None):
-        """Modify the startup script"""
-        print("🚀 Modifying startup script...")
+    def modify_startup_script(self, custom_commands=None, name=None, priority=None):
+        """Modify the startup script
         
-        script_path = f"{self.modified_dir}/squashfs-root/etc/run_app.sh"
+        Each call adds (or replaces) a named fragment; the script is always
+        rendered against the original run_app.sh, so calls do not stack.
+        """
+        print("🚀 Modifying startup script...")
         
         if custom_commands is None:
             custom_commands = [
@@ -134,19 +252,17 @@ class FirmwareModifier:
                 "# Original startup"
             ]
         
-        # Read original script
-        with open(script_path, 'r') as f:
-            original_lines = f.readlines()
-        
-        # Create modified script
-        modified_script = ["#!/bin/sh\n", "\n"]
-        modified_script.extend([cmd + "\n" for cmd in custom_commands])
-        modified_script.append("\n")
-        modified_script.extend(original_lines[2:])  # Skip original shebang and empty line
+        composer = self._startup_composer()
+        if name is None:
+            name = f"fragment{len(composer.fragments) + 1}"
+        if priority is None:
+            composer.add(name, custom_commands)
+        else:
+            composer.add(name, custom_commands, priority)
         
-        # Write modified script
-        with open(script_path, 'w') as f:
-            f.writelines(modified_script)
+        # Outside a transaction the script is rendered and written right away
+        if self._batch_depth == 0:
+            composer.write()
             
         print("✅ Startup script modified")
         
@@ -157,18 +273,83 @@ class FirmwareModifier:
         full_target = f"{self.modified_dir}/squashfs-root{target_path}"
         os.makedirs(os.path.dirname(full_target), exist_ok=True)
         
+        # Never write through a link shared with the extraction tree
+        break_link(full_target, keep_content=False)
         shutil.copy2(binary_path, full_target)
         os.chmod(full_target, 0o755)  # Make executable
         
         print("✅ Custom binary added")
         
-    def repack_filesystem(self):
-        """Repack the modified filesystem"""
+    def replace_resource(self, name, source_path, strict=True):
+        """Swap one entry of usr/resource.bin (UI bitmap, font, sound)
+        
+        Only the entry's slot and table record are written; the rest of
+        the 2.9 MB container is left alone. With strict, bitmaps must keep
+        their geometry and depth.
+        """
+        print(f"🎨 Replacing resource: {name} <- {source_path}")
+        
+        resource_path = f"{self.modified_dir}/squashfs-root/usr/resource.bin"
+        try:
+            with ResourceContainer(resource_path) as container:
+                mode = container.replace_file(name, source_path, strict)
+        except (OSError, KeyError, ResourceError) as e:
+            print(f"❌ Resource replacement failed: {e}")
+            return None
+        
+        print(f"✅ Resource {name} replaced ({mode.replace('_', ' ')})")
+        return resource_path
+        
+    def _original_rootfs(self):
+        """Reader for the original root filesystem image, or None"""
+        return self._open_base([(self.firmware_path, ROOTFS_OFFSET),
+                                (f"{self.extract_dir}/{ROOTFS_OFFSET:X}.squashfs", 0)])
+        
+    def _open_base(self, candidates):
+        """Reader for the first readable (path, offset) squashfs image, or None"""
+        for path, offset in candidates:
+            if os.path.isfile(path):
+                try:
+                    return SquashfsReader(path, offset)
+                except (OSError, SquashfsError):
+                    continue
+        return None
+        
+    def repack_filesystem(self, native=True, workers=None, incremental=True, base_image=None):
+        """Repack the modified filesystem
+        
+        The built-in writer compresses on a process pool and produces
+        byte-identical images for identical trees; native=False uses
+        mksquashfs instead. With incremental, files whose content matches
+        the original rootfs (or the squashfs image base_image, e.g. a
+        shared base the tree was cloned from) keep its compressed blocks.
+        """
         print("📦 Repacking modified filesystem...")
         
         squashfs_path = f"{self.modified_dir}/11EA00_modified.squashfs"
         root_path = f"{self.modified_dir}/squashfs-root"
         
+        if native:
+            base = None
+            if incremental:
+                base = self._open_base([(base_image, 0)]) if base_image else self._original_rootfs()
+            try:
+                writer = SquashfsWriter(root_path, 'lzma', 65536, workers=workers, base=base)
+                stats = writer.write(squashfs_path)
+            except (OSError, ValueError) as e:
+                print(f"❌ Repacking failed: {e}")
+                return None
+            finally:
+                if base is not None:
+                    base.close()
+            print(f"✅ Filesystem repacked successfully ({stats['inodes']} inodes, "
+                  f"{stats['bytes_used']} bytes, {stats['workers']} workers, {stats['seconds']}s)")
+            if stats['reused_files']:
+                print(f"   ♻️  Reused {stats['reused_blocks']} compressed blocks from "
+                      f"{stats['reused_files']} unchanged files")
+            self._store_artifact("rootfs", squashfs_path)
+            return squashfs_path
+        
         # Create new SquashFS
         result = subprocess.run([
             'mksquashfs', root_path, squashfs_path,
@@ -182,25 +363,158 @@ class FirmwareModifier:
             print(f"❌ Repacking failed: {result.stderr}")
             return None
             
-    def rebuild_firmware(self):
-        """Rebuild complete firmware file"""
+    def prune_languages(self, languages, bitrate=None, mono=False, workers=None):
+        """Rebuild the voice partition with only the given language packs
+        
+        The kept language directories of squashfs-root-0 are cloned into
+        the modification tree. With bitrate (kbps) or mono, their prompts
+        are re-encoded with ffmpeg on a thread pool; a prompt keeps its
+        original encoding unless the result is smaller. The tree is packed
+        into 590000_modified.squashfs, which rebuild_firmware() picks up as
+        the voice partition.
+        """
+        print(f"🗣️  Pruning voice prompts to: {', '.join(languages)}")
+        
+        source = f"{self.extract_dir}/squashfs-root-0"
+        voice_root = f"{self.modified_dir}/squashfs-root-0"
+        squashfs_path = f"{self.modified_dir}/{VOICE_OFFSET:X}_modified.squashfs"
+        
+        if not os.path.isdir(source):
+            print(f"❌ {source} not found")
+            return None
+        available = sorted(name for name in os.listdir(source) if os.path.isdir(f"{source}/{name}"))
+        unknown = [language for language in languages if language not in available]
+        if unknown or not languages:
+            print(f"❌ Unknown language(s): {', '.join(unknown) or '(none given)'}; "
+                  f"available: {', '.join(available)}")
+            return None
+        
+        if os.path.exists(voice_root):
+            shutil.rmtree(voice_root)
+        for language in languages:
+            Workspace(f"{source}/{language}", f"{voice_root}/{language}").create()
+        shutil.copystat(source, voice_root)
+        
+        prompts = sorted(f"{dirpath}/{name}" for dirpath, _, names in os.walk(voice_root)
+                         for name in names if name.lower().endswith(".mp3"))
+        original_bytes = sum(os.path.getsize(path) for path in prompts)
+        prompt_bytes = original_bytes
+        if bitrate or mono:
+            if shutil.which('ffmpeg') is None:
+                print("⚠️  ffmpeg not found, keeping the original encoding")
+            else:
+                with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+                    sizes = list(pool.map(_reencode_prompt, [(path, bitrate, mono) for path in prompts]))
+                prompt_bytes = sum(new for _, new in sizes)
+                print(f"   Re-encoded {sum(1 for old, new in sizes if new < old)}/{len(prompts)} prompts: "
+                      f"{original_bytes} -> {prompt_bytes} bytes")
+        
+        # A previous pruned image shares every unchanged prompt's blocks
+        base = self._open_base([(squashfs_path, 0), (self.firmware_path, VOICE_OFFSET),
+                                (f"{self.extract_dir}/{VOICE_OFFSET:X}.squashfs", 0)])
+        try:
+            writer = SquashfsWriter(voice_root, 'lzma', VOICE_BLOCK_SIZE, workers=workers, base=base)
+            stats = writer.write(squashfs_path)
+        except (OSError, ValueError) as e:
+            print(f"❌ Voice partition packing failed: {e}")
+            return None
+        finally:
+            if base is not None:
+                base.close()
+        
+        print(f"✅ Voice partition packed: {len(prompts)} prompts in {len(languages)} language(s), "
+              f"{stats['bytes_used']} bytes")
+        try:
+            with FirmwareImage(self.firmware_path) as image:
+                layout = FirmwareLayout.for_image(image)
+                voice = layout.partition("voice")
+                original_size = layout.used_size(image, voice)
+            print(f"   Partition: {stats['bytes_used']} of {voice.capacity} bytes "
+                  f"(original {original_size}, {original_size - stats['bytes_used']} saved)")
+        except (OSError, ValueError, KeyError):
+            pass
+        return squashfs_path
+        
+    def rebuild_firmware(self, replacements=None):
+        """Rebuild complete firmware file
+        
+        Patches the replaced partitions (by default the repacked rootfs and,
+        if present, a repacked voice partition) into a copy of the original
+        image, writing only the bytes that differ from the previous build.
+        """
         print("🔨 Rebuilding firmware file...")
         
-        # This is a simplified rebuild - in practice, you'd need to:
-        # 1. Maintain exact structure and offsets
-        # 2. Recalculate checksums
-        # 3. Update headers appropriately
+        output_path = f"{self.modified_dir}/a60_modified.bin"
+        
+        if replacements is None:
+            replacements = {}
+            for name, carved in (("rootfs", "11EA00"), ("voice", "590000")):
+                path = f"{self.modified_dir}/{carved}_modified.squashfs"
+                if os.path.exists(path):
+                    replacements[name] = path
+        
+        try:
+            stats = rebuild_image(self.firmware_path, output_path, replacements)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ Rebuild failed: {e}")
+            return None
         
-        print("⚠️  WARNING: Firmware rebuilding requires careful offset management")
-        print("   This is a template - implement based on specific firmware structure")
+        for name, info in stats["partitions"].items():
+            print(f"   {name}: {info['size']} bytes, {info['free']} free, crc32 {info['crc32']}")
+        action = "created" if stats["created"] else "updated in place"
+        print(f"   Output {action}: {stats['bytes_written']} bytes written")
+        self._store_artifact("firmware", output_path)
+        print(f"✅ Modified firmware saved as: {output_path}")
+        return output_path
+        
+    def create_delta(self):
+        """Write a delta patch turning the original firmware into the rebuilt one
+        
+        Devices that already run the original image only need the patch,
+        which holds nothing for partitions the build left untouched.
+        """
+        print("📦 Creating delta patch...")
         
-        # Template for firmware rebuild
         output_path = f"{self.modified_dir}/a60_modified.bin"
+        patch_path = f"{self.modified_dir}/a60_modified.delta"
         
-        # Copy original and patch specific sections
-        shutil.copy2(self.firmware_path, output_path)
+        try:
+            stats = create_patch(self.firmware_path, output_path, patch_path)
+        except (OSError, ValueError) as e:
+            print(f"❌ Delta patch failed: {e}")
+            return None
         
-        print(f"✅ Modified firmware saved as: {output_path}")
+        changed = [name for name, info in stats["partitions"].items() if info["changed"]]
+        print(f"   {stats['patch_size']} bytes ({stats['ratio']:.2%} of the image), "
+              f"changed partitions: {', '.join(changed) or 'none'}")
+        print(f"✅ Delta patch saved as: {patch_path}")
+        return patch_path
+        
+    def _store_artifact(self, kind, path):
+        if self.store is not None and self.build_key is not None:
+            self.store.put_file(f"{self.build_key}-{kind}", path)
+        
+    def restore_build(self):
+        """Restore the repacked rootfs and firmware of build_key from the store
+        
+        Returns the firmware path on a hit, None otherwise.
+        """
+        if self.store is None or self.build_key is None:
+            return None
+        
+        squashfs_path = f"{self.modified_dir}/11EA00_modified.squashfs"
+        output_path = f"{self.modified_dir}/a60_modified.bin"
+        if not (self.store.has(f"{self.build_key}-rootfs") and self.store.has(f"{self.build_key}-firmware")):
+            return None
+        if not (self.store.get_file(f"{self.build_key}-rootfs", squashfs_path)
+                and self.store.get_file(f"{self.build_key}-firmware", output_path)):
+            return None
+        
+        # The restored image did not come from an in-place rebuild
+        layout_manifest = f"{output_path}.layout.json"
+        if os.path.exists(layout_manifest):
+            os.unlink(layout_manifest)
+        print(f"♻️  Build {self.build_key[:16]} restored from artifact store")
         return output_path
 
 def main():
@@ -262,8 +576,12 @@ def main():
         firmware_path = modifier.rebuild_firmware()
         print()
         
+        patch_path = firmware_path and modifier.create_delta()
+        print()
+        
         print("🎉 MODIFICATION COMPLETE!")
         print(f"   Modified firmware: {firmware_path}")
+        print(f"   Delta patch: {patch_path}")
         print(f"   Original backup: {modifier.backup_dir}/original_a60.bin")
         print()
         print("⚠️  IMPORTANT SAFETY NOTES:")
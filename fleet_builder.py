@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+EN-818/EN-818T Fleet Builder
+============================
+
+Builds one firmware image per device from a template profile and a list
+of per-device overrides (CSV or JSON). The template is applied once to a
+shared base tree; every variant is then a copy-on-write clone of that
+base in which only the per-device files are rewritten (usr/config.txt and,
+for network overrides, etc/run_app.sh). Variants are repacked and
+patched into their own image on a process pool, and a build manifest
+records every output. With an artifact store, a variant whose inputs are
+unchanged since an earlier build is restored instead of rebuilt, and the
+stored variant images share every chunk outside the rewritten files.
+
+Override columns / keys:
+- serial (required, unique): config.txt serial, also names the output
+- static_ip, subnet_mask, gateway, dns_server, tcp_port, dhcp_enabled:
+  merged into the template's network settings; a static_ip without
+  dhcp_enabled switches the device to a static address
+- device_name: config.txt device_name
+- anything else (or a JSON "config" object): raw config.txt keys
+
+Usage: fleet_builder.py <devices.csv|devices.json> [profile.json] [output_dir] [workers]
+"""
+
+import io
+import os
+import re
+import csv
+import sys
+import json
+import time
+import shutil
+import hashlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from en818_modifier import EN818Modifier, apply_profile, profile_files
+from workspace import Workspace
+from artifact_store import ArtifactStore, build_key, derive_key
+
+NETWORK_FIELDS = ("dhcp_enabled", "static_ip", "subnet_mask", "gateway", "dns_server", "tcp_port")
+MANIFEST_VERSION = 1
+_TRUE = ("1", "true", "yes", "on")
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in _TRUE
+    return bool(value)
+
+
+def device_overrides(row):
+    """Normalize one CSV row or JSON object into {serial, network, config}"""
+    row = {key.strip(): value for key, value in row.items()
+           if key and value is not None and value != ""}
+    config = dict(row.pop("config", None) or {})
+
+    serial = str(row.pop("serial", "")).strip()
+    if not serial:
+        raise ValueError(f"Device entry without a serial: {row}")
+
+    network = {key: row.pop(key) for key in NETWORK_FIELDS if key in row}
+    if "dhcp_enabled" in network:
+        network["dhcp_enabled"] = _parse_bool(network["dhcp_enabled"])
+    elif "static_ip" in network:
+        network["dhcp_enabled"] = False
+
+    # Remaining columns are config.txt keys as they are
+    config.update(row)
+    config["serial"] = serial
+    return {"serial": serial, "network": network,
+            "config": {key: str(value) for key, value in config.items()}}
+
+
+def load_devices(path):
+    """Per-device overrides from a CSV file or a JSON list"""
+    if path.lower().endswith(".json"):
+        with open(path, 'r') as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.get("devices", [])
+    else:
+        with open(path, 'r', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    devices = [device_overrides(row) for row in rows]
+    seen = set()
+    for device in devices:
+        if device["serial"] in seen:
+            raise ValueError(f"Duplicate serial: {device['serial']}")
+        seen.add(device["serial"])
+    return devices
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _build_variant(job):
+    """Worker: clone the base tree, apply one device's overrides, repack and rebuild
+    
+    A restore_only job only tries the artifact store and reports a miss
+    instead of building, since the base tree may not exist yet.
+    """
+    start = time.perf_counter()
+    result = {"serial": job["serial"], "directory": job["variant_dir"],
+              "network": job["overrides"]["network"], "config": job["overrides"]["config"]}
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            variant_dir = job["variant_dir"]
+            store = ArtifactStore(job["store_root"]) if job["store_root"] else None
+            modifier = EN818Modifier(job["firmware_path"], variant_dir, store)
+            modifier.build_key = job["build_key"]
+
+            firmware_path = modifier.restore_build()
+            squashfs_path = f"{variant_dir}/11EA00_modified.squashfs"
+            result["cached"] = firmware_path is not None
+            if firmware_path is None and job["restore_only"]:
+                result["status"] = "miss"
+            elif firmware_path is None:
+                if os.path.exists(variant_dir):
+                    shutil.rmtree(variant_dir)
+                Workspace(job["base_root"], f"{variant_dir}/squashfs-root").create()
+
+                modifier.seed_startup_fragments(job["fragments"])
+                with modifier.edit_transaction():
+                    modifier.modify_config(job["overrides"]["config"])
+                    if job["overrides"]["network"]:
+                        modifier.modify_network_settings({**job["network"], **job["overrides"]["network"]})
+
+                squashfs_path = modifier.repack_filesystem(workers=1, base_image=job["base_image"])
+                replacements = None
+                if squashfs_path and job["voice_image"]:
+                    replacements = {"rootfs": squashfs_path, "voice": job["voice_image"]}
+                firmware_path = squashfs_path and modifier.rebuild_firmware(replacements)
+                if firmware_path is None:
+                    raise RuntimeError("repack or rebuild failed")
+
+                if not job["keep_trees"]:
+                    shutil.rmtree(f"{variant_dir}/squashfs-root")
+
+        if firmware_path is not None:
+            result.update(status="ok", firmware=firmware_path, size=os.path.getsize(firmware_path),
+                          sha256=_file_sha256(firmware_path),
+                          rootfs_size=os.path.getsize(squashfs_path))
+    except Exception as e:
+        result.update(status="failed", error=str(e), log=log.getvalue()[-2000:])
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+class FleetBuilder:
+    """Builds per-device firmware variants from one shared base"""
+
+    def __init__(self, profile_path="en818_modification_profile.json", output_dir="_fleet",
+                 firmware_path="a60.bin", workers=None, keep_trees=False, store=None):
+        self.profile_path = profile_path
+        self.output_dir = output_dir
+        self.firmware_path = firmware_path
+        self.workers = workers or os.cpu_count() or 1
+        self.keep_trees = keep_trees
+        self.store = store
+
+        with open(profile_path, 'r') as f:
+            self.profile = json.load(f)
+
+    def build_base(self):
+        """Apply the template profile once and repack it; returns the base modifier
+        
+        Variants repack against the base's squashfs, so only the files a
+        device overrides are compressed again.
+        """
+        print("🧱 Building shared base from template profile...")
+        base = EN818Modifier(self.firmware_path, f"{self.output_dir}/base")
+        if not os.path.isdir(f"{base.extract_dir}/squashfs-root"):
+            raise FileNotFoundError(f"{base.extract_dir}/squashfs-root not found; extract the firmware first")
+        base.prepare_modification_env()
+        apply_profile(base, self.profile["modifications"])
+        if base.repack_filesystem(workers=self.workers) is None:
+            raise RuntimeError("Repacking the base tree failed")
+        return base
+
+    @staticmethod
+    def _directory_name(serial):
+        return re.sub(r"[^A-Za-z0-9._-]", "_", serial)
+
+    def _run(self, jobs):
+        """Run variant jobs on the process pool, yielding results as they finish"""
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(_build_variant, job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                if result["status"] != "miss":
+                    mark = "✅" if result["status"] == "ok" else "❌"
+                    note = ", cached" if result.get("cached") else ""
+                    print(f"   {mark} {result['serial']} ({result['seconds']}s{note})")
+                yield result
+
+    def build(self, devices):
+        """Build every device variant; returns the build manifest"""
+        start = time.perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        # A variant is determined by the image, the template and its overrides
+        keys = {}
+        if self.store is not None:
+            template_key = build_key(self.firmware_path, self.profile,
+                                     profile_files(self.profile["modifications"]), stage="fleet")
+            keys = {device["serial"]: derive_key(template_key, device) for device in devices}
+
+        base_dir = f"{self.output_dir}/base"
+        common = {
+            "base_root": f"{base_dir}/squashfs-root",
+            "base_image": f"{base_dir}/11EA00_modified.squashfs",
+            "firmware_path": self.firmware_path,
+            "fragments": {},
+            "voice_image": None,
+            "network": self.profile["modifications"].get("network", {}),
+            "keep_trees": self.keep_trees,
+            "store_root": self.store.root if self.store is not None else None,
+            "restore_only": False,
+        }
+        jobs = [dict(common, serial=device["serial"], overrides=device,
+                     build_key=keys.get(device["serial"]),
+                     variant_dir=f"{self.output_dir}/{self._directory_name(device['serial'])}")
+                for device in devices]
+
+        # Restore first: a stored variant can still miss on a lost or corrupt chunk
+        results = {}
+        if self.store is not None:
+            print(f"♻️  Restoring {len(jobs)} device variants from the artifact store...")
+            for result in self._run([dict(job, restore_only=True) for job in jobs]):
+                if result["status"] != "miss":
+                    results[result["serial"]] = result
+
+        # The base tree is only needed when some variant has to be built
+        misses = [job for job in jobs if job["serial"] not in results]
+        base_seconds = 0
+        if misses:
+            base_start = time.perf_counter()
+            fragments = self.build_base().startup_fragments()
+            # A pruned voice partition is packed once for the whole fleet
+            voice_image = f"{base_dir}/590000_modified.squashfs"
+            if not (self.profile["modifications"].get("voice") and os.path.exists(voice_image)):
+                voice_image = None
+            base_seconds = round(time.perf_counter() - base_start, 3)
+
+            print(f"🏭 Building {len(misses)} device variants on {self.workers} workers...")
+            for result in self._run([dict(job, fragments=fragments, voice_image=voice_image)
+                                     for job in misses]):
+                results[result["serial"]] = result
+        else:
+            print("♻️  Every variant was restored from the artifact store; skipped the base build")
+
+        ordered = [results[job["serial"]] for job in jobs]
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "profile": self.profile_path,
+            "firmware": self.firmware_path,
+            "base": {"directory": base_dir, "seconds": base_seconds},
+            "workers": self.workers,
+            "devices": ordered,
+            "summary": {
+                "built": sum(1 for r in ordered if r["status"] == "ok"),
+                "failed": sum(1 for r in ordered if r["status"] != "ok"),
+                "cached": sum(1 for r in ordered if r.get("cached")),
+                "seconds": round(time.perf_counter() - start, 3),
+            },
+        }
+
+        manifest_path = f"{self.output_dir}/build_manifest.json"
+        with open(f"{manifest_path}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+        summary = manifest["summary"]
+        print(f"🎉 Fleet build complete: {summary['built']} built, {summary['failed']} failed "
+              f"in {summary['seconds']}s")
+        print(f"   📄 Build manifest: {manifest_path}")
+        return manifest
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: fleet_builder.py <devices.csv|devices.json> [profile.json] [output_dir] [workers]")
+        return
+    profile = sys.argv[2] if len(sys.argv) > 2 else "en818_modification_profile.json"
+    output_dir = sys.argv[3] if len(sys.argv) > 3 else "_fleet"
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    devices = load_devices(sys.argv[1])
+    FleetBuilder(profile, output_dir, workers=workers, store=ArtifactStore()).build(devices)
+
+
+if __name__ == "__main__":
+    main()
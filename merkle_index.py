@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Merkle Tree Index
+=================
+
+Content hashes for every entry of an extracted root filesystem, arranged
+as a Merkle tree: a file's hash is the SHA-256 of its content, a
+symlink's that of its target, and a directory's is computed from the
+names, kinds, permission bits and hashes of its children. Two trees with
+the same root hash are identical. When two roots differ, only the
+subtrees whose hashes differ need to be opened.
+
+The index is cached as JSON next to the tree (.squashfs-root.merkle.json
+beside squashfs-root). Refreshing it costs one lstat walk; files whose
+size and mtime are unchanged keep their cached hash without being read.
+diff_trees() reports added, removed, changed, mode-changed and
+type-changed entries and retargeted symlinks.
+
+Usage: merkle_index.py [original_root] [modified_root]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+
+from analysis_cache import file_digest
+from filesystem_index import FilesystemIndex, FILE, DIRECTORY, SYMLINK
+
+INDEX_VERSION = 1
+
+
+class MerkleNode:
+    """Hash and metadata of one entry; directories list their children"""
+
+    __slots__ = ("kind", "mode", "size", "mtime_ns", "digest", "target", "children")
+
+    def __init__(self, kind, mode, size, mtime_ns, digest, target=None):
+        self.kind = kind
+        self.mode = mode
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.target = target
+        self.children = [] if kind == DIRECTORY else None
+
+    def to_list(self):
+        return [self.kind, self.mode, self.size, self.mtime_ns, self.digest, self.target]
+
+
+def _directory_digest(children):
+    """Hash of a directory from (name, node) pairs sorted by name"""
+    digest = hashlib.sha256()
+    for name, node in children:
+        digest.update(f"{name}\0{node.kind}\0{node.mode:o}\0{node.digest}\n".encode())
+    return digest.hexdigest()
+
+
+def default_cache_path(root):
+    root = os.path.normpath(root)
+    return os.path.join(os.path.dirname(root), f".{os.path.basename(root)}.merkle.json")
+
+
+class MerkleIndex:
+    """Merkle hashes of a directory tree, keyed by path relative to its root"""
+
+    def __init__(self, root, cache_path=None):
+        self.root = root
+        self.cache_path = cache_path or default_cache_path(root)
+        self.nodes = {}
+        self.stats = {"hashed": 0, "reused": 0}
+
+    @classmethod
+    def load(cls, root, cache_path=None, refresh=True):
+        """Index of root from its cache, refreshed against the tree unless refresh is False"""
+        index = cls(root, cache_path)
+        cached = index._load_cache()
+        if cached is not None and not refresh:
+            index.nodes = cached
+            index._link_children()
+            return index
+        index.build(cached or {})
+        index.save()
+        return index
+
+    @property
+    def root_digest(self):
+        return self.nodes[""].digest
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != INDEX_VERSION or "" not in data.get("nodes", {}):
+            return None
+        return {path: MerkleNode(*entry) for path, entry in data["nodes"].items()}
+
+    def _link_children(self):
+        for path in sorted(self.nodes):
+            if path:
+                parent, _, name = path.rpartition("/")
+                self.nodes[parent].children.append(name)
+
+    def build(self, cached=None):
+        """Hash the tree bottom-up, reusing cached hashes of unchanged files"""
+        cached = cached or {}
+        fs_index = FilesystemIndex(self.root)
+        order = [("", fs_index.root)]
+        for path, fs_node in order:
+            if fs_node.kind == DIRECTORY:
+                order.extend((f"{path}/{name}" if path else name, child)
+                             for name, child in sorted(fs_node.children.items()))
+
+        nodes = {}
+        for path, fs_node in reversed(order):
+            mode = fs_node.st_mode & 0o7777
+            if fs_node.kind == DIRECTORY:
+                names = sorted(fs_node.children)
+                prefix = f"{path}/" if path else ""
+                node = MerkleNode(DIRECTORY, mode, 0, 0, _directory_digest(
+                    (name, nodes[prefix + name]) for name in names))
+                node.children = names
+            elif fs_node.kind == SYMLINK:
+                node = MerkleNode(SYMLINK, mode, fs_node.st_size, fs_node.st_mtime_ns,
+                                  hashlib.sha256(fs_node.target.encode()).hexdigest(), fs_node.target)
+            elif fs_node.kind == FILE:
+                previous = cached.get(path)
+                if (previous is not None and previous.kind == FILE and previous.size == fs_node.st_size
+                        and previous.mtime_ns == fs_node.st_mtime_ns):
+                    digest = previous.digest
+                    self.stats["reused"] += 1
+                else:
+                    digest = file_digest(fs_index.full_path(path))
+                    self.stats["hashed"] += 1
+                node = MerkleNode(FILE, mode, fs_node.st_size, fs_node.st_mtime_ns, digest)
+            else:
+                # Device nodes, fifos and sockets carry no content
+                node = MerkleNode(fs_node.kind, mode, 0, fs_node.st_mtime_ns,
+                                  hashlib.sha256(f"{fs_node.st_mode:o}".encode()).hexdigest())
+            nodes[path] = node
+        self.nodes = nodes
+        return self
+
+    def save(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "root": os.path.abspath(self.root),
+                       "nodes": {path: node.to_list() for path, node in self.nodes.items()}}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def subtree(self, path):
+        """path and every path below it"""
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            yield path
+            node = self.nodes[path]
+            if node.kind == DIRECTORY:
+                stack.extend(f"{path}/{name}" if path else name for name in reversed(node.children))
+
+
+def diff_trees(original, modified):
+    """Differences between two MerkleIndexes, descending only into differing subtrees"""
+    start = time.perf_counter()
+    changes = {"added": [], "removed": [], "changed": [], "mode_changed": [],
+               "type_changed": [], "retargeted": []}
+    compared = 0
+
+    if original.nodes[""].mode != modified.nodes[""].mode:
+        changes["mode_changed"].append({"path": "/", "old": f"{original.nodes[''].mode:o}",
+                                        "new": f"{modified.nodes[''].mode:o}"})
+    stack = [""] if original.root_digest != modified.root_digest else []
+    while stack:
+        path = stack.pop()
+        old_dir, new_dir = original.nodes[path], modified.nodes[path]
+        prefix = f"{path}/" if path else ""
+        for name in sorted(set(old_dir.children) | set(new_dir.children)):
+            child = prefix + name
+            old, new = original.nodes.get(child), modified.nodes.get(child)
+            compared += 1
+            if old is None:
+                changes["added"].extend(modified.subtree(child))
+                continue
+            if new is None:
+                changes["removed"].extend(original.subtree(child))
+                continue
+            if old.kind != new.kind:
+                changes["type_changed"].append({"path": child, "old": old.kind, "new": new.kind})
+                continue
+            if old.mode != new.mode and old.kind != SYMLINK:
+                changes["mode_changed"].append({"path": child, "old": f"{old.mode:o}",
+                                                "new": f"{new.mode:o}"})
+            if old.digest == new.digest:
+                continue
+            if old.kind == DIRECTORY:
+                stack.append(child)
+            elif old.kind == SYMLINK:
+                changes["retargeted"].append({"path": child, "old": old.target, "new": new.target})
+            else:
+                changes["changed"].append(child)
+
+    for key in ("added", "removed", "changed"):
+        changes[key].sort()
+    changes["summary"] = {key: len(value) for key, value in changes.items()}
+    changes["summary"].update(identical=original.root_digest == modified.root_digest,
+                              compared=compared,
+                              seconds=round(time.perf_counter() - start, 6))
+    return changes
+
+
+def main():
+    original_root = sys.argv[1] if len(sys.argv) > 1 else "_a60.bin/squashfs-root"
+    modified_root = sys.argv[2] if len(sys.argv) > 2 else "_a60_modified/squashfs-root"
+    for root in (original_root, modified_root):
+        if not os.path.isdir(root):
+            print(f"❌ {root} not found")
+            return
+
+    changes = diff_trees(MerkleIndex.load(original_root), MerkleIndex.load(modified_root))
+    summary = changes["summary"]
+    if summary["identical"]:
+        print("Trees are identical")
+        return
+    for path in changes["added"]:
+        print(f"+ {path}")
+    for path in changes["removed"]:
+        print(f"- {path}")
+    for path in changes["changed"]:
+        print(f"M {path}")
+    for entry in changes["mode_changed"]:
+        print(f"P {entry['path']} {entry['old']} -> {entry['new']}")
+    for entry in changes["type_changed"]:
+        print(f"T {entry['path']} {entry['old']} -> {entry['new']}")
+    for entry in changes["retargeted"]:
+        print(f"L {entry['path']} {entry['old']} -> {entry['new']}")
+    print(f"{summary['compared']} entries compared in {summary['seconds'] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
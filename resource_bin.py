@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Resource Container
+==================
+
+Index, extraction and in-place replacement for usr/resource.bin, the
+SBFS container that holds the bitmaps, fonts, sounds and translation
+strings of the 2.4" TFT UI.
+
+Layout (little endian):
+    0x00  "SBFS", data start, entry count                 (12 bytes)
+    0x0C  count x (name offset, data offset, data size)   (12 bytes each)
+    ....  names: u16 length + bytes, padded to 4 bytes, sorted by name
+    data  entry data, each entry 4-byte aligned
+
+Only the header and entry table are read to build the index; entry data
+is handed out as memoryview slices of the mapped file. The index, with
+each entry's type and bitmap geometry, is cached as JSON beside the root
+filesystem and revalidated by size and mtime.
+
+replace() rewrites one entry: data that fits the entry's aligned slot is
+written in place, larger data is appended at the end of the file. Only
+the entry's table record changes in either case. compact() reclaims the
+slots that appended entries left behind.
+
+Usage: resource_bin.py [resource.bin] [ls|extract <dest_dir>|replace <name> <file>|compact]
+"""
+
+import os
+import sys
+import json
+import struct
+import tempfile
+
+from firmware_image import FirmwareImage
+from workspace import break_link
+
+HEADER = struct.Struct("<4sII")
+ENTRY = struct.Struct("<III")
+NAME_LENGTH = struct.Struct("<H")
+BITMAP_HEADER = struct.Struct("<2sIHHIIiiHHI")
+
+MAGIC = b"SBFS"
+ALIGNMENT = 4
+INDEX_VERSION = 1
+
+BITMAP = "bitmap"
+FONT = "font"
+AUDIO = "audio"
+STRINGS = "strings"
+DATA = "data"
+
+
+class ResourceError(ValueError):
+    pass
+
+
+def _aligned(value):
+    return (value + ALIGNMENT - 1) & ~(ALIGNMENT - 1)
+
+
+def bitmap_info(data):
+    """Width, height, bits per pixel and compression of a BMP, or None"""
+    if len(data) < BITMAP_HEADER.size or bytes(data[:2]) != b"BM":
+        return None
+    (_, _, _, _, _, _, width, height, _, bpp,
+     compression) = BITMAP_HEADER.unpack_from(data, 0)
+    # Negative heights are top-down bitmaps
+    return {"width": width, "height": abs(height), "bpp": bpp, "compression": compression}
+
+
+def classify(name, data):
+    """Entry type from its content; names are unreliable (the .png entries are BMPs)"""
+    head = bytes(data[:16])
+    if head[:2] == b"BM":
+        return BITMAP
+    if head[12:16] == b"TFBS":
+        return FONT
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return AUDIO
+    if name.endswith(".dic"):
+        return STRINGS
+    return DATA
+
+
+def default_cache_path(path):
+    """Cache beside the enclosing squashfs-root, so it is never packed into the image"""
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    while os.path.dirname(directory) != directory:
+        if os.path.basename(directory).startswith("squashfs-root"):
+            relative = os.path.relpath(path, directory).replace(os.sep, "_")
+            return os.path.join(os.path.dirname(directory),
+                                f".{os.path.basename(directory)}.{relative}.resindex.json")
+        directory = os.path.dirname(directory)
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.resindex.json")
+
+
+class ResourceEntry:
+    """One container entry and its position in the file"""
+
+    __slots__ = ("name", "index", "name_offset", "offset", "size", "kind", "info")
+
+    def __init__(self, name, index, name_offset, offset, size, kind, info=None):
+        self.name = name
+        self.index = index
+        self.name_offset = name_offset
+        self.offset = offset
+        self.size = size
+        self.kind = kind
+        self.info = info
+
+    def to_list(self):
+        return [self.name, self.index, self.name_offset, self.offset, self.size, self.kind, self.info]
+
+    def describe(self):
+        if self.kind == BITMAP and self.info:
+            return f"{self.info['width']}x{self.info['height']} {self.info['bpp']}bpp"
+        return ""
+
+
+class ResourceContainer:
+    """Cached index of an SBFS resource container with per-entry access"""
+
+    def __init__(self, path, cache_path=None):
+        self.path = path
+        self.cache_path = cache_path or default_cache_path(path)
+        self.data_start = 0
+        self.entries = []
+        self.by_name = {}
+        self.stats = {"cached": False, "in_place": 0, "appended": 0, "bytes_written": 0}
+        self._image = None
+        self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = FirmwareImage(self.path)
+        return self._image
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+    # Index
+
+    def _load(self):
+        st = os.stat(self.path)
+        try:
+            with open(self.cache_path, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+        if (cached and cached.get("version") == INDEX_VERSION and cached.get("size") == st.st_size
+                and cached.get("mtime_ns") == st.st_mtime_ns):
+            self.data_start = cached["data_start"]
+            self._set_entries([ResourceEntry(*entry) for entry in cached["entries"]])
+            self.stats["cached"] = True
+            return
+        self._scan()
+        self._save()
+
+    def _set_entries(self, entries):
+        self.entries = entries
+        self.by_name = {entry.name: entry for entry in entries}
+
+    def _scan(self):
+        """Parse header, entry table and names; classify each entry from its first bytes"""
+        image = self.image
+        if image.size < HEADER.size:
+            raise ResourceError(f"{self.path}: too small for a resource container")
+        magic, data_start, count = image.unpack_from(HEADER.format, 0)
+        if magic != MAGIC:
+            raise ResourceError(f"{self.path}: bad magic {magic!r}")
+        if HEADER.size + count * ENTRY.size > data_start or data_start > image.size:
+            raise ResourceError(f"{self.path}: entry table overruns data start {data_start:#x}")
+
+        entries = []
+        for index, (name_offset, offset, size) in enumerate(
+                ENTRY.iter_unpack(image[HEADER.size:HEADER.size + count * ENTRY.size])):
+            if name_offset + NAME_LENGTH.size > data_start or offset + size > image.size:
+                raise ResourceError(f"{self.path}: entry {index} out of bounds")
+            (length,) = NAME_LENGTH.unpack_from(image.view, name_offset)
+            start = name_offset + NAME_LENGTH.size
+            name = image.bytes(start, length).decode("latin-1")
+            data = image[offset:offset + size]
+            kind = classify(name, data)
+            info = bitmap_info(data) if kind == BITMAP else None
+            data.release()
+            entries.append(ResourceEntry(name, index, name_offset, offset, size, kind, info))
+
+        self.data_start = data_start
+        self._set_entries(entries)
+
+    def _save(self):
+        st = os.stat(self.path)
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": INDEX_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                           "data_start": self.data_start,
+                           "entries": [entry.to_list() for entry in self.entries]}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # A read-only location only costs the next run a rescan
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def entry(self, name):
+        try:
+            return self.by_name[name]
+        except KeyError:
+            raise KeyError(f"No resource named {name}") from None
+
+    def summary(self):
+        """Entry count and bytes per type"""
+        kinds = {}
+        for entry in self.entries:
+            counts = kinds.setdefault(entry.kind, {"count": 0, "bytes": 0})
+            counts["count"] += 1
+            counts["bytes"] += entry.size
+        return kinds
+
+    def slack(self):
+        """Bytes of the data area not covered by any entry (alignment and abandoned slots)"""
+        size = os.path.getsize(self.path)
+        # The last entry ends at EOF without padding
+        used = sum(min(_aligned(entry.size), size - entry.offset) for entry in self.entries)
+        return size - self.data_start - used
+
+    # Reading
+
+    def read(self, name):
+        """Zero-copy view of an entry's data; release it before replace()"""
+        entry = self.entry(name)
+        return self.image[entry.offset:entry.offset + entry.size]
+
+    def extract(self, name, dest):
+        view = self.read(name)
+        try:
+            with open(dest, 'wb') as f:
+                f.write(view)
+        finally:
+            view.release()
+        return dest
+
+    def extract_all(self, dest_dir, kinds=None):
+        """Write every entry (or every entry of kinds) to dest_dir; returns the count"""
+        os.makedirs(dest_dir, exist_ok=True)
+        count = 0
+        for entry in self.entries:
+            if kinds is None or entry.kind in kinds:
+                self.extract(entry.name, os.path.join(dest_dir, os.path.basename(entry.name)))
+                count += 1
+        return count
+
+    # Writing
+
+    def _slot_end(self, entry):
+        """End of the space entry may grow into in place: the next entry's data, or None at EOF"""
+        following = [other.offset for other in self.entries if other.offset > entry.offset]
+        return min(following) if following else None
+
+    def replace(self, name, data, strict=True):
+        """Replace one entry's data, touching only its slot and table record
+
+        With strict, a bitmap may only be replaced by a bitmap of the same
+        geometry and depth, since the UI lays out screens by pixel position.
+        Returns "in_place" or "appended".
+        """
+        entry = self.entry(name)
+        data = memoryview(data)
+        kind = classify(name, data)
+        info = bitmap_info(data) if kind == BITMAP else None
+        if strict and entry.kind == BITMAP:
+            if info is None:
+                raise ResourceError(f"{name}: replacement is not a BMP")
+            for key in ("width", "height", "bpp"):
+                if info[key] != entry.info[key]:
+                    raise ResourceError(f"{name}: {key} {info[key]} does not match {entry.info[key]}")
+
+        # break_link swaps the inode, so the old mapping must go first
+        self.close()
+        break_link(self.path)
+        file_size = os.path.getsize(self.path)
+        slot_end = self._slot_end(entry)
+
+        with open(self.path, 'r+b') as f:
+            if slot_end is None:
+                # Last entry in the file: it grows or shrinks with the file
+                offset, mode = entry.offset, "in_place"
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+            elif entry.offset + len(data) <= slot_end:
+                offset, mode = entry.offset, "in_place"
+                f.seek(offset)
+                f.write(data)
+                f.write(b"\0" * (slot_end - offset - len(data)))
+            else:
+                offset, mode = _aligned(file_size), "appended"
+                f.seek(file_size)
+                f.write(b"\0" * (offset - file_size))
+                f.write(data)
+                f.write(b"\0" * (_aligned(len(data)) - len(data)))
+            f.seek(HEADER.size + entry.index * ENTRY.size)
+            f.write(ENTRY.pack(entry.name_offset, offset, len(data)))
+
+        entry.offset, entry.size, entry.kind, entry.info = offset, len(data), kind, info
+        self.stats[mode] += 1
+        self.stats["bytes_written"] += len(data)
+        self._save()
+        return mode
+
+    def replace_file(self, name, source_path, strict=True):
+        with open(source_path, 'rb') as f:
+            return self.replace(name, f.read(), strict)
+
+    def compact(self):
+        """Rewrite the file with entry data contiguous again; returns bytes reclaimed"""
+        before = os.path.getsize(self.path)
+        image = self.image
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.compact.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(image[:self.data_start])
+                offset = self.data_start
+                records = {}
+                for entry in sorted(self.entries, key=lambda e: e.offset):
+                    out.write(b"\0" * (offset - out.tell()))
+                    out.write(image[entry.offset:entry.offset + entry.size])
+                    records[entry.index] = offset
+                    offset = _aligned(offset + entry.size)
+                for entry in self.entries:
+                    entry.offset = records[entry.index]
+                    out.seek(HEADER.size + entry.index * ENTRY.size)
+                    out.write(ENTRY.pack(entry.name_offset, entry.offset, entry.size))
+            os.chmod(tmp_path, os.stat(self.path).st_mode & 0o7777)
+            self.close()
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._save()
+        return before - os.path.getsize(self.path)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "_a60.bin/squashfs-root/usr/resource.bin"
+    command = sys.argv[2] if len(sys.argv) > 2 else "ls"
+    if not os.path.isfile(path):
+        print(f"❌ {path} not found")
+        return
+
+    with ResourceContainer(path) as container:
+        if command == "extract":
+            dest = sys.argv[3] if len(sys.argv) > 3 else "resources"
+            print(f"✅ {container.extract_all(dest)} entries extracted to {dest}")
+        elif command == "replace":
+            mode = container.replace_file(sys.argv[3], sys.argv[4])
+            print(f"✅ {sys.argv[3]} replaced ({mode.replace('_', ' ')})")
+        elif command == "compact":
+            print(f"✅ {container.compact()} bytes reclaimed")
+        else:
+            for entry in container.entries:
+                print(f"{entry.offset:08X} {entry.size:>9}  {entry.kind:<8} {entry.name}  "
+                      f"{entry.describe()}")
+            source = "cached index" if container.stats["cached"] else "scanned"
+            print(f"{len(container)} entries ({source}), {container.slack()} bytes slack")
+            for kind, counts in sorted(container.summary().items()):
+                print(f"   {kind}: {counts['count']} entries, {counts['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    main()
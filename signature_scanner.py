@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Multi-Signature Firmware Scanner
+================================
+
+Finds every known magic (ELF, squashfs, uImage, LZMA/gzip/xz streams, the
+ANYKAS3C boot header and the legacy section markers) in one linear pass
+using a single compiled regex alternation. The result is a sorted offset
+table that the analyzers reuse instead of running one data.find loop per
+marker.
+
+finditer only yields non-overlapping matches, so the few offsets inside
+each hit are re-checked against every signature; a magic that starts
+inside another match is reported just as a per-signature find would.
+"""
+
+import re
+import bisect
+from collections import namedtuple
+
+SignatureHit = namedtuple("SignatureHit", ["offset", "name", "description"])
+
+# name -> (regex fragment, description); order only matters for ties
+SIGNATURES = {
+    "elf": (rb"\x7fELF", "ELF executable"),
+    "squashfs_le": (rb"hsqs", "SquashFS filesystem (little endian)"),
+    "squashfs_be": (rb"sqsh", "SquashFS filesystem (big endian)"),
+    "uimage": (rb"\x27\x05\x19\x56", "U-Boot uImage header"),
+    "lzma": (rb"\x5d\x00\x00[\x01\x02\x04\x08\x10\x20\x40\x80]\x00", "LZMA stream"),
+    "gzip": (rb"\x1f\x8b\x08", "gzip stream"),
+    "xz": (rb"\xfd7zXZ\x00", "xz stream"),
+    "anyka": (rb"ANYKAS3C", "ANYKA A60 boot header"),
+    "boot": (rb"BOOT", "Bootloader"),
+    "kern": (rb"KERN", "Kernel"),
+    "root": (rb"ROOT", "Root filesystem"),
+    "data": (rb"DATA", "Data section"),
+    "uimg": (rb"UIMG", "U-Boot image"),
+}
+
+SECTION_MARKERS = ["boot", "kern", "root", "data", "uimg"]
+EMBEDDED_IMAGES = ["anyka", "uimage", "squashfs_le", "squashfs_be", "lzma", "gzip", "xz"]
+
+
+class CompiledSignatures:
+    """One alternation regex plus a classifier for its matches
+
+    The alternation deliberately has no capture groups: groups defeat the
+    regex engine's literal-prefix fast path and make the scan ~30x slower.
+    Matches are mapped back to a signature name afterwards.
+    """
+
+    def __init__(self, signatures=SIGNATURES):
+        self.signatures = signatures
+        self.pattern = re.compile(b"|".join(p for p, _ in signatures.values()))
+        self._patterns = [(name, re.compile(p)) for name, (p, _) in signatures.items()]
+        self._classified = {}
+
+    def overlapping(self, data, start, end):
+        """(offset, name) of signatures starting strictly inside [start, end)"""
+        found = []
+        for offset in range(start + 1, end):
+            for name, pattern in self._patterns:
+                if pattern.match(data, offset):
+                    found.append((offset, name))
+        return found
+
+    def classify(self, matched):
+        """Map matched bytes back to a signature name (memoized)"""
+        name = self._classified.get(matched)
+        if name is None:
+            for name, pattern in self._patterns:
+                if pattern.fullmatch(matched):
+                    break
+            self._classified[matched] = name
+        return name
+
+
+_DEFAULT_SIGNATURES = CompiledSignatures()
+
+
+class SignatureTable:
+    """Sorted offset table of signature hits"""
+
+    def __init__(self, hits):
+        self.hits = sorted(hits)
+        self._offsets = [hit.offset for hit in self.hits]
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    def offsets(self, name):
+        """All offsets for one signature name"""
+        return [hit.offset for hit in self.hits if hit.name == name]
+
+    def by_name(self):
+        """Group offsets by signature name"""
+        grouped = {}
+        for hit in self.hits:
+            grouped.setdefault(hit.name, []).append(hit.offset)
+        return grouped
+
+    def between(self, start, end):
+        """Hits with start <= offset < end"""
+        lo = bisect.bisect_left(self._offsets, start)
+        hi = bisect.bisect_left(self._offsets, end)
+        return self.hits[lo:hi]
+
+    def to_dict(self):
+        return [hit._asdict() for hit in self.hits]
+
+
+def scan_signatures(data, signatures=None):
+    """Scan data (bytes, memoryview or mmap) for all signatures in one pass"""
+    compiled = _DEFAULT_SIGNATURES if signatures is None else CompiledSignatures(signatures)
+
+    hits = []
+    for match in compiled.pattern.finditer(data):
+        name = compiled.classify(match.group())
+        hits.append(SignatureHit(match.start(), name, compiled.signatures[name][1]))
+        for offset, inner in compiled.overlapping(data, match.start(), match.end()):
+            hits.append(SignatureHit(offset, inner, compiled.signatures[inner][1]))
+    return SignatureTable(hits)
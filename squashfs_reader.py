@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+"""
+Native SquashFS Reader
+======================
+
+Pure-Python, lazy reader for SquashFS 4.0 images such as the rootfs and
+the 590000.squashfs voice partition. It parses the superblock, inode,
+directory, fragment and id tables and only decompresses the metadata and
+data blocks a caller actually touches; decompressed blocks are kept in an
+LRU cache. Images are accessed through FirmwareImage, so a squashfs
+embedded in a60.bin can be read in place at its offset.
+
+gzip, lzma and xz are handled by the standard library; lzo, lz4 and zstd
+are used when python-lzo, lz4 or zstandard are installed.
+
+Usage: squashfs_reader.py <image> [ls|cat|stat] [path] [offset]
+"""
+
+import io
+import sys
+import zlib
+import lzma
+import stat
+import struct
+import posixpath
+import threading
+from collections import OrderedDict
+
+from firmware_image import FirmwareImage
+
+SQUASHFS_MAGIC = b"hsqs"
+METADATA_SIZE = 8192
+INVALID_FRAGMENT = 0xFFFFFFFF
+NO_TABLE = 0xFFFFFFFFFFFFFFFF
+
+# Flags
+UNCOMPRESSED_INODES = 0x0001
+UNCOMPRESSED_DATA = 0x0002
+UNCOMPRESSED_FRAGMENTS = 0x0008
+NO_FRAGMENTS = 0x0010
+ALWAYS_FRAGMENTS = 0x0020
+DUPLICATES = 0x0040
+EXPORTABLE = 0x0080
+NO_XATTRS = 0x0200
+
+# Inode types (basic, extended)
+DIR_TYPES = (1, 8)
+FILE_TYPES = (2, 9)
+SYMLINK_TYPES = (3, 10)
+BLKDEV_TYPES = (4, 11)
+CHRDEV_TYPES = (5, 12)
+FIFO_TYPES = (6, 13)
+SOCKET_TYPES = (7, 14)
+
+_MODE_BITS = {
+    1: stat.S_IFDIR, 2: stat.S_IFREG, 3: stat.S_IFLNK, 4: stat.S_IFBLK,
+    5: stat.S_IFCHR, 6: stat.S_IFIFO, 7: stat.S_IFSOCK,
+}
+
+COMPRESSION_NAMES = {1: "gzip", 2: "lzma", 3: "lzo", 4: "xz", 5: "lz4", 6: "zstd"}
+
+SUPERBLOCK = struct.Struct("<4sIIIIHHHHHHQQQQQQQQ")
+INODE_HEADER = struct.Struct("<HHHHII")
+BASIC_DIR = struct.Struct("<IIHHI")
+EXT_DIR = struct.Struct("<IIIIHHI")
+BASIC_FILE = struct.Struct("<IIII")
+EXT_FILE = struct.Struct("<QQQIIII")
+SYMLINK = struct.Struct("<II")
+DEVICE = struct.Struct("<II")
+IPC = struct.Struct("<I")
+DIR_HEADER = struct.Struct("<IIi")
+DIR_ENTRY = struct.Struct("<HhHH")
+FRAGMENT_ENTRY = struct.Struct("<QII")
+
+
+class SquashfsError(Exception):
+    """Malformed image or unsupported feature"""
+
+
+def _decompressor(compression):
+    """Return a function decompressing one block (data, max_size) -> bytes"""
+    if compression == 1:
+        return lambda data, size: zlib.decompress(data)
+    if compression == 2:
+        return lambda data, size: lzma.decompress(data, format=lzma.FORMAT_ALONE)
+    if compression == 4:
+        return lambda data, size: lzma.decompress(data, format=lzma.FORMAT_XZ)
+    if compression == 3:
+        try:
+            import lzo
+        except ImportError:
+            return None
+        return lambda data, size: lzo.decompress(data, False, size)
+    if compression == 5:
+        try:
+            import lz4.block
+        except ImportError:
+            return None
+        return lambda data, size: lz4.block.decompress(data, uncompressed_size=size)
+    if compression == 6:
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        return lambda data, size: zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    return None
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping for decompressed blocks"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class Superblock:
+    __slots__ = ("magic", "inode_count", "mkfs_time", "block_size", "fragment_count",
+                 "compression", "block_log", "flags", "id_count", "version_major",
+                 "version_minor", "root_inode", "bytes_used", "id_table",
+                 "xattr_table", "inode_table", "directory_table", "fragment_table",
+                 "export_table")
+
+    def __init__(self, data):
+        for name, value in zip(self.__slots__, SUPERBLOCK.unpack_from(data, 0)):
+            setattr(self, name, value)
+
+    @property
+    def compression_name(self):
+        return COMPRESSION_NAMES.get(self.compression, f"unknown ({self.compression})")
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "magic"}
+
+
+class SquashfsInode:
+    """Decoded inode; exposes stat-compatible st_* attributes"""
+
+    __slots__ = ("type", "permissions", "uid", "gid", "mtime", "inode_number",
+                 "nlink", "size", "blocks_start", "block_sizes", "fragment",
+                 "fragment_offset", "dir_block", "dir_offset", "parent", "target",
+                 "device")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    @property
+    def is_dir(self):
+        return self.type in DIR_TYPES
+
+    @property
+    def is_file(self):
+        return self.type in FILE_TYPES
+
+    @property
+    def is_symlink(self):
+        return self.type in SYMLINK_TYPES
+
+    @property
+    def st_mode(self):
+        basic = self.type if self.type <= 7 else self.type - 7
+        return _MODE_BITS[basic] | self.permissions
+
+    @property
+    def st_size(self):
+        return self.size or 0
+
+    @property
+    def st_mtime(self):
+        return self.mtime
+
+    @property
+    def st_mtime_ns(self):
+        return self.mtime * 1000000000
+
+    @property
+    def st_ino(self):
+        return self.inode_number
+
+    @property
+    def st_dev(self):
+        return 0
+
+    @property
+    def st_nlink(self):
+        return self.nlink
+
+    @property
+    def st_uid(self):
+        return self.uid
+
+    @property
+    def st_gid(self):
+        return self.gid
+
+
+class SquashfsReader:
+    """Random-access reader for a SquashFS 4.0 image"""
+
+    def __init__(self, source, offset=0, cache_blocks=64):
+        if isinstance(source, FirmwareImage):
+            self.image, self._owns_image = source, False
+        else:
+            self.image, self._owns_image = FirmwareImage(source), True
+        self.offset = offset
+        self.view = self.image.view
+
+        if self.image.bytes(offset, 4) != SQUASHFS_MAGIC:
+            raise SquashfsError(f"No little-endian squashfs superblock at 0x{offset:x}")
+        self.superblock = sb = Superblock(self.image.bytes(offset, SUPERBLOCK.size))
+        if (sb.version_major, sb.version_minor) != (4, 0):
+            raise SquashfsError(f"Unsupported squashfs version {sb.version_major}.{sb.version_minor}")
+
+        self._decompress = _decompressor(sb.compression)
+        self.metadata_cache = LRUCache(cache_blocks)
+        self.block_cache = LRUCache(cache_blocks)
+        self._ids = None
+        self._fragments = None
+        self.root = self.read_inode(sb.root_inode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.view = None
+        if self._owns_image:
+            self.image.close()
+
+    # Low-level block access
+
+    def _decompress_block(self, data, max_size):
+        if self._decompress is None:
+            raise SquashfsError(
+                f"{self.superblock.compression_name} decompression is not available "
+                f"(install the matching Python package)")
+        return self._decompress(bytes(data), max_size)
+
+    def read_metadata_block(self, position):
+        """Decompressed metadata block at an image-relative position
+
+        Returns (data, position of the next block).
+        """
+        cached = self.metadata_cache.get(position)
+        if cached is not None:
+            return cached
+
+        start = self.offset + position
+        header = struct.unpack_from("<H", self.view, start)[0]
+        size = header & 0x7FFF
+        raw = self.view[start + 2:start + 2 + size]
+        data = bytes(raw) if header & 0x8000 else self._decompress_block(raw, METADATA_SIZE)
+        result = (data, position + 2 + size)
+        self.metadata_cache.put(position, result)
+        return result
+
+    def read_metadata(self, position, offset, length):
+        """length bytes of metadata starting offset bytes into block at position
+
+        Returns (data, position, offset) where the last two point just past
+        the bytes read.
+        """
+        chunks = []
+        while length > 0:
+            block, next_position = self.read_metadata_block(position)
+            piece = block[offset:offset + length]
+            chunks.append(piece)
+            length -= len(piece)
+            offset += len(piece)
+            if offset >= len(block):
+                position, offset = next_position, 0
+            if not piece and length > 0:
+                raise SquashfsError("Metadata read past end of table")
+        return b"".join(chunks), position, offset
+
+    def read_data_block(self, position, size_field, expected):
+        """One data or fragment block, decompressed and cached"""
+        if size_field == 0:
+            return bytes(expected)  # sparse block
+        cached = self.block_cache.get(position)
+        if cached is not None:
+            return cached
+
+        size = size_field & 0xFFFFFF
+        raw = self.view[self.offset + position:self.offset + position + size]
+        data = bytes(raw) if size_field & 0x1000000 else self._decompress_block(raw, self.superblock.block_size)
+        self.block_cache.put(position, data)
+        return data
+
+    def _lookup_table(self, table_start, count, entry_size):
+        """Concatenated entries of an indexed metadata table (ids, fragments)"""
+        if count == 0 or table_start == NO_TABLE:
+            return b""
+        total = count * entry_size
+        blocks = (total + METADATA_SIZE - 1) // METADATA_SIZE
+        pointers = struct.unpack_from(f"<{blocks}Q", self.view, self.offset + table_start)
+        data = b"".join(self.read_metadata_block(pointer)[0] for pointer in pointers)
+        return data[:total]
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            sb = self.superblock
+            table = self._lookup_table(sb.id_table, sb.id_count, 4)
+            self._ids = list(struct.unpack(f"<{sb.id_count}I", table))
+        return self._ids
+
+    @property
+    def fragments(self):
+        if self._fragments is None:
+            sb = self.superblock
+            table = self._lookup_table(sb.fragment_table, sb.fragment_count, FRAGMENT_ENTRY.size)
+            self._fragments = [FRAGMENT_ENTRY.unpack_from(table, i * FRAGMENT_ENTRY.size)[:2]
+                               for i in range(sb.fragment_count)]
+        return self._fragments
+
+    # Inodes and directories
+
+    def read_inode(self, reference):
+        """Decode the inode at a 48-bit inode reference (block << 16 | offset)"""
+        position = self.superblock.inode_table + (reference >> 16)
+        offset = reference & 0xFFFF
+        header, position, offset = self.read_metadata(position, offset, INODE_HEADER.size)
+
+        inode = SquashfsInode()
+        (inode.type, inode.permissions, uid_index, gid_index,
+         inode.mtime, inode.inode_number) = INODE_HEADER.unpack(header)
+        inode.uid = self.ids[uid_index] if uid_index < len(self.ids) else uid_index
+        inode.gid = self.ids[gid_index] if gid_index < len(self.ids) else gid_index
+
+        def read(fmt):
+            nonlocal position, offset
+            data, position, offset = self.read_metadata(position, offset, fmt.size)
+            return fmt.unpack(data)
+
+        kind = inode.type
+        if kind == 1:
+            inode.dir_block, inode.nlink, size, inode.dir_offset, inode.parent = read(BASIC_DIR)
+            inode.size = size
+        elif kind == 8:
+            (inode.nlink, inode.size, inode.dir_block, inode.parent, _,
+             inode.dir_offset, _) = read(EXT_DIR)
+        elif kind in FILE_TYPES:
+            if kind == 2:
+                inode.blocks_start, inode.fragment, inode.fragment_offset, inode.size = read(BASIC_FILE)
+                inode.nlink = 1
+            else:
+                (inode.blocks_start, inode.size, _, inode.nlink, inode.fragment,
+                 inode.fragment_offset, _) = read(EXT_FILE)
+            block_size = self.superblock.block_size
+            if inode.fragment == INVALID_FRAGMENT:
+                count = (inode.size + block_size - 1) // block_size
+            else:
+                count = inode.size // block_size
+            data, position, offset = self.read_metadata(position, offset, 4 * count)
+            inode.block_sizes = struct.unpack(f"<{count}I", data)
+        elif kind in SYMLINK_TYPES:
+            inode.nlink, target_size = read(SYMLINK)
+            target, position, offset = self.read_metadata(position, offset, target_size)
+            inode.target = target.decode("utf-8", "surrogateescape")
+            inode.size = target_size
+        elif kind in BLKDEV_TYPES + CHRDEV_TYPES:
+            inode.nlink, inode.device = read(DEVICE)
+        elif kind in FIFO_TYPES + SOCKET_TYPES:
+            inode.nlink, = read(IPC)
+        else:
+            raise SquashfsError(f"Unknown inode type {kind}")
+        return inode
+
+    def iterdir(self, inode):
+        """Yield (name, inode) for every entry of a directory inode"""
+        if not inode.is_dir:
+            raise NotADirectoryError(inode.inode_number)
+
+        # The listing size counts the implicit "." and ".." entries
+        remaining = inode.size - 3
+        position = self.superblock.directory_table + inode.dir_block
+        offset = inode.dir_offset
+
+        while remaining > 0:
+            header, position, offset = self.read_metadata(position, offset, DIR_HEADER.size)
+            count, start, _ = DIR_HEADER.unpack(header)
+            remaining -= DIR_HEADER.size
+            for _ in range(count + 1):
+                entry, position, offset = self.read_metadata(position, offset, DIR_ENTRY.size)
+                inode_offset, _, _, name_size = DIR_ENTRY.unpack(entry)
+                name, position, offset = self.read_metadata(position, offset, name_size + 1)
+                remaining -= DIR_ENTRY.size + name_size + 1
+                yield (name.decode("utf-8", "surrogateescape"),
+                       self.read_inode((start << 16) | inode_offset))
+
+    def listdir(self, path="/"):
+        return [name for name, _ in self.iterdir(self.lookup(path, follow_symlinks=True))]
+
+    def lookup(self, path, follow_symlinks=False, _depth=0):
+        """Inode for an absolute or root-relative path (FileNotFoundError if missing)"""
+        if _depth > 40:
+            raise SquashfsError(f"Too many levels of symbolic links: {path}")
+        parts = [p for p in path.split("/") if p and p != "."]
+        inode, current = self.root, []
+
+        for i, part in enumerate(parts):
+            if part == "..":
+                current = current[:-1]
+                inode = self.lookup("/".join(current), True, _depth + 1)
+                continue
+            if inode.is_symlink:
+                inode = self._follow(current[:-1], inode, _depth)
+            if not inode.is_dir:
+                raise NotADirectoryError(path)
+            for name, child in self.iterdir(inode):
+                if name == part:
+                    inode = child
+                    break
+            else:
+                raise FileNotFoundError(path)
+            current.append(part)
+
+        if follow_symlinks and inode.is_symlink:
+            inode = self._follow(current[:-1], inode, _depth)
+        return inode
+
+    def _follow(self, parent_parts, link, depth):
+        target = link.target
+        if not target.startswith("/"):
+            target = posixpath.join("/".join(parent_parts), target)
+        return self.lookup(target, True, depth + 1)
+
+    def readlink(self, path):
+        inode = self.lookup(path)
+        if not inode.is_symlink:
+            raise OSError(f"Not a symbolic link: {path}")
+        return inode.target
+
+    def stat(self, path, follow_symlinks=True):
+        return self.lookup(path, follow_symlinks)
+
+    def walk(self, top="/"):
+        """Yield (path, [(name, inode) dirs], [(name, inode) others]) top-down"""
+        stack = [(top.rstrip("/") or "/", self.lookup(top, follow_symlinks=True))]
+        while stack:
+            path, inode = stack.pop()
+            dirs, files = [], []
+            for name, child in self.iterdir(inode):
+                (dirs if child.is_dir else files).append((name, child))
+            yield path, dirs, files
+            for name, child in reversed(dirs):
+                stack.append((posixpath.join(path, name), child))
+
+    # File data
+
+    def _file_inode(self, path_or_inode):
+        inode = path_or_inode
+        if not isinstance(inode, SquashfsInode):
+            inode = self.lookup(path_or_inode, follow_symlinks=True)
+        if not inode.is_file:
+            raise IsADirectoryError(path_or_inode) if inode.is_dir else OSError(f"Not a regular file: {path_or_inode}")
+        return inode
+
+    def _block_positions(self, inode):
+        positions = []
+        position = inode.blocks_start
+        for size_field in inode.block_sizes:
+            positions.append(position)
+            position += size_field & 0xFFFFFF
+        return positions
+
+    def read_file(self, path_or_inode, offset=0, size=None):
+        """Read part of a file, decompressing only the blocks it spans"""
+        inode = self._file_inode(path_or_inode)
+        block_size = self.superblock.block_size
+        end = inode.size if size is None else min(inode.size, offset + size)
+        if offset >= end:
+            return b""
+
+        positions = self._block_positions(inode)
+        chunks = []
+        position = offset
+        while position < end:
+            index = position // block_size
+            if index < len(inode.block_sizes):
+                expected = min(block_size, inode.size - index * block_size)
+                block = self.read_data_block(positions[index], inode.block_sizes[index], expected)
+            else:
+                block = self._fragment_data(inode)
+            start = position - index * block_size
+            piece = block[start:start + (end - position)]
+            if not piece:
+                raise SquashfsError("File data shorter than its inode size")
+            chunks.append(piece)
+            position += len(piece)
+        return b"".join(chunks)
+
+    def _fragment_data(self, inode):
+        """The tail end of a file stored in a shared fragment block"""
+        start, size_field = self.fragments[inode.fragment]
+        block = self.read_data_block(start, size_field, self.superblock.block_size)
+        tail = inode.size % self.superblock.block_size
+        return block[inode.fragment_offset:inode.fragment_offset + tail]
+
+    def open(self, path_or_inode):
+        """Seekable, read-only file object over one file in the image"""
+        return SquashfsFile(self, self._file_inode(path_or_inode))
+
+    def info(self):
+        info = self.superblock.to_dict()
+        info["compression_name"] = self.superblock.compression_name
+        return info
+
+
+class SquashfsFile(io.RawIOBase):
+    """Lazy file object; each read decompresses only the blocks it needs"""
+
+    def __init__(self, reader, inode):
+        self.reader = reader
+        self.inode = inode
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.inode.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.inode.size - self.position)
+        data = self.reader.read_file(self.inode, self.position, size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: squashfs_reader.py <image> [ls|cat|stat] [path] [offset]")
+        return
+
+    command = sys.argv[2] if len(sys.argv) > 2 else "ls"
+    path = sys.argv[3] if len(sys.argv) > 3 else "/"
+    offset = int(sys.argv[4], 0) if len(sys.argv) > 4 else 0
+
+    with SquashfsReader(sys.argv[1], offset) as reader:
+        if command == "ls":
+            for name, inode in reader.iterdir(reader.lookup(path, follow_symlinks=True)):
+                suffix = f" -> {inode.target}" if inode.is_symlink else ""
+                print(f"{stat.filemode(inode.st_mode)} {inode.st_size:>10} {name}{suffix}")
+        elif command == "cat":
+            sys.stdout.buffer.write(reader.read_file(path))
+        elif command == "stat":
+            inode = reader.lookup(path)
+            print({name: getattr(inode, name) for name in SquashfsInode.__slots__
+                   if name != "block_sizes"})
+        else:
+            print(f"Unknown command: {command}")
+
+
+if __name__ == "__main__":
+    main()
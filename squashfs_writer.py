@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Native Parallel SquashFS Writer
+===============================
+
+Builds a SquashFS 4.0 image from a directory tree without mksquashfs.
+Data blocks and fragment blocks are compressed on a process pool, then
+written in a fixed order and followed by the inode, directory, fragment
+and id tables, which are assembled in the main process.
+
+The output is deterministic: directory entries are sorted by name, inode
+numbers follow that order, every inode and the superblock carry one fixed
+timestamp, and blocks are laid out in traversal order regardless of which
+worker finished first. Identical trees give byte-identical images.
+
+Given the image the tree was extracted from as a base, the writer repacks
+incrementally: a file whose content hashes the same as the base's file at
+that path has its compressed blocks copied verbatim, so only modified
+files are compressed again. Files smaller than a block share fragment
+blocks and are always repacked; they are cheap to compress.
+
+Layout and defaults follow mksquashfs: 64K blocks, files smaller than a
+block packed into fragments, uncompressible blocks stored raw, no xattrs
+and the file padded to 4K. lzma blocks carry the same 13-byte lzma-alone
+header (dictionary = block size, real uncompressed size) mksquashfs writes.
+
+Usage: squashfs_writer.py <directory> <image> [lzma|xz|gzip] [workers]
+"""
+
+import os
+import sys
+import zlib
+import lzma
+import stat
+import struct
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from squashfs_reader import (SUPERBLOCK, INODE_HEADER, BASIC_DIR, EXT_DIR, BASIC_FILE,
+                             EXT_FILE, SYMLINK, DEVICE, IPC, DIR_HEADER, DIR_ENTRY,
+                             FRAGMENT_ENTRY, METADATA_SIZE, INVALID_FRAGMENT, NO_TABLE,
+                             NO_XATTRS, SQUASHFS_MAGIC, SquashfsError)
+
+COMPRESSION_IDS = {"gzip": 1, "lzma": 2, "xz": 4}
+DEFAULT_BLOCK_SIZE = 65536
+UNCOMPRESSED_BLOCK = 0x1000000
+UNCOMPRESSED_METADATA = 0x8000
+NO_XATTR_INDEX = 0xFFFFFFFF
+PAD_SIZE = 4096
+
+# Largest run of entries one directory header may describe
+DIR_RUN_MAX = 256
+
+_BASIC_TYPES = (
+    (stat.S_ISDIR, 1), (stat.S_ISREG, 2), (stat.S_ISLNK, 3), (stat.S_ISBLK, 4),
+    (stat.S_ISCHR, 5), (stat.S_ISFIFO, 6), (stat.S_ISSOCK, 7),
+)
+
+
+def _basic_type(mode):
+    for test, kind in _BASIC_TYPES:
+        if test(mode):
+            return kind
+    raise ValueError(f"Unsupported file mode {oct(mode)}")
+
+
+def compress(data, compression, block_size):
+    """Compress one block the way the squashfs kernel decompressors expect"""
+    if compression == "gzip":
+        return zlib.compress(data, 9)
+    if compression == "lzma":
+        filters = [{"id": lzma.FILTER_LZMA1, "preset": 5, "dict_size": block_size,
+                    "lc": 3, "lp": 0, "pb": 2, "nice_len": 32}]
+        body = lzma.compress(data, format=lzma.FORMAT_RAW, filters=filters)
+        return struct.pack("<BIQ", (2 * 5 + 0) * 9 + 3, block_size, len(data)) + body
+    if compression == "xz":
+        filters = [{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": max(block_size, 8192)}]
+        return lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32, filters=filters)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def _compress_job(job):
+    """Worker: (path or bytes, offset, length, compression, block_size) -> stored block
+
+    Returns (bytes, size_field); blocks that do not shrink are stored raw.
+    """
+    source, offset, length, compression, block_size = job
+    if isinstance(source, bytes):
+        data = source
+    else:
+        with open(source, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            raise OSError(f"{source} changed while being packed")
+    packed = compress(data, compression, block_size)
+    if len(packed) < len(data):
+        return packed, len(packed)
+    return data, len(data) | UNCOMPRESSED_BLOCK
+
+
+class _MetadataWriter:
+    """Packs a table into 8K metadata blocks and hands out references"""
+
+    def __init__(self, compression, block_size):
+        self.compression = compression
+        self.block_size = block_size
+        self.output = bytearray()
+        self.buffer = bytearray()
+        self.block_starts = []
+
+    def reference(self):
+        """(compressed block start, offset in block) of the next byte written"""
+        return len(self.output), len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= METADATA_SIZE:
+            self._flush(bytes(self.buffer[:METADATA_SIZE]))
+            del self.buffer[:METADATA_SIZE]
+
+    def _flush(self, chunk):
+        self.block_starts.append(len(self.output))
+        packed = compress(chunk, self.compression, self.block_size)
+        if len(packed) < len(chunk):
+            self.output += struct.pack("<H", len(packed)) + packed
+        else:
+            self.output += struct.pack("<H", len(chunk) | UNCOMPRESSED_METADATA) + chunk
+
+    def finish(self):
+        if self.buffer:
+            self._flush(bytes(self.buffer))
+            self.buffer = bytearray()
+        return bytes(self.output)
+
+
+class _Entry:
+    """One node of the tree being packed"""
+
+    __slots__ = ("name", "path", "st", "type", "children", "parent", "inode_number",
+                 "reference", "link", "nlink", "blocks_start", "block_sizes",
+                 "fragment", "fragment_offset", "target")
+
+    def __init__(self, name, path, st, parent):
+        self.name = name
+        self.path = path
+        self.st = st
+        self.type = _basic_type(st.st_mode)
+        self.parent = parent
+        self.children = [] if self.type == 1 else None
+        self.inode_number = None
+        self.reference = None
+        self.link = None
+        self.nlink = 1
+        self.blocks_start = 0
+        self.block_sizes = []
+        self.fragment = INVALID_FRAGMENT
+        self.fragment_offset = 0
+        self.target = None
+
+
+class SquashfsWriter:
+    """Deterministic SquashFS 4.0 image builder with parallel compression"""
+
+    def __init__(self, root, compression="lzma", block_size=DEFAULT_BLOCK_SIZE,
+                 mtime=None, workers=None, base=None):
+        if compression not in COMPRESSION_IDS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        if block_size & (block_size - 1) or not 4096 <= block_size <= 1 << 20:
+            raise ValueError(f"Block size must be a power of two from 4K to 1M: {block_size}")
+        self.root = root
+        self.compression = compression
+        self.block_size = block_size
+        # One timestamp for every inode; SOURCE_DATE_EPOCH as in other reproducible builds
+        if mtime is None:
+            mtime = int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+        self.mtime = mtime
+        self.workers = workers or os.cpu_count() or 1
+        # SquashfsReader of the original image; blocks are only portable
+        # between images with the same compressor and block size
+        self.base = None
+        if base is not None:
+            sb = base.superblock
+            if (sb.compression, sb.block_size) == (COMPRESSION_IDS[compression], block_size):
+                self.base = base
+        self.stats = {"reused_files": 0, "reused_blocks": 0, "reused_bytes": 0}
+
+    # Tree scan
+
+    def _scan(self):
+        """Sorted tree of entries"""
+        root = _Entry(b"", self.root, os.stat(self.root), None)
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory.path) as it:
+                entries = sorted(it, key=lambda e: os.fsencode(e.name))
+            for dirent in entries:
+                st = dirent.stat(follow_symlinks=False)
+                entry = _Entry(os.fsencode(dirent.name), dirent.path, st, directory)
+                if entry.type == 3:
+                    entry.target = os.fsencode(os.readlink(dirent.path))
+                directory.children.append(entry)
+                if entry.type == 1:
+                    stack.append(entry)
+        return root
+
+    def _postorder(self, root):
+        """Entries in the order their inodes are written (children before parents)"""
+        order = []
+        stack = [(root, False)]
+        while stack:
+            entry, expanded = stack.pop()
+            if expanded or entry.type != 1:
+                order.append(entry)
+                continue
+            stack.append((entry, True))
+            stack.extend((child, False) for child in reversed(entry.children))
+        return order
+
+    def _link_hardlinks(self, order):
+        """Hardlinked files inside the tree share the inode of their first entry
+
+        The owner is the first entry in write order, so its inode reference
+        exists before any directory listing that names one of its links,
+        even when the links sit in a directory that sorts earlier.
+        """
+        owners = {}
+        for entry in order:
+            if entry.type == 2 and entry.st.st_nlink > 1:
+                first = owners.setdefault((entry.st.st_dev, entry.st.st_ino), entry)
+                if first is not entry:
+                    first.nlink += 1
+                    entry.link = first
+
+    # Data
+
+    def _files(self, order):
+        """Regular files that own their data, in layout order"""
+        return [entry for entry in order if entry.type == 2 and entry.link is None]
+
+    def _reusable_blocks(self, entry):
+        """Stored blocks of the base file at entry's path if its content is unchanged
+
+        Returns [(bytes, size_field), ...] for the file's full blocks, or
+        None. A tail the base kept in a fragment is not included.
+        """
+        rel_path = os.path.relpath(entry.path, self.root)
+        try:
+            inode = self.base.lookup(rel_path)
+        except (OSError, SquashfsError):
+            return None
+        if not inode.is_file or inode.size != entry.st.st_size:
+            return None
+
+        original, current = hashlib.sha256(), hashlib.sha256()
+        with open(entry.path, "rb") as f:
+            for offset in range(0, inode.size, self.block_size):
+                original.update(self.base.read_file(inode, offset, self.block_size))
+                current.update(f.read(self.block_size))
+        if original.digest() != current.digest():
+            return None
+
+        base_offset = self.base.offset
+        view = self.base.view
+        blocks = []
+        position = inode.blocks_start
+        for size_field in inode.block_sizes:
+            size = size_field & 0xFFFFFF
+            blocks.append((bytes(view[base_offset + position:base_offset + position + size]),
+                           size_field))
+            position += size
+        return blocks
+
+    def _plan(self, files):
+        """Compression jobs and copied blocks for every data block, in layout order
+
+        Returns (jobs, placements, fragment count). Each placement says
+        where a block goes, ("block", entry) or ("fragment", index), and
+        carries its stored (bytes, size_field) when copied from the base or
+        None when it is the next compression job's result.
+        """
+        jobs, placements = [], []
+        fragment_data, fragment_members = bytearray(), []
+        fragments = []
+
+        def close_fragment():
+            if fragment_data:
+                index = len(fragments)
+                fragments.append(bytes(fragment_data))
+                for member in fragment_members:
+                    member.fragment = index
+                fragment_data.clear()
+                fragment_members.clear()
+
+        for entry in files:
+            size = entry.st.st_size
+            if 0 < size < self.block_size:
+                with open(entry.path, "rb") as f:
+                    data = f.read(size + 1)
+                if len(data) != size:
+                    raise OSError(f"{entry.path} changed while being packed")
+                if len(fragment_data) + size > self.block_size:
+                    close_fragment()
+                entry.fragment_offset = len(fragment_data)
+                fragment_data += data
+                fragment_members.append(entry)
+                continue
+            reused = self._reusable_blocks(entry) if self.base is not None else None
+            if reused:
+                placements.extend(("block", entry, stored) for stored in reused)
+                self.stats["reused_files"] += 1
+                self.stats["reused_blocks"] += len(reused)
+                self.stats["reused_bytes"] += sum(len(data) for data, _ in reused)
+            for offset in range(len(reused or ()) * self.block_size, size, self.block_size):
+                length = min(self.block_size, size - offset)
+                jobs.append((entry.path, offset, length, self.compression, self.block_size))
+                placements.append(("block", entry, None))
+        close_fragment()
+
+        for index, data in enumerate(fragments):
+            jobs.append((data, 0, len(data), self.compression, self.block_size))
+            placements.append(("fragment", index, None))
+        return jobs, placements, len(fragments)
+
+    def _compressed(self, jobs):
+        """Results of jobs in job order, compressed on a process pool"""
+        if self.workers <= 1 or len(jobs) < 2:
+            return map(_compress_job, jobs)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        chunksize = max(1, len(jobs) // (self.workers * 8))
+        return self._pool.map(_compress_job, jobs, chunksize=chunksize)
+
+    def _write_data(self, out, files):
+        """Write data and fragment blocks; returns the fragment table entries"""
+        jobs, placements, fragment_count = self._plan(files)
+        fragment_entries = [None] * fragment_count
+        position = SUPERBLOCK.size
+
+        self._pool = None
+        try:
+            started = set()
+            results = self._compressed(jobs)
+            for kind, target, stored in placements:
+                data, size_field = stored or next(results)
+                if kind == "block":
+                    if target not in started:
+                        started.add(target)
+                        target.blocks_start = position
+                    target.block_sizes.append(size_field)
+                else:
+                    fragment_entries[target] = (position, size_field)
+                out.write(data)
+                position += len(data)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+        self.stats.update(data_blocks=len(placements) - fragment_count,
+                          compressed_blocks=len(jobs), fragments=fragment_count)
+        return fragment_entries, position
+
+    # Metadata
+
+    def _ids(self, order):
+        ids = sorted({entry.st.st_uid for entry in order} | {entry.st.st_gid for entry in order})
+        return ids, {value: index for index, value in enumerate(ids)}
+
+    def _inode_header(self, entry, kind, id_index):
+        return INODE_HEADER.pack(kind, stat.S_IMODE(entry.st.st_mode),
+                                 id_index[entry.st.st_uid], id_index[entry.st.st_gid],
+                                 self.mtime, entry.inode_number)
+
+    def _write_inode(self, inodes, entry, id_index, listing=None):
+        entry.reference = inodes.reference()
+        st = entry.st
+
+        if entry.type == 1:
+            dir_block, dir_offset, size = listing
+            parent = entry.parent.inode_number if entry.parent else self._inode_count + 1
+            nlink = 2 + sum(1 for child in entry.children if child.type == 1)
+            if size + 3 <= 0xFFFF:
+                body = BASIC_DIR.pack(dir_block, nlink, size + 3, dir_offset, parent)
+                inodes.write(self._inode_header(entry, 1, id_index) + body)
+            else:
+                body = EXT_DIR.pack(nlink, size + 3, dir_block, parent, 0, dir_offset, NO_XATTR_INDEX)
+                inodes.write(self._inode_header(entry, 8, id_index) + body)
+        elif entry.type == 2:
+            sizes = struct.pack(f"<{len(entry.block_sizes)}I", *entry.block_sizes)
+            if entry.nlink == 1 and st.st_size < 1 << 32 and entry.blocks_start < 1 << 32:
+                body = BASIC_FILE.pack(entry.blocks_start, entry.fragment,
+                                       entry.fragment_offset, st.st_size)
+                inodes.write(self._inode_header(entry, 2, id_index) + body + sizes)
+            else:
+                body = EXT_FILE.pack(entry.blocks_start, st.st_size, 0, entry.nlink,
+                                     entry.fragment, entry.fragment_offset, NO_XATTR_INDEX)
+                inodes.write(self._inode_header(entry, 9, id_index) + body + sizes)
+        elif entry.type == 3:
+            body = SYMLINK.pack(1, len(entry.target)) + entry.target
+            inodes.write(self._inode_header(entry, 3, id_index) + body)
+        elif entry.type in (4, 5):
+            major, minor = os.major(st.st_rdev), os.minor(st.st_rdev)
+            device = (major << 8) | (minor & 0xFF) | ((minor & ~0xFF) << 12)
+            inodes.write(self._inode_header(entry, entry.type, id_index) + DEVICE.pack(1, device))
+        else:
+            inodes.write(self._inode_header(entry, entry.type, id_index) + IPC.pack(1))
+
+    def _write_listing(self, directories, entry):
+        """Directory table listing for entry; returns (block, offset, size)"""
+        block, offset = directories.reference()
+        listing = bytearray()
+        children = [child.link or child for child in entry.children]
+        names = [child.name for child in entry.children]
+
+        i = 0
+        while i < len(children):
+            start = children[i].reference[0]
+            base = children[i].inode_number
+            run = i
+            while (run < len(children) and run - i < DIR_RUN_MAX
+                   and children[run].reference[0] == start
+                   and -0x8000 <= children[run].inode_number - base <= 0x7FFF):
+                run += 1
+            listing += DIR_HEADER.pack(run - i - 1, start, base)
+            for child, name in zip(children[i:run], names[i:run]):
+                listing += DIR_ENTRY.pack(child.reference[1], child.inode_number - base,
+                                          child.type, len(name) - 1) + name
+            i = run
+
+        directories.write(bytes(listing))
+        return block, offset, len(listing)
+
+    def _write_lookup_table(self, out, position, entries):
+        """Metadata blocks holding entries, then their u64 index; returns index position"""
+        table = _MetadataWriter(self.compression, self.block_size)
+        table.write(entries)
+        blocks = table.finish()
+        out.write(blocks)
+        index_position = position + len(blocks)
+        out.write(struct.pack(f"<{len(table.block_starts)}Q",
+                              *(position + start for start in table.block_starts)))
+        return index_position, index_position + 8 * len(table.block_starts)
+
+    # Image
+
+    def write(self, output_path):
+        """Pack the tree into output_path; returns build statistics"""
+        start_time = time.perf_counter()
+        root = self._scan()
+        order = self._postorder(root)
+        self._link_hardlinks(order)
+        owners = [entry for entry in order if entry.link is None]
+        for number, entry in enumerate(owners, 1):
+            entry.inode_number = number
+        for entry in order:
+            if entry.link is not None:
+                entry.inode_number = entry.link.inode_number
+        self._inode_count = len(owners)
+        ids, id_index = self._ids(order)
+        files = self._files(order)
+
+        tmp_path = f"{output_path}.tmp"
+        try:
+            bytes_used = self._write_image(tmp_path, root, owners, ids, id_index, files)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self.stats.update(inodes=self._inode_count, bytes_used=bytes_used,
+                          workers=self.workers,
+                          seconds=round(time.perf_counter() - start_time, 3))
+        return self.stats
+
+    def _write_image(self, tmp_path, root, owners, ids, id_index, files):
+        with open(tmp_path, "wb") as out:
+            out.write(bytes(SUPERBLOCK.size))
+            fragment_entries, position = self._write_data(out, files)
+
+            inodes = _MetadataWriter(self.compression, self.block_size)
+            directories = _MetadataWriter(self.compression, self.block_size)
+            for entry in owners:
+                listing = self._write_listing(directories, entry) if entry.type == 1 else None
+                self._write_inode(inodes, entry, id_index, listing)
+
+            inode_table = position
+            inode_data = inodes.finish()
+            out.write(inode_data)
+            directory_table = inode_table + len(inode_data)
+            directory_data = directories.finish()
+            out.write(directory_data)
+            position = directory_table + len(directory_data)
+
+            fragment_table = NO_TABLE
+            if fragment_entries:
+                packed = b"".join(FRAGMENT_ENTRY.pack(start, size, 0)
+                                  for start, size in fragment_entries)
+                fragment_table, position = self._write_lookup_table(out, position, packed)
+
+            id_table, bytes_used = self._write_lookup_table(
+                out, position, struct.pack(f"<{len(ids)}I", *ids))
+
+            out.write(bytes(-bytes_used % PAD_SIZE))
+
+            root_reference = (root.reference[0] << 16) | root.reference[1]
+            out.seek(0)
+            out.write(SUPERBLOCK.pack(
+                SQUASHFS_MAGIC, self._inode_count, self.mtime, self.block_size,
+                len(fragment_entries), COMPRESSION_IDS[self.compression],
+                self.block_size.bit_length() - 1, NO_XATTRS, len(ids), 4, 0,
+                root_reference, bytes_used, id_table, NO_TABLE, inode_table,
+                directory_table, fragment_table, NO_TABLE))
+        return bytes_used
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: squashfs_writer.py <directory> <image> [lzma|xz|gzip] [workers]")
+        return
+    compression = sys.argv[3] if len(sys.argv) > 3 else "lzma"
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    stats = SquashfsWriter(sys.argv[1], compression, workers=workers).write(sys.argv[2])
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
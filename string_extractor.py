@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Streaming String Extractor
+==========================
+
+Lazily extracts printable strings (ASCII and UTF-16LE) from whole firmware
+images. Each encoding is matched with a compiled bytes regex over fixed-size
+chunks of the mmap; runs that straddle a chunk boundary are carried into the
+next chunk so nothing is split or reported twice. Results are yielded as
+(offset, encoding, text) tuples in offset order, so callers can feed an
+index without holding every string in memory.
+"""
+
+import re
+import sys
+import heapq
+from itertools import islice
+
+from firmware_image import FirmwareImage
+
+CHUNK_SIZE = 1 << 20
+ENCODINGS = ("ascii", "utf-16le")
+
+# encoding -> (regex template, bytes per character)
+_PATTERNS = {
+    "ascii": (rb"[\x20-\x7e]{%d,}", 1),
+    "utf-16le": (rb"(?:[\x20-\x7e]\x00){%d,}", 2),
+}
+
+_compiled = {}
+
+
+def _pattern(encoding, min_length):
+    key = (encoding, min_length)
+    if key not in _compiled:
+        template, _ = _PATTERNS[encoding]
+        _compiled[key] = re.compile(template % min_length)
+    return _compiled[key]
+
+
+def _iter_encoding(view, encoding, min_length, chunk_size):
+    """Yield strings of one encoding from a buffer, chunk by chunk"""
+    pattern = _pattern(encoding, min_length)
+    unit = _PATTERNS[encoding][1]
+    # A run shorter than min_length can hide at a chunk end; re-scan it
+    overlap = unit * min_length
+    chunk_size = max(chunk_size, 2 * overlap)
+    size = len(view)
+    pos = 0
+    emitted_end = 0
+    length = chunk_size
+
+    while pos < size:
+        end = min(pos + length, size)
+        window = view[pos:end]
+        next_pos = end if end == size else max(end - overlap, pos + 1)
+        deferred = False
+
+        for match in pattern.finditer(window):
+            start = pos + match.start()
+            if end < size and match.end() > len(window) - unit:
+                # The run may continue past this chunk, pick it up next time
+                next_pos = start
+                deferred = True
+                break
+            if start >= emitted_end:
+                emitted_end = pos + match.end()
+                yield start, encoding, match.group().decode(encoding)
+
+        window.release()
+        if deferred and next_pos == pos:
+            # Run longer than a whole chunk: widen the window and retry
+            length *= 2
+            continue
+        length = chunk_size
+        pos = next_pos
+
+
+def iter_strings(data, min_length=4, encodings=ENCODINGS, chunk_size=CHUNK_SIZE):
+    """Lazily yield (offset, encoding, text) for every string in data
+
+    data may be bytes, a memoryview, an mmap or a FirmwareImage. Strings of
+    all requested encodings are merged in offset order.
+    """
+    view = data.view if isinstance(data, FirmwareImage) else memoryview(data)
+    streams = [_iter_encoding(view, encoding, min_length, chunk_size)
+               for encoding in encodings]
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams)
+
+
+def iter_file_strings(path, min_length=4, encodings=ENCODINGS, chunk_size=CHUNK_SIZE):
+    """iter_strings over a file on disk, mapped for the duration of the scan"""
+    with FirmwareImage(path) as image:
+        yield from iter_strings(image, min_length, encodings, chunk_size)
+
+
+def extract_strings(data, min_length=4, max_strings=None, encodings=ENCODINGS):
+    """First max_strings strings from data as a list of (offset, encoding, text)"""
+    return list(islice(iter_strings(data, min_length, encodings), max_strings))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: string_extractor.py <file> [min_length]")
+        return
+
+    min_length = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    for offset, encoding, text in iter_file_strings(sys.argv[1], min_length):
+        print(f"0x{offset:08x} {encoding:<8} {text}")
+
+
+if __name__ == "__main__":
+    main()
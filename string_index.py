@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+String and Symbol Index
+=======================
+
+Inverted index of the printable strings (ASCII and UTF-16LE) and ELF
+symbol names of every file under squashfs-root and squashfs-root-0 and
+of the raw partitions (7900, 10EA00). It answers "which files, at which
+offsets, contain X" without grepping the tree: finding the binary that
+reads a config key such as xml_download is one lookup.
+
+Each distinct string is stored once, with the list of places it occurs:
+a file and an offset (a symbol's value for symbols). Terms are the
+identifiers of each string (maximal runs of letters, digits and
+underscores, lowercased), each mapped to the strings that contain it.
+
+A query matches every string containing the query text, ignoring case.
+A query word lies inside one identifier of any string that contains it,
+so the strings holding the word are the postings of the terms the word
+is a substring of ("engine" finds face_engine_threshold and faceengine).
+Those candidates are intersected across the query's words and checked
+for the whole query text. Queries without a word of MIN_TERM characters
+scan the string table instead.
+
+On disk the index is one file of zlib-compressed sections: file list,
+string table, occurrence arrays, terms and postings. It is rebuilt when
+any indexed file's size or mtime changes.
+
+Usage: string_index.py build [extract_dir]
+       string_index.py <text> [--limit N] [--index path]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from string_extractor import iter_file_strings
+from elf_parser import ElfFile, ElfError, is_elf
+
+MAGIC = b"A60STRIX"
+INDEX_VERSION = 2
+HEADER = struct.Struct("<8sIIIII")
+SECTION = struct.Struct("<I")
+
+MIN_LENGTH = 4
+MIN_TERM = 3
+DEFAULT_SOURCES = ("squashfs-root", "squashfs-root-0", "7900", "10EA00")
+
+ASCII, UTF16, SYMBOL, IMPORT = range(4)
+KIND_NAMES = ("ascii", "utf-16le", "symbol", "import")
+_KINDS = {"ascii": ASCII, "utf-16le": UTF16}
+
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+
+
+def terms(text):
+    """Indexed terms of a string: its identifiers, lowercased"""
+    return {word for word in _WORD.findall(text.lower()) if len(word) >= MIN_TERM}
+
+
+def default_index_path(extract_dir):
+    return os.path.join(extract_dir, ".string_index.bin")
+
+
+def _source_files(extract_dir, sources):
+    """(relative path, full path, stat) of every regular file to index"""
+    files, seen = [], set()
+    for source in sources:
+        full = os.path.join(extract_dir, source)
+        if os.path.isfile(full):
+            candidates = [full]
+        elif os.path.isdir(full):
+            candidates = []
+            for dirpath, dirnames, filenames in os.walk(full):
+                dirnames.sort()
+                candidates.extend(os.path.join(dirpath, name) for name in sorted(filenames))
+        else:
+            continue
+        for path in candidates:
+            st = os.lstat(path)
+            # Symlinks point at indexed files; hardlinks are indexed once
+            if not os.path.isfile(path) or os.path.islink(path) or (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            files.append((os.path.relpath(path, extract_dir), path, st))
+    return files
+
+
+def _extract_job(path):
+    """Worker: (offset, kind, text) for every string and ELF symbol of one file"""
+    found = [(offset, _KINDS[encoding], text)
+             for offset, encoding, text in iter_file_strings(path, MIN_LENGTH)]
+    if is_elf(path):
+        try:
+            with ElfFile.open(path) as elf:
+                symbols = {(s.name, s.value, s.defined) for s in elf.symbols + elf.dynamic_symbols
+                           if s.name and s.type not in ("section", "file")}
+        except ElfError:
+            symbols = ()
+        found.extend((value, SYMBOL if defined else IMPORT, name)
+                     for name, value, defined in sorted(symbols))
+    return found
+
+
+class _Haystack:
+    """Joined copy of a string list for finding the strings that contain a needle"""
+
+    def __init__(self, strings):
+        self.blob = "\0".join(strings).lower()
+        lengths = np.fromiter((len(t) + 1 for t in strings), dtype=np.int64, count=len(strings))
+        self.starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    def find(self, needle):
+        """Sorted ids of the strings containing needle (lowercase)"""
+        positions = [m.start() for m in re.finditer(re.escape(needle), self.blob)]
+        if not positions:
+            return np.zeros(0, dtype=np.uint32)
+        return np.unique(np.searchsorted(self.starts, positions, side="right") - 1).astype(np.uint32)
+
+
+def _pack(array):
+    return zlib.compress(np.ascontiguousarray(array).tobytes(), 6)
+
+
+class StringIndex:
+    """Inverted string/symbol index over an extracted firmware"""
+
+    def __init__(self, files, texts, occurrence_starts, file_ids, offsets, kinds,
+                 term_list, posting_starts, postings):
+        self.files = files
+        self.texts = texts
+        self.occurrence_starts = occurrence_starts
+        self.file_ids = file_ids
+        self.offsets = offsets
+        self.kinds = kinds
+        self.terms = term_list
+        self.posting_starts = posting_starts
+        self.postings = postings
+        self._texts_haystack = None
+        self._terms_haystack = None
+
+    # Building
+
+    @classmethod
+    def build(cls, extract_dir="_a60.bin", sources=DEFAULT_SOURCES, workers=None):
+        files = _source_files(extract_dir, sources)
+        paths = [path for _, path, _ in files]
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(paths) <= 1:
+            results = map(_extract_job, paths)
+        else:
+            chunksize = max(1, len(paths) // (workers * 8))
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(_extract_job, paths, chunksize=chunksize)
+
+        text_ids, texts = {}, []
+        file_ids, offsets, kinds, occurrence_texts = [], [], [], []
+        try:
+            for file_id, found in enumerate(results):
+                for offset, kind, text in found:
+                    text_id = text_ids.get(text)
+                    if text_id is None:
+                        text_id = text_ids[text] = len(texts)
+                        texts.append(text)
+                    file_ids.append(file_id)
+                    offsets.append(offset)
+                    kinds.append(kind)
+                    occurrence_texts.append(text_id)
+        finally:
+            if workers > 1 and len(paths) > 1:
+                pool.shutdown()
+
+        # Occurrences grouped by string, in file and offset order within a string
+        occurrence_texts = np.array(occurrence_texts, dtype=np.uint32)
+        order = np.argsort(occurrence_texts, kind="stable")
+        occurrence_starts = np.searchsorted(occurrence_texts[order],
+                                            np.arange(len(texts) + 1)).astype(np.uint32)
+
+        postings_by_term = {}
+        for text_id, text in enumerate(texts):
+            for term in terms(text):
+                postings_by_term.setdefault(term, []).append(text_id)
+        term_list = sorted(postings_by_term)
+        posting_starts = np.zeros(len(term_list) + 1, dtype=np.uint32)
+        posting_starts[1:] = np.cumsum([len(postings_by_term[t]) for t in term_list])
+        postings = np.fromiter((text_id for t in term_list for text_id in postings_by_term[t]),
+                               dtype=np.uint32, count=int(posting_starts[-1]))
+
+        return cls([[rel, st.st_size, st.st_mtime_ns] for rel, _, st in files], texts,
+                   occurrence_starts, np.array(file_ids, dtype=np.uint32)[order],
+                   np.array(offsets, dtype=np.uint64)[order], np.array(kinds, dtype=np.uint8)[order],
+                   term_list, posting_starts, postings)
+
+    @classmethod
+    def load_or_build(cls, extract_dir="_a60.bin", index_path=None, sources=DEFAULT_SOURCES,
+                      workers=None):
+        """Index from index_path if no indexed file changed, otherwise rebuilt and saved"""
+        index_path = index_path or default_index_path(extract_dir)
+        index = cls.load(index_path)
+        current = [[rel, st.st_size, st.st_mtime_ns] for rel, _, st in _source_files(extract_dir, sources)]
+        if index is not None and index.files == current:
+            return index, False
+        index = cls.build(extract_dir, sources, workers)
+        index.save(index_path)
+        return index, True
+
+    # Storage
+
+    def save(self, path):
+        sections = [
+            zlib.compress(json.dumps(self.files).encode(), 6),
+            zlib.compress("\0".join(self.texts).encode("utf-8"), 6),
+            _pack(self.occurrence_starts), _pack(self.file_ids), _pack(self.offsets), _pack(self.kinds),
+            zlib.compress("\0".join(self.terms).encode("utf-8"), 6),
+            _pack(self.posting_starts), _pack(self.postings),
+        ]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, INDEX_VERSION, len(self.files), len(self.texts),
+                                len(self.terms), len(self.offsets)))
+            for data in sections:
+                f.write(SECTION.pack(len(data)))
+                f.write(data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Index stored at path, or None if missing or from another version"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, version, _, text_count, term_count, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != INDEX_VERSION:
+            return None
+
+        sections, pos = [], HEADER.size
+        for _ in range(9):
+            (length,) = SECTION.unpack_from(data, pos)
+            sections.append(zlib.decompress(data[pos + SECTION.size:pos + SECTION.size + length]))
+            pos += SECTION.size + length
+        (files, texts, occurrence_starts, file_ids, offsets, kinds,
+         term_blob, posting_starts, postings) = sections
+        return cls(json.loads(files),
+                   texts.decode("utf-8").split("\0") if text_count else [],
+                   np.frombuffer(occurrence_starts, dtype=np.uint32),
+                   np.frombuffer(file_ids, dtype=np.uint32),
+                   np.frombuffer(offsets, dtype=np.uint64),
+                   np.frombuffer(kinds, dtype=np.uint8),
+                   term_blob.decode("utf-8").split("\0") if term_count else [],
+                   np.frombuffer(posting_starts, dtype=np.uint32),
+                   np.frombuffer(postings, dtype=np.uint32))
+
+    # Queries
+
+    def _scan(self, needle):
+        """Ids of strings containing needle, by scanning the string table"""
+        if self._texts_haystack is None:
+            self._texts_haystack = _Haystack(self.texts)
+        return self._texts_haystack.find(needle)
+
+    def _word_texts(self, word):
+        """Ids of strings containing word: postings of every term word is part of"""
+        if self._terms_haystack is None:
+            self._terms_haystack = _Haystack(self.terms)
+        postings = [self.postings[self.posting_starts[i]:self.posting_starts[i + 1]]
+                    for i in self._terms_haystack.find(word)]
+        if not postings:
+            return np.zeros(0, dtype=np.uint32)
+        return np.unique(np.concatenate(postings))
+
+    def matching_texts(self, query):
+        """Ids of the strings containing query, ignoring case"""
+        needle = query.lower()
+        words = [w for w in _WORD.findall(needle) if len(w) >= MIN_TERM]
+        if not words:
+            return self._scan(needle)
+
+        candidates = None
+        for word in sorted(set(words), key=len, reverse=True):
+            found = self._word_texts(word)
+            candidates = found if candidates is None else np.intersect1d(candidates, found,
+                                                                          assume_unique=True)
+            if not len(candidates):
+                return candidates
+        if words == [needle]:
+            return candidates
+        return np.array([i for i in candidates if needle in self.texts[i].lower()], dtype=np.uint32)
+
+    def query(self, query, limit=None):
+        """(path, offset, kind, text) for every occurrence of a string containing query"""
+        hits = []
+        for text_id in self.matching_texts(query):
+            for i in range(self.occurrence_starts[text_id], self.occurrence_starts[text_id + 1]):
+                hits.append((self.files[self.file_ids[i]][0], int(self.offsets[i]),
+                             KIND_NAMES[self.kinds[i]], self.texts[text_id]))
+        hits.sort()
+        return hits[:limit] if limit is not None else hits
+
+    def stats(self):
+        return {"files": len(self.files), "strings": len(self.texts),
+                "occurrences": len(self.offsets), "terms": len(self.terms)}
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        print(__doc__.strip().split("Usage: ")[1])
+        return
+
+    if args[0] == "build":
+        extract_dir = args[1] if len(args) > 1 else "_a60.bin"
+        start = time.perf_counter()
+        index = StringIndex.build(extract_dir)
+        path = default_index_path(extract_dir)
+        index.save(path)
+        stats = index.stats()
+        print(f"✅ Indexed {stats['files']} files: {stats['strings']} strings, "
+              f"{stats['occurrences']} occurrences, {stats['terms']} terms "
+              f"in {time.perf_counter() - start:.2f}s ({os.path.getsize(path)} bytes)")
+        return
+
+    limit = int(args[args.index("--limit") + 1]) if "--limit" in args else 50
+    index_path = args[args.index("--index") + 1] if "--index" in args else default_index_path("_a60.bin")
+    query = " ".join(a for i, a in enumerate(args)
+                     if not a.startswith("--") and (i == 0 or args[i - 1] not in ("--limit", "--index")))
+
+    start = time.perf_counter()
+    index = StringIndex.load(index_path)
+    if index is None:
+        print(f"❌ No index at {index_path} (run: string_index.py build)")
+        return
+    loaded = time.perf_counter()
+    hits = index.query(query)
+    done = time.perf_counter()
+    for path, offset, kind, text in hits[:limit]:
+        print(f"{path}:0x{offset:x} [{kind}] {text}")
+    more = f" (showing {limit})" if len(hits) > limit else ""
+    print(f"{len(hits)} occurrences{more}; load {(loaded - start) * 1000:.1f} ms, "
+          f"query {(done - loaded) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
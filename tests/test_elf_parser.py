@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import sysconfig
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from elf_parser import ElfFile, elf_summary, dependency_graph
+from firmware_analyzer import FirmwareAnalyzer
+from squashfs_writer import SquashfsWriter
+
+BINARY = "/bin/ls"
+MULTIARCH = sysconfig.get_config_var("MULTIARCH") or ""
+SYSTEM_LIBRARY_PATHS = [os.path.join(d, MULTIARCH) for d in ("/lib", "/usr/lib") if MULTIARCH] + [
+    "/lib64", "/usr/lib64", "/lib", "/usr/lib"]
+
+
+def _system_library(name):
+    return next((os.path.join(d, name) for d in SYSTEM_LIBRARY_PATHS
+                 if os.path.isfile(os.path.join(d, name))), None)
+
+
+@pytest.fixture
+def rootfs(tmp_path):
+    """bin/ls with the libraries it needs directly in lib/"""
+    summary = elf_summary(BINARY) if os.path.isfile(BINARY) else None
+    if summary is None or not summary["needed"]:
+        pytest.skip(f"no dynamically linked {BINARY}")
+    root = tmp_path / "root"
+    (root / "bin").mkdir(parents=True)
+    (root / "lib").mkdir()
+    shutil.copy(BINARY, root / "bin" / "ls")
+    copied = []
+    for library in summary["needed"]:
+        path = _system_library(library)
+        if path is not None:
+            shutil.copy(path, root / "lib" / library)
+            copied.append(library)
+    if not copied:
+        pytest.skip("libraries of the test binary not found")
+    return root, summary["needed"], copied
+
+
+def test_dependency_graph_on_real_binary(rootfs):
+    root, needed, copied = rootfs
+    binaries = {}
+    for directory in ("bin", "lib"):
+        for name in os.listdir(root / directory):
+            binaries[f"{directory}/{name}"] = elf_summary(str(root / directory / name))
+
+    assert binaries["bin/ls"]["interpreter"]
+    assert binaries["bin/ls"]["imports"] > 0
+    for library in copied:
+        assert binaries[f"lib/{library}"]["soname"] == library
+
+    graph = dependency_graph(binaries)
+    assert list(graph["edges"]["bin/ls"]) == needed
+    for library in copied:
+        assert graph["edges"]["bin/ls"][library] == f"lib/{library}"
+        assert "bin/ls" in graph["used_by"][f"lib/{library}"]
+    for library in set(needed) - set(copied):
+        assert "bin/ls" in graph["missing"][library]
+
+
+def test_stream_matches_buffer(rootfs):
+    root, _, _ = rootfs
+    path = str(root / "bin" / "ls")
+    with open(path, "rb") as f:
+        assert ElfFile(f, 0, path).summary() == elf_summary(path)
+
+
+def test_image_mode_reads_only_tables(rootfs, tmp_path):
+    root, _, _ = rootfs
+    image = tmp_path / "root.sqfs"
+    SquashfsWriter(str(root), "lzma", workers=1).write(str(image))
+
+    tree = FirmwareAnalyzer(extract_dir=str(tmp_path / "none"), use_cache=False)
+    tree.squashfs_root = str(root)
+    tree.analyze_elf_binaries()
+
+    analyzer = FirmwareAnalyzer(extract_dir=str(tmp_path / "none"), squashfs_image=str(image))
+    decompress, decompressed = analyzer.reader._decompress_block, []
+
+    def counting(data, max_size):
+        decompressed.append(decompress(data, max_size))
+        return decompressed[-1]
+
+    analyzer.reader._decompress_block = counting
+    analyzer.analyze_elf_binaries()
+
+    assert analyzer.analysis_report == tree.analysis_report
+    total = sum(os.path.getsize(os.path.join(d, n)) for d, _, names in os.walk(root) for n in names)
+    assert sum(len(block) for block in decompressed) < total
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from signature_scanner import scan_signatures
+
+SIGNATURES = {
+    "long": (rb"ABCDEF", "long magic"),
+    "inner": (rb"CDE", "magic inside the long one"),
+    "tail": (rb"EFGH", "magic overlapping the long one's end"),
+}
+
+
+def test_overlapping_signatures_are_all_reported():
+    data = b"..ABCDEFGH..CDE.."
+    table = scan_signatures(data, SIGNATURES)
+    assert [(hit.offset, hit.name) for hit in table] == [
+        (2, "long"), (4, "inner"), (6, "tail"), (12, "inner")]
+
+
+def test_builtin_magics_overlapping():
+    data = b"\x00" * 16 + b"hsqsh" + b"\x00" * 3 + b"ROOTROOT"
+    found = scan_signatures(data).by_name()
+    assert found["squashfs_le"] == [16]
+    assert found["squashfs_be"] == [17]
+    assert found["root"] == [24, 28]
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from squashfs_reader import SquashfsReader
+from squashfs_writer import SquashfsWriter
+
+
+def test_hardlink_across_directories(tmp_path):
+    # The link sorts (and is listed) before the directory holding the first name
+    root = tmp_path / "t"
+    (root / "a").mkdir(parents=True)
+    (root / "b").mkdir()
+    (root / "b" / "h1").write_bytes(b"hello\n")
+    os.link(root / "b" / "h1", root / "a" / "h2")
+
+    image = tmp_path / "out.sqfs"
+    SquashfsWriter(str(root), "lzma", workers=1).write(str(image))
+
+    with SquashfsReader(str(image)) as reader:
+        assert reader.read_file("a/h2") == b"hello\n"
+        assert reader.read_file("b/h1") == b"hello\n"
+        first, second = reader.stat("a/h2"), reader.stat("b/h1")
+        assert first.st_ino == second.st_ino
+        assert first.st_nlink == 2
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workspace import Workspace
+
+
+def test_missing_source_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        Workspace(str(tmp_path / "missing"), str(tmp_path / "root")).create()
+    assert not (tmp_path / "root").exists()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Voice Prompt Indexer
+====================
+
+Indexes the MP3 voice prompts of the voice partition (squashfs-root-0,
+one directory per language holding mp3-<lang>-<prompt>.mp3). Every file
+is mapped with FirmwareImage and its MPEG audio frame headers are walked
+directly: version, layer, bitrate, sample rate and channel mode are
+read from each header, frames are counted and the duration follows from
+the samples per frame. ID3v2 (with footer) and ID3v1 tags are measured
+and left out of the audio. A Xing/Info/VBRI header frame counts as a tag
+frame, not audio. Files are parsed on a process pool.
+
+The report totals size, tag overhead and duration per language and
+lists prompts a language lacks. It also groups files with identical
+content, and files whose audio frames are identical but whose tags
+differ.
+
+Usage: voice_indexer.py [voice_root] [workers]
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from firmware_image import FirmwareImage
+
+PROMPT_NAME = re.compile(r"^mp3-(?P<language>[A-Za-z0-9]+)-(?P<prompt>\d+)\.mp3$")
+
+# Bitrates in kbps by (MPEG-1?, layer)
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (0: MPEG-2.5, 2: MPEG-2, 3: MPEG-1)
+SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+VERSIONS = {0: "2.5", 2: "2", 3: "1"}
+CHANNEL_MODES = ("stereo", "joint_stereo", "dual_channel", "mono")
+
+ID3V2_HEADER = 10
+ID3V1_SIZE = 128
+
+
+class FrameHeader:
+    """Decoded 4-byte MPEG audio frame header"""
+
+    __slots__ = ("version", "layer", "bitrate", "sample_rate", "padding", "channel_mode",
+                 "length", "samples")
+
+    def __init__(self, version, layer, bitrate, sample_rate, padding, channel_mode):
+        self.version = version
+        self.layer = layer
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.padding = padding
+        self.channel_mode = channel_mode
+
+        mpeg1 = version == 3
+        if layer == 1:
+            self.length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+            self.samples = 384
+        elif layer == 2:
+            self.length = 144 * bitrate * 1000 // sample_rate + padding
+            self.samples = 1152
+        else:
+            self.length = (144 if mpeg1 else 72) * bitrate * 1000 // sample_rate + padding
+            self.samples = 1152 if mpeg1 else 576
+
+    @property
+    def side_info_size(self):
+        """Layer III side information length, where a Xing/Info tag would start"""
+        mono = self.channel_mode == 3
+        if self.version == 3:
+            return 17 if mono else 32
+        return 9 if mono else 17
+
+
+def parse_frame_header(data, offset):
+    """FrameHeader at offset, or None if the bytes there are not a valid header"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    return FrameHeader(version, layer, BITRATES[(version == 3, layer)][bitrate_index],
+                       SAMPLE_RATES[version][rate_index], (b2 >> 1) & 1, b3 >> 6)
+
+
+def _id3v2_size(data):
+    """Bytes taken by a leading ID3v2 tag (0 if there is none)"""
+    if len(data) < ID3V2_HEADER or bytes(data[:3]) != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = ID3V2_HEADER if data[5] & 0x10 else 0
+    return min(len(data), ID3V2_HEADER + size + footer)
+
+
+def _is_tag_frame(data, offset, header):
+    """Xing/Info or VBRI header frame (carries no audio)"""
+    tag_offset = offset + 4 + (header.side_info_size if header.layer == 3 else 0)
+    if bytes(data[tag_offset:tag_offset + 4]) in (b"Xing", b"Info"):
+        return True
+    return bytes(data[offset + 36:offset + 40]) == b"VBRI"
+
+
+def parse_mp3(path):
+    """Frame-level summary of one MP3 file"""
+    with FirmwareImage(path) as image:
+        data = image.view
+        size = len(data)
+        id3v2 = _id3v2_size(data)
+        id3v1 = 0
+        if size - id3v2 >= ID3V1_SIZE and bytes(data[size - ID3V1_SIZE:size - ID3V1_SIZE + 3]) == b"TAG":
+            id3v1 = ID3V1_SIZE
+        end = size - id3v1
+
+        frames = samples = audio_bytes = junk = 0
+        bitrates, sample_rates, versions, layers, modes = set(), set(), set(), set(), set()
+        audio_hash = hashlib.sha256()
+        tag_frame = False
+        position = id3v2
+        locked = False
+        while position + 4 <= end:
+            header = parse_frame_header(data, position)
+            # Out of sync: a header only counts if the frame after it starts one too
+            if header is not None and not locked:
+                following = position + header.length
+                if following + 4 <= end and parse_frame_header(data, following) is None:
+                    header = None
+            if header is None or position + header.length > end:
+                locked = False
+                resync = image.find(b"\xff", position + 1, end)
+                next_position = resync if resync != -1 else end
+                junk += next_position - position
+                position = next_position
+                continue
+
+            locked = True
+            if frames == 0 and not tag_frame and _is_tag_frame(data, position, header):
+                tag_frame = True
+            else:
+                frames += 1
+                samples += header.samples
+                audio_bytes += header.length
+                audio_hash.update(data[position:position + header.length])
+                bitrates.add(header.bitrate)
+                sample_rates.add(header.sample_rate)
+                versions.add(VERSIONS[header.version])
+                layers.add(header.layer)
+                modes.add(CHANNEL_MODES[header.channel_mode])
+            position += header.length
+        junk += max(0, end - position)
+
+        content_hash = hashlib.sha256(data).hexdigest()
+
+    sample_rate = min(sample_rates) if len(sample_rates) == 1 else None
+    return {
+        "size": size,
+        "sha256": content_hash,
+        "audio_sha256": audio_hash.hexdigest() if frames else None,
+        "id3_size": id3v2 + id3v1,
+        "id3v2_size": id3v2,
+        "id3v1": bool(id3v1),
+        "frames": frames,
+        "audio_bytes": audio_bytes,
+        "junk_bytes": junk,
+        "duration": round(samples / sample_rate, 3) if sample_rate else None,
+        # Average over all frames; per-frame rates differ for VBR files
+        "bitrate": round(audio_bytes * 8 * sample_rate / samples / 1000, 1) if sample_rate and samples else None,
+        "vbr": len(bitrates) > 1,
+        "sample_rate": sample_rate,
+        "mpeg_version": "/".join(sorted(versions)) or None,
+        "layer": min(layers) if len(layers) == 1 else None,
+        "channel_mode": "/".join(sorted(modes)) or None,
+        "vbr_header": tag_frame,
+    }
+
+
+def _index_job(job):
+    rel_path, path = job
+    try:
+        info = parse_mp3(path)
+    except OSError as e:
+        info = {"error": str(e)}
+    info["path"] = rel_path
+    return info
+
+
+def _duplicates(files, key):
+    groups = {}
+    for info in files:
+        if info.get(key):
+            groups.setdefault(info[key], []).append(info)
+    return [{key: digest, "size": group[0]["size"], "paths": [info["path"] for info in group],
+             "wasted_bytes": sum(info["size"] for info in group[1:])}
+            for digest, group in sorted(groups.items()) if len(group) > 1]
+
+
+class VoicePromptIndexer:
+    """Frame-level index of the per-language voice prompt files"""
+
+    def __init__(self, root="_a60.bin/squashfs-root-0", workers=None):
+        self.root = root
+        self.workers = workers or os.cpu_count() or 1
+
+    def _jobs(self):
+        jobs = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(".mp3"):
+                    path = os.path.join(dirpath, name)
+                    jobs.append((os.path.relpath(path, self.root), path))
+        return jobs
+
+    def _parse(self, jobs):
+        if self.workers <= 1 or len(jobs) < 2:
+            return [_index_job(job) for job in jobs]
+        chunksize = max(1, len(jobs) // (self.workers * 8))
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(_index_job, jobs, chunksize=chunksize))
+
+    def index(self):
+        """Parse every prompt; returns the report"""
+        start = time.perf_counter()
+        files = self._parse(self._jobs())
+
+        languages = {}
+        for info in files:
+            match = PROMPT_NAME.match(os.path.basename(info["path"]))
+            language = match["language"] if match else os.path.dirname(info["path"]) or "unknown"
+            info["language"] = language
+            info["prompt"] = int(match["prompt"]) if match else None
+            entry = languages.setdefault(language, {"files": 0, "bytes": 0, "id3_bytes": 0,
+                                                    "audio_bytes": 0, "duration": 0.0, "prompts": []})
+            entry["files"] += 1
+            entry["bytes"] += info.get("size", 0)
+            entry["id3_bytes"] += info.get("id3_size", 0)
+            entry["audio_bytes"] += info.get("audio_bytes", 0)
+            entry["duration"] += info.get("duration") or 0.0
+            if info["prompt"] is not None:
+                entry["prompts"].append(info["prompt"])
+
+        all_prompts = set(p for entry in languages.values() for p in entry["prompts"])
+        for entry in languages.values():
+            entry["duration"] = round(entry["duration"], 3)
+            entry["missing"] = sorted(all_prompts - set(entry["prompts"]))
+            entry["prompts"] = sorted(entry["prompts"])
+
+        return {
+            "root": self.root,
+            "languages": dict(sorted(languages.items())),
+            "totals": {
+                "files": len(files),
+                "bytes": sum(entry["bytes"] for entry in languages.values()),
+                "id3_bytes": sum(entry["id3_bytes"] for entry in languages.values()),
+                "duration": round(sum(entry["duration"] for entry in languages.values()), 3),
+            },
+            "duplicates": _duplicates(files, "sha256"),
+            "audio_duplicates": [group for group in _duplicates(files, "audio_sha256")
+                                 if len(set(info["sha256"] for info in files
+                                            if info["path"] in group["paths"])) > 1],
+            "invalid": [info["path"] for info in files if "error" in info or not info["frames"]],
+            "files": files,
+            "workers": self.workers,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else "_a60.bin/squashfs-root-0"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    if not os.path.isdir(root):
+        print(f"❌ {root} not found")
+        return
+
+    report = VoicePromptIndexer(root, workers).index()
+    print(f"{'lang':<6} {'files':>5} {'bytes':>9} {'id3':>7} {'seconds':>8}  missing")
+    for language, entry in report["languages"].items():
+        print(f"{language:<6} {entry['files']:>5} {entry['bytes']:>9} {entry['id3_bytes']:>7} "
+              f"{entry['duration']:>8.1f}  {','.join(map(str, entry['missing'])) or '-'}")
+    totals = report["totals"]
+    print(f"{'total':<6} {totals['files']:>5} {totals['bytes']:>9} {totals['id3_bytes']:>7} "
+          f"{totals['duration']:>8.1f}")
+    for group in report["duplicates"]:
+        print(f"Identical ({group['size']} bytes): {', '.join(group['paths'])}")
+    for group in report["audio_duplicates"]:
+        print(f"Same audio, different tags: {', '.join(group['paths'])}")
+    for path in report["invalid"]:
+        print(f"⚠️  No MPEG audio frames: {path}")
+    print(f"Indexed in {report['seconds']}s on {report['workers']} workers")
+
+
+if __name__ == "__main__":
+    main()
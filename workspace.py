@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Copy-on-Write Modification Workspace
+====================================
+
+Creates the modification tree (_a60_modified) from the extraction tree
+without copying file data. Regular files are reflinked where the
+filesystem supports it (btrfs, XFS, ...) and hardlinked otherwise;
+symlinks and directories are recreated. A file only gets a private copy
+when a modifier is about to write to it, so creating the workspace is
+near-instant and disk usage grows with the edits only.
+
+Writers must call break_link() before touching a file in place. Writers
+that replace files through a temporary file and os.replace() (config.txt,
+run_app.sh) never modify the shared inode and need nothing extra.
+"""
+
+import os
+import errno
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Errors meaning "this filesystem cannot share data", fall back to a copy
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                errno.EPERM, errno.EMLINK}
+
+
+def reflink(source, target):
+    """Clone source to target sharing data blocks (raises OSError if unsupported)"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported on this platform")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target)
+            raise
+    shutil.copystat(source, target)
+
+
+def is_shared(path):
+    """True if path is a hardlink whose inode other paths also use"""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    return not os.path.islink(path) and st.st_nlink > 1
+
+
+def break_link(path, keep_content=True):
+    """Give path a private inode before it is written
+
+    With keep_content the current data is copied into the private inode
+    (for in-place edits and chmod); otherwise the shared entry is just
+    removed so the caller can create the file from scratch.
+    """
+    if not is_shared(path):
+        return False
+
+    if not keep_content:
+        os.unlink(path)
+        return True
+
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.cow.', dir=directory)
+    os.close(fd)
+    try:
+        shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+
+class Workspace:
+    """Copy-on-write clone of a directory tree"""
+
+    MODES = ("auto", "reflink", "hardlink", "copy")
+
+    def __init__(self, source, root):
+        self.source = source
+        self.root = root
+        self.stats = {"reflinked": 0, "hardlinked": 0, "copied": 0,
+                      "symlinks": 0, "directories": 0}
+
+    def create(self, mode="auto"):
+        """Populate root from source; mode is auto, reflink, hardlink or copy"""
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown workspace mode: {mode}")
+        if not os.path.isdir(self.source):
+            raise FileNotFoundError(errno.ENOENT, "Workspace source not found", self.source)
+
+        strategy = mode
+        directories = []
+
+        for dirpath, dirnames, filenames in os.walk(self.source):
+            rel_dir = os.path.relpath(dirpath, self.source)
+            target_dir = os.path.normpath(os.path.join(self.root, rel_dir))
+            os.makedirs(target_dir, exist_ok=True)
+            directories.append((dirpath, target_dir))
+            self.stats["directories"] += 1
+
+            # os.walk lists symlinks to directories with the directories
+            for name in dirnames + filenames:
+                src = os.path.join(dirpath, name)
+                if os.path.islink(src):
+                    os.symlink(os.readlink(src), os.path.join(target_dir, name))
+                    self.stats["symlinks"] += 1
+                    if name in dirnames:
+                        dirnames.remove(name)
+            for name in filenames:
+                src = os.path.join(dirpath, name)
+                if not os.path.islink(src):
+                    strategy = self._clone(src, os.path.join(target_dir, name), strategy)
+
+        # Directory metadata last, once nothing else is written into them
+        for src_dir, target_dir in reversed(directories):
+            shutil.copystat(src_dir, target_dir)
+
+        return self.stats
+
+    def _clone(self, src, dst, strategy):
+        """Clone one file; returns the strategy to use for the next one"""
+        if strategy in ("auto", "reflink"):
+            try:
+                reflink(src, dst)
+                self.stats["reflinked"] += 1
+                return strategy
+            except OSError as e:
+                if strategy == "reflink" or e.errno not in _UNSUPPORTED:
+                    raise
+                strategy = "hardlink"
+
+        if strategy == "hardlink":
+            try:
+                os.link(src, dst)
+                self.stats["hardlinked"] += 1
+                return strategy
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+
+        shutil.copy2(src, dst)
+        self.stats["copied"] += 1
+        return strategy
+
+    def private_bytes(self):
+        """Bytes in files that no longer share an inode with source
+
+        Only meaningful for hardlink workspaces; reflinked files have their
+        own inode from the start even though their blocks are shared.
+        """
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not os.path.islink(path) and not is_shared(path):
+                    total += os.lstat(path).st_size
+        return total